@@ -30,7 +30,8 @@ from src.api_service import api_bp, set_pipeline_manager
 from src.decode.decode_pipeline import DecodePipeline
 from src.encode.encode_pipeline import EncodePipeline
 from src.hidden.hidden_pipeline import HiddenPipeline
-from async_d import Monitor, PipelineAnalyser, Pipeline
+from src.data_structure import Survey
+from async_d import Monitor, PipelineAnalyser, Autoscaler, Tracer, Pipeline, Journal
 from src.database.mongo_manager import get_mongo_manager
 from src.common_service.auth.tencent_sms import get_sms_client
 
@@ -168,7 +169,7 @@ class Application:
             CORS(self.app)
         
         # 初始化数据库和JWT
-        from src.common_service.models import db
+        from src.common_service.models import db, upgrade_schema
         db.init_app(self.app)
         
         # 初始化JWT
@@ -191,6 +192,8 @@ class Application:
             try:
                 # 创建所有表（默认会检查表是否已存在，避免重复创建）
                 db.create_all()
+                # create_all不修改已存在的表，补上新增的列
+                upgrade_schema()
                 self.logger.info("数据库表已创建/验证")
                     
             except Exception as e:
@@ -204,6 +207,8 @@ class Application:
         # 初始化组件
         self.pipelines: Dict[str, EntirePipeline] = {}
         self.pipeline_monitor = None
+        self.journals: Dict[str, Journal] = {}
+        self.resumed_task_ids = []
         self.pipeline_task_manager = None
         self.task_manager = None
         
@@ -259,6 +264,10 @@ class Application:
             each_query_result=self.config.pipeline.search_each_query_result
         )
         
+        # 重启前未完成的任务已由检查点恢复，继续监控其完成状态
+        if self.resumed_task_ids:
+            self.pipeline_task_manager.resume_tasks(self.resumed_task_ids)
+        
         # 设置API服务的Pipeline管理器
         set_pipeline_manager(self.pipeline_task_manager)
         
@@ -277,11 +286,39 @@ class Application:
             pipeline_analyser = PipelineAnalyser()
             pipeline_analyser.register(pipeline)
             
+            # 根据队列积压自动伸缩各节点的worker数量
+            autoscaler = Autoscaler()
+            autoscaler.register(pipeline)
+            
+            # 分析器和伸缩器都是单例，只向监控器注册一次
             if self.pipeline_monitor is None:
                 self.pipeline_monitor = Monitor(report_interval=60)
-            self.pipeline_monitor.register(pipeline_analyser)
+                self.pipeline_monitor.register(pipeline_analyser, autoscaler)
+            
+            # 记录每个Survey在节点、模块和请求上的耗时瀑布图
+            if self.config.pipeline.trace_dir:
+                tracer = Tracer(output_dir=self.config.pipeline.trace_dir)
+                tracer.register(pipeline)
+                if tracer not in self.pipeline_monitor.registered_analysers:
+                    self.pipeline_monitor.register(tracer)
+            
+            # 记录各节点完成后的在途Survey，重启后从最后完成的节点继续
+            journal = None
+            if self.config.pipeline.journal_dir:
+                # 只记录Survey，由Survey拆出的章节随Survey一起恢复
+                journal = Journal(
+                    os.path.join(self.config.pipeline.journal_dir, f"{lang}.db"),
+                    key=lambda data: data.task_id if isinstance(data, Survey) else None,
+                )
+                journal.register(pipeline)
+                self.journals[lang] = journal
             
             pipeline.start()
+            if journal:
+                resumed_task_ids = journal.resume()
+                if resumed_task_ids:
+                    self.logger.info(f"{lang} pipeline 从检查点恢复了 {len(resumed_task_ids)} 个任务")
+                self.resumed_task_ids.extend(resumed_task_ids)
             self.pipelines[lang] = pipeline
             self.logger.info(f"{lang} pipeline 已启动.")
 
@@ -343,6 +380,9 @@ class Application:
                 except Exception as e:
                     self.logger.error(f"关闭 {lang} pipeline 时出错: {str(e)}")
         
+        for journal in self.journals.values():
+            journal.close()
+        
         # 清理任务管理器
         if self.task_manager:
             self.logger.info("正在清理任务管理器...")
@@ -19,9 +19,15 @@ except FileNotFoundError:
     ASYNC_D_CONFIG = {}
 
 from .node import Node, decorator
+from .shared_copy import shared_deepcopy
+from .scheduler import FairQueue
+from .executor import run_in_process
+from .journal import Journal
+from .trace import trace_span, bind_trace
+from .cancel import cancel, is_cancelled, check_cancelled
 from .node_group.pipeline import Pipeline
 from .node_group.sequential import Sequential
-from .analyser import Analyser, Monitor, PipelineAnalyser
+from .analyser import Analyser, Monitor, PipelineAnalyser, Autoscaler, Tracer
 
 __all__ = [
     "Node",
@@ -30,5 +36,16 @@ __all__ = [
     "Analyser",
     "Monitor",
     "PipelineAnalyser",
+    "Autoscaler",
+    "Tracer",
     "decorator",
+    "shared_deepcopy",
+    "FairQueue",
+    "run_in_process",
+    "Journal",
+    "trace_span",
+    "bind_trace",
+    "cancel",
+    "is_cancelled",
+    "check_cancelled",
 ]
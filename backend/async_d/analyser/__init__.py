@@ -4,5 +4,7 @@ gevent.monkey.patch_all()
 from .monitor import Monitor
 from .analyser import Analyser
 from .pipeline_analyser import PipelineAnalyser
+from .autoscaler import Autoscaler
+from .tracer import Tracer
 
-__all__ = ["Monitor", "Analyser", "PipelineAnalyser"]
+__all__ = ["Monitor", "Analyser", "PipelineAnalyser", "Autoscaler", "Tracer"]
@@ -0,0 +1,121 @@
+import math
+import logging
+
+import gevent
+from tabulate import tabulate
+
+from .analyser import Analyser
+from .pipeline_analyser import PipelineAnalyser
+
+logger = logging.getLogger(__name__)
+
+
+class Autoscaler(Analyser):
+    """
+    Grows and shrinks the worker pool of each node from its queue depth,
+    in-flight count and downstream backpressure, within the node's
+    [min_worker_num, max_worker_num] bounds.
+
+    The average execution time recorded by PipelineAnalyser is used to estimate
+    how many workers are needed to drain the queue within `target_wait` seconds.
+    """
+
+    def __init__(self, interval=5, target_wait=30):
+        self.node_groups = []
+        self.interval = interval
+        self.target_wait = target_wait
+        self.scale_task = None
+        self.last_scale = {}
+
+    def register(self, node_group):
+        if node_group not in self.node_groups:
+            self.node_groups.append(node_group)
+
+    def start(self):
+        if self.scale_task is None:
+            self.scale_task = gevent.spawn(self._scale_loop)
+
+    def _scale_loop(self):
+        while True:
+            gevent.sleep(self.interval)
+            for node in self._scalable_nodes():
+                try:
+                    self.scale(node)
+                except Exception as e:
+                    logger.error(f"Autoscale node {node.__name__} failed: {e}")
+
+    def _scalable_nodes(self):
+        from ..node import Node
+
+        def find_nodes(node_group):
+            for node in node_group.all_nodes.values():
+                if isinstance(node, Node):
+                    if node.min_worker_num < node.max_worker_num:
+                        yield node
+                else:
+                    yield from find_nodes(node)
+
+        for node_group in self.node_groups:
+            yield from find_nodes(node_group)
+
+    def scale(self, node):
+        if not node.is_start:
+            return
+        old_worker_num = node.worker_num
+        new_worker_num = node.scale_workers(self.desired_worker_num(node))
+        if new_worker_num != old_worker_num:
+            self.last_scale[node.__name__] = (old_worker_num, new_worker_num)
+            logger.info(
+                f"Autoscale node {node.__name__}: {old_worker_num} -> {new_worker_num} workers"
+            )
+
+    def desired_worker_num(self, node):
+        queue_depth = node.src_queue.qsize()
+        in_flight = len(node.executing_data_queue)
+        worker_num = node.worker_num
+
+        if queue_depth > 0 and self._is_backpressured(node):
+            # the downstream is full, more workers would only block on putting data
+            return worker_num
+
+        avg_exec_time = PipelineAnalyser().get_avg_exec_time(node)
+        if avg_exec_time:
+            # workers needed to drain the queue within target_wait, besides the busy ones
+            backlog_workers = math.ceil(queue_depth * avg_exec_time / self.target_wait)
+        else:
+            backlog_workers = queue_depth
+        desired = in_flight + backlog_workers
+
+        if desired < worker_num:
+            if queue_depth > 0:
+                return worker_num
+            # shrink by half of the idle workers at a time to avoid oscillation
+            desired = worker_num - max(1, (worker_num - desired) // 2)
+        return desired
+
+    def _is_backpressured(self, node):
+        for dst_node in node.dst_nodes.values():
+            while dst_node.head is not dst_node:
+                dst_node = dst_node.head
+            if dst_node.src_queue.full():
+                return True
+        return False
+
+    def report(self) -> str:
+        headers = ["Name", "Workers", "Range", "Queue", "Exec", "Last Scale"]
+        table = []
+        for node in self._scalable_nodes():
+            last_scale = self.last_scale.get(node.__name__)
+            table.append(
+                [
+                    node.__name__,
+                    node.worker_num,
+                    f"{node.min_worker_num}-{node.max_worker_num}",
+                    node.src_queue.qsize(),
+                    len(node.executing_data_queue),
+                    f"{last_scale[0]} -> {last_scale[1]}" if last_scale else "N/A",
+                ]
+            )
+        string = "Autoscaler Report"
+        string += "\n" + tabulate(table, headers, tablefmt="grid")
+        return string
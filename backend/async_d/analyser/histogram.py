@@ -0,0 +1,56 @@
+class LatencyHistogram:
+    """
+    HDR-style log-linear histogram of latencies.
+
+    Values are recorded in microseconds and bucketed by their leading
+    `significant_bits` bits, so each bucket spans at most 1 / 2**(significant_bits - 1)
+    of its value (< 2% with the default 7 bits) whatever the magnitude. The
+    buckets are sparse, a histogram from 1us to 1 hour holds a few thousand
+    counters at most, and recording is O(1).
+    """
+
+    def __init__(self, significant_bits=7):
+        self.significant_bits = significant_bits
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        value = max(int(seconds * 1e6), 0)
+        shift = max(value.bit_length() - self.significant_bits, 0)
+        bucket = (shift, value >> shift)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent):
+        """
+        The value below which `percent`% of the records fall, in seconds, None if empty.
+        """
+        if self.count == 0:
+            return None
+        rank = max(percent / 100 * self.count, 1)
+        seen = 0
+        for shift, mantissa in sorted(self.counts):
+            seen += self.counts[(shift, mantissa)]
+            if seen >= rank:
+                # the upper bound of the bucket, never under-report the tail
+                value = ((mantissa + 1) << shift) - 1
+                return min(value / 1e6, self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max if self.count else None,
+        }
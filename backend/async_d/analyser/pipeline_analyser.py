@@ -2,123 +2,211 @@ import time
 import functools
 import logging
 from gevent.lock import Semaphore
-from collections import defaultdict
 from tabulate import tabulate
 
 from .analyser import Analyser
+from .histogram import LatencyHistogram
 
 logger = logging.getLogger(__name__)
 
 
 class PipelineAnalyser(Analyser):
 
-    class FuncInfo:
-        def __init__(self, func):
-            self.func = func
+    class NodeInfo:
+        def __init__(self, node):
+            self.node = node
+            self.lock = Semaphore(1)
             self.exec_count = 0
             self.exec_time = 0
             self.interval_exec_count = 0
             self.interval_exec_time = 0
+            self.error_count = 0
+            self.exec_latency = LatencyHistogram()
+            # from putting into the node to taking out by a worker
+            self.queue_wait = LatencyHistogram()
 
     def __init__(self):
-        self.node_group = None
-        self.node_executing_count = {}
-        self.func_info = {}
-        self.func_lock = defaultdict(Semaphore)
+        self.node_groups = []
+        self.node_info = {}  # node: NodeInfo
 
-    def start(self):
+    def register(self, node_group):
+        """
+        Registers a node group, should be called before the group starts
+        as the decorators are set up when the nodes start.
+        """
         from ..node import Node
 
         def add_decorator(node_group):
             for node in node_group.all_nodes.values():
                 if isinstance(node, Node):
-                    self.func_info[node.__name__] = self.FuncInfo(node._proc_data)
-                    node.add_proc_decorator(self.decorator)
+                    info = self.NodeInfo(node)
+                    self.node_info[node] = info
+                    node.track_enqueue_time()
+                    node.add_get_decorator(self.queue_wait_decorator(info))
+                    node.add_proc_decorator(self.exec_time_decorator(info))
                 else:
                     add_decorator(node)
 
-        add_decorator(self.node_group)
-
-    def decorator(self, func):
-        @functools.wraps(func)
-        def exec_time_wrapper(*args, **kwargs):
-            func_name = func.__name__
-            func_info = self.func_info[func_name]
-
-            start_time = time.perf_counter()
-            result = func(*args, **kwargs)
-            end_time = time.perf_counter()
-
-            exec_time = end_time - start_time
-            with self.func_lock[func_name]:
-                func_info.interval_exec_time += exec_time
-                func_info.interval_exec_count += 1
+        if node_group not in self.node_groups:
+            self.node_groups.append(node_group)
+            add_decorator(node_group)
 
-            return result
-
-        return exec_time_wrapper
-
-    def register(self, node_group):
-        self.node_group = node_group
+    def start(self):
+        pass
+
+    def queue_wait_decorator(self, info):
+        def decorator(func):
+            @functools.wraps(func)
+            def queue_wait_wrapper(data):
+                enqueue_time = info.node.pop_enqueue_time(data)
+                if enqueue_time is not None:
+                    info.queue_wait.record(time.monotonic() - enqueue_time)
+                return func(data)
+
+            return queue_wait_wrapper
+
+        return decorator
+
+    def exec_time_decorator(self, info):
+        def decorator(func):
+            @functools.wraps(func)
+            def exec_time_wrapper(*args, **kwargs):
+                start_time = time.perf_counter()
+                result = func(*args, **kwargs)
+                end_time = time.perf_counter()
+
+                exec_time = end_time - start_time
+                with info.lock:
+                    info.interval_exec_time += exec_time
+                    info.interval_exec_count += 1
+                    info.exec_latency.record(exec_time)
+                    if isinstance(result, Exception):
+                        info.error_count += 1
+
+                return result
+
+            return exec_time_wrapper
+
+        return decorator
+
+    def get_avg_exec_time(self, node):
+        """
+        Average execution time of the node function so far, None if never executed.
+        """
+        if node not in self.node_info:
+            return None
+        info = self.node_info[node]
+        with info.lock:
+            exec_count = info.exec_count + info.interval_exec_count
+            exec_time = info.exec_time + info.interval_exec_time
+        if exec_count == 0:
+            return None
+        return exec_time / exec_count
+
+    def get_metrics(self, node_group=None):
+        """
+        Metrics of every node in the node group (all registered groups by default),
+        latencies are in seconds.
+        """
+        node_groups = [node_group] if node_group else self.node_groups
+        metrics = []
+        for node in self._all_nodes(node_groups):
+            info = self.node_info[node]
+            with info.lock:
+                metrics.append(
+                    {
+                        "serial": "-".join(map(str, node.serial_number)),
+                        "name": node.__name__,
+                        "is_running": node.is_start,
+                        "queue_size": node.src_queue.qsize(),
+                        "max_queue_size": node.src_queue.maxsize,
+                        "executing_count": len(node.executing_data_queue),
+                        "worker_num": node.worker_num,
+                        "exec_count": info.exec_count + info.interval_exec_count,
+                        "error_count": info.error_count,
+                        "retry_count": node.retry_count,
+                        "exec_latency": info.exec_latency.snapshot(),
+                        "queue_wait": info.queue_wait.snapshot(),
+                    }
+                )
+        return metrics
 
     def report(self) -> str:
-        from .. import Node
-
-        table = []
+        string = "Pipeline Report"
         headers = [
             "Serial",
             "Name",
-            "Wait",
+            "Queue",
             "Exec",
-            "Speed",
-            "Avg Speed",
+            "Interval Speed",
+            "Total",
+            "Latency p50/p95/p99",
+            "Queue Wait p50/p95/p99",
+            "Errors/Retries",
         ]
 
-        def add_infos(node_group, cur_table):
+        for node_group in self.node_groups:
+            table = []
+            for node in self._all_nodes([node_group]):
+                info = self.node_info[node]
+                with info.lock:
+                    interval_exec_count = info.interval_exec_count
+                    info.exec_count += interval_exec_count
+                    total_exec_count = info.exec_count
+
+                    interval_exec_time = info.interval_exec_time
+                    info.exec_time += interval_exec_time
+                    total_exec_time = info.exec_time
+
+                    info.interval_exec_count = 0
+                    info.interval_exec_time = 0
+
+                name = node.__name__
+                if node.is_start:
+                    name = f"{name} (Running)"
+                else:
+                    name = f"{name} (Finished)"
+
+                table.append(
+                    [
+                        "-".join(map(str, node.serial_number)),
+                        name,
+                        f"{node.src_queue.qsize()}/{node.src_queue.maxsize}",
+                        f"{len(node.executing_data_queue)}/{node.worker_num}",
+                        (
+                            f"{interval_exec_count}/{interval_exec_time:.2f}s, {interval_exec_count / interval_exec_time:.2f}/s"
+                            if interval_exec_time > 0
+                            else "N/A"
+                        ),
+                        (
+                            f"{total_exec_count} in {total_exec_time:.2f}s, avg {total_exec_time / total_exec_count:.2f}s"
+                            if total_exec_count > 0
+                            else "N/A"
+                        ),
+                        self._format_percentiles(info.exec_latency),
+                        self._format_percentiles(info.queue_wait),
+                        f"{info.error_count}/{node.retry_count}",
+                    ]
+                )
+            string += "\n" + tabulate(table, headers, tablefmt="grid")
+        return string
+
+    def _format_percentiles(self, histogram):
+        if histogram.count == 0:
+            return "N/A"
+        return "/".join(
+            f"{histogram.percentile(percent):.2f}s" for percent in [50, 95, 99]
+        )
+
+    def _all_nodes(self, node_groups):
+        from ..node import Node
+
+        def find_nodes(node_group):
             for node in node_group.all_nodes.values():
                 if isinstance(node, Node):
-                    info = self.func_info[node.__name__]
-                    with self.func_lock[node.__name__]:
-                        interval_exec_count = info.interval_exec_count
-                        info.exec_count += interval_exec_count
-                        total_exec_count = info.exec_count
-
-                        interval_exec_time = info.interval_exec_time
-                        info.exec_time += interval_exec_time
-                        total_exec_time = info.exec_time
-
-                        info.interval_exec_count = 0
-                        info.interval_exec_time = 0
-                        
-                    name = node.__name__
-                    if node.is_start:
-                        name = f"{name} (Running)"
-                    else:
-                        name = f"{name} (Finished)"
-                        
-                    cur_table.append(
-                        [
-                            "-".join(map(str, node.serial_number)),
-                            name,
-                            f"{node.src_queue.qsize()}/{node.src_queue.maxsize}",
-                            f"{len(node.executing_data_queue)}/{node.worker_num}",
-                            (
-                                f"{interval_exec_count}/{interval_exec_time:.2f}s, {interval_exec_count / interval_exec_time:.2f}/s"
-                                if interval_exec_time > 0
-                                else "N/A"
-                            ),
-                            (
-                                f"{total_exec_count}/{total_exec_time:.2f}s, {total_exec_time / total_exec_count:.2f}/s"
-                                if total_exec_count > 0
-                                else "N/A"
-                            ),
-                        ]
-                    )
+                    yield node
                 else:
-                    add_infos(node, cur_table)
-
-        add_infos(self.node_group, table)
+                    yield from find_nodes(node)
 
-        string = "Pipeline Report"
-        string += "\n" + tabulate(table, headers, tablefmt="grid")
-        return string
+        for node_group in node_groups:
+            yield from find_nodes(node_group)
@@ -0,0 +1,151 @@
+import os
+import re
+import json
+import time
+import logging
+import functools
+from collections import OrderedDict
+
+from tabulate import tabulate
+
+from .analyser import Analyser
+from ..trace import Span, Trace, trace_context, trace_span
+
+logger = logging.getLogger(__name__)
+
+
+def default_trace_key(data):
+    return getattr(data, "trace_id", None)
+
+
+class Tracer(Analyser):
+    """
+    Records a waterfall of spans for each traced item through the nodes.
+
+    The trace id of the data is given by `key` (the `trace_id` attribute by
+    default), data sharing a trace id (e.g. a survey and the sections split
+    from it) are recorded into one trace. Each node call opens a span, the
+    modules and requests called inside add nested spans through
+    `trace_span`. A trace is exported in the Chrome trace format to
+    `output_dir` when its data reaches a node without output, or when it is
+    evicted as the oldest of more than `max_traces` live traces.
+    """
+
+    def __init__(self, output_dir=None, key=default_trace_key, max_traces=100):
+        self.output_dir = output_dir
+        self.key = key
+        self.max_traces = max_traces
+        self.traces = OrderedDict()  # trace_id: Trace
+        self.node_groups = []
+        self.exported_count = 0
+
+    def register(self, node_group):
+        """
+        Adds the trace decorator to all the nodes of the group, should be called before the group starts.
+        """
+        from ..node import Node
+
+        def add_decorator(node_group):
+            for node in node_group.all_nodes.values():
+                if isinstance(node, Node):
+                    node.add_proc_decorator(self.decorator(node))
+                else:
+                    add_decorator(node)
+
+        if node_group not in self.node_groups:
+            self.node_groups.append(node_group)
+            add_decorator(node_group)
+
+    def start(self):
+        pass
+
+    def decorator(self, node):
+        def trace_decorator(func):
+            @functools.wraps(func)
+            def trace_wrapper(data):
+                if node.batch_size:
+                    return self._trace_batch(node, func, data)
+
+                trace = self.get_trace(self._get_key(data))
+                if trace is None:
+                    return func(data)
+                with trace_context(trace):
+                    with trace_span(node.__name__, category="node") as span:
+                        result = func(data)
+                        if isinstance(result, Exception):
+                            span.args["error"] = str(result)[:200]
+                if node.no_output:
+                    self.finish(trace.trace_id)
+                return result
+
+            return trace_wrapper
+
+        return trace_decorator
+
+    def _trace_batch(self, node, func, batch):
+        # the batch is processed in one call, record the same span into the trace of each data
+        spans = []
+        for data in batch:
+            trace = self.get_trace(self._get_key(data))
+            if trace is not None:
+                span = Span(node.__name__, args={"category": "node", "batch": len(batch)})
+                trace.add_span(span)
+                spans.append((trace, span))
+        result = func(batch)
+        for trace, span in spans:
+            span.finish()
+            if node.no_output:
+                self.finish(trace.trace_id)
+        return result
+
+    def get_trace(self, trace_id):
+        if trace_id is None:
+            return None
+        if trace_id not in self.traces:
+            self.traces[trace_id] = Trace(trace_id)
+            while len(self.traces) > self.max_traces:
+                oldest_id = next(iter(self.traces))
+                logger.warning(f"Too many live traces, export the oldest trace {oldest_id}")
+                self.finish(oldest_id)
+        return self.traces[trace_id]
+
+    def finish(self, trace_id):
+        trace = self.traces.pop(trace_id, None)
+        if trace is None or not self.output_dir:
+            return trace
+        try:
+            self.export(trace, self._trace_file(trace_id))
+        except Exception as e:
+            logger.error(f"Export trace {trace_id} failed: {e}")
+        return trace
+
+    def export(self, trace, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(trace.to_chrome_trace(), f, ensure_ascii=False)
+        self.exported_count += 1
+        logger.info(f"Export trace {trace.trace_id} to {path}")
+
+    def report(self) -> str:
+        headers = ["Trace", "Spans", "Duration"]
+        table = []
+        now = time.time()
+        for trace_id, trace in list(self.traces.items()):
+            duration = now - trace.spans[0].start_time if trace.spans else 0
+            table.append([str(trace_id)[:60], len(trace.spans), f"{duration:.2f}s"])
+        string = f"Tracer Report (exported: {self.exported_count})"
+        string += "\n" + tabulate(table, headers, tablefmt="grid")
+        return string
+
+    def _trace_file(self, trace_id):
+        file_name = re.sub(r"[^\w\-]", "_", str(trace_id))[:120]
+        return os.path.join(self.output_dir, f"{file_name}.json")
+
+    def _get_key(self, data):
+        if data is None or isinstance(data, Exception):
+            return None
+        try:
+            return self.key(data)
+        except Exception:
+            return None
@@ -0,0 +1,100 @@
+import time
+import logging
+from collections import OrderedDict, defaultdict
+
+import gevent
+
+from .exceptions import TaskCancelled
+
+logger = logging.getLogger(__name__)
+
+MAX_CANCELLED_NUM = 10000
+
+# cancelled keys in the order of cancellation: cancel time
+_cancelled = OrderedDict()
+# greenlets working for a key, they are killed when the key is cancelled
+_running = defaultdict(set)
+_greenlet_keys = {}
+# the stage (node name) a tracked greenlet runs in, to attribute its work, e.g. LLM usage
+_greenlet_stages = {}
+
+
+def cancel_key(data):
+    """
+    The key data is cancelled by, the task_id of the data by default.
+    """
+    if data is None or isinstance(data, BaseException):
+        return None
+    return getattr(data, "task_id", None)
+
+
+def cancel(key):
+    """
+    Cancels the key: the queued data of the key is dropped when taken out by
+    a node, and the greenlets working for it are killed with TaskCancelled.
+    Returns the number of killed greenlets.
+    """
+    if key is None:
+        return 0
+    _cancelled[key] = time.time()
+    _cancelled.move_to_end(key)
+    while len(_cancelled) > MAX_CANCELLED_NUM:
+        _cancelled.popitem(last=False)
+
+    greenlets = [greenlet for greenlet in _running.get(key, ()) if not greenlet.dead]
+    gevent.killall(greenlets, exception=TaskCancelled(key), block=False)
+    logger.info(f"Cancel {key}, kill {len(greenlets)} running greenlets")
+    return len(greenlets)
+
+
+def is_cancelled(key):
+    return key is not None and key in _cancelled
+
+
+def track(greenlet, key, stage=None):
+    """
+    Records the greenlet as working for the key (in the stage) until it finishes.
+    """
+    if key is None:
+        return
+    _greenlet_keys[greenlet] = key
+    if stage is not None:
+        _greenlet_stages[greenlet] = stage
+    _running[key].add(greenlet)
+    greenlet.link(_untrack)
+
+
+def track_children(greenlets):
+    """
+    The greenlets spawned by a tracked greenlet work for the same key, in the same stage.
+    """
+    key = current_key()
+    stage = current_stage()
+    for greenlet in greenlets:
+        track(greenlet, key, stage)
+
+
+def current_key():
+    return _greenlet_keys.get(gevent.getcurrent())
+
+
+def current_stage():
+    return _greenlet_stages.get(gevent.getcurrent())
+
+
+def check_cancelled():
+    """
+    Raises TaskCancelled if the current greenlet works for a cancelled key.
+    """
+    key = current_key()
+    if is_cancelled(key):
+        raise TaskCancelled(key)
+
+
+def _untrack(greenlet):
+    key = _greenlet_keys.pop(greenlet, None)
+    _greenlet_stages.pop(greenlet, None)
+    if key in _running:
+        _running[key].discard(greenlet)
+        if not _running[key]:
+            del _running[key]
@@ -1,3 +1,6 @@
+from gevent import GreenletExit
+
+
 class NodeStop(Exception):
     pass
 
@@ -15,3 +18,11 @@ class NodeProcessingError(Exception):
         self.func_name = func_name
         self.origin_error = error
         self.stack = stack
+
+
+class TaskCancelled(GreenletExit):
+    """Raised in the greenlets working for a cancelled task, see async_d.cancel."""
+
+    def __init__(self, key=None) -> None:
+        super().__init__(f"Task {key} is cancelled")
+        self.key = key
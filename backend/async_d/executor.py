@@ -0,0 +1,64 @@
+import os
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+from gevent.lock import Semaphore
+
+from . import ASYNC_D_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_process_executor = None
+_process_executor_lock = Semaphore(1)
+
+
+def get_process_executor():
+    """
+    Returns the process pool shared by all the nodes, created on first use.
+
+    The pool size and start method are read from ASYNC_D_CONFIG
+    ("process_worker_num", "process_start_method"). The workers start from a
+    fresh interpreter (forkserver, spawn where it is not available) since
+    forking the application would copy the gevent hub, its threadpool
+    threads and the locks they hold into the workers. "fork" is opt-in.
+    """
+    global _process_executor
+    with _process_executor_lock:
+        if _process_executor is None:
+            max_workers = ASYNC_D_CONFIG.get("process_worker_num", os.cpu_count())
+            start_method = ASYNC_D_CONFIG.get("process_start_method", _default_start_method())
+            _process_executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context(start_method),
+            )
+            logger.info(
+                f"Process executor start, worker_num: {max_workers}, start_method: {start_method}"
+            )
+        return _process_executor
+
+
+def _default_start_method():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return "forkserver"
+    return "spawn"
+
+
+def get_executor(executor):
+    if executor is None or isinstance(executor, Executor):
+        return executor
+    elif executor == "process":
+        return get_process_executor()
+    else:
+        raise ValueError(f"Unknown executor: {executor}")
+
+
+def run_in_process(func, *args, **kwargs):
+    """
+    Runs a CPU-bound function in the shared process pool and waits for the result.
+
+    Only the current greenlet waits, the hub keeps serving the other workers.
+    func and its arguments are pickled, so func should be a module level
+    function and the arguments should be as small as possible.
+    """
+    return get_process_executor().submit(func, *args, **kwargs).result()
@@ -0,0 +1,283 @@
+import os
+import time
+import pickle
+import sqlite3
+import logging
+import functools
+
+import gevent
+from gevent.lock import Semaphore
+
+logger = logging.getLogger(__name__)
+
+
+def default_key(data):
+    return getattr(data, "task_id", None)
+
+
+class Journal:
+    """
+    Checkpoints the data leaving each node into a SQLite file, so the data in
+    flight could be resumed after a restart.
+
+    Each output of a node is kept in one row until every destination it was
+    put to has processed it, so a data live in several branches at once
+    (e.g. a survey sent both to the output and to the next iteration) keeps
+    one row per branch, and a branch ending (a node without output or a
+    failure) does not drop the others. On resume the output of each row is
+    put to the destinations of its node again, which repeats the routing of
+    the original run.
+
+    Data without a key (key returns None) is not journaled, e.g. the sections
+    split from a survey, it is recovered from the checkpoint of the data it
+    was split from: that row is kept until a node outputs the data with the
+    key again without a journaled input (e.g. the survey assembled from its
+    sections), or the node keeping it gets a later version of the data.
+    """
+
+    def __init__(self, path, key=default_key):
+        self.path = path
+        self.key = key
+        self.node_groups = []
+        self.db_lock = Semaphore(1)
+        self.pending = {}  # row id: destinations yet to process the output, +1 while putting it
+        self._output_rows = {}  # id(output): (output, row id), until the output is put
+        self._putting = {}  # greenlet: row id of the output it is putting
+        self._sources = {}  # (node, id(data)): [(data, row id)] of the data put to the node
+        self._parked = {}  # key: [(node, row id)] of the branches going on without the key
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS branch_checkpoint ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, node_id TEXT, payload BLOB, update_time REAL)"
+        )
+        self.conn.commit()
+
+    def register(self, node_group):
+        """
+        Adds the journal decorator to all the nodes of the group, should be called before the group starts.
+        """
+        from .node import Node
+
+        def add_decorator(node_group):
+            for node in node_group.all_nodes.values():
+                if isinstance(node, Node):
+                    node.add_proc_decorator(self.decorator(node))
+                    node.add_put_decorator(self.put_decorator)
+                    node.put = self._track_put(node, node.put)
+                else:
+                    add_decorator(node)
+
+        add_decorator(node_group)
+        self.node_groups.append(node_group)
+
+    def decorator(self, node):
+        def journal_decorator(func):
+            @functools.wraps(func)
+            def journal_wrapper(data):
+                result = func(data)
+                try:
+                    self._record(node, data, result)
+                except Exception as e:
+                    logger.error(f"Journal node {node.__name__} failed: {e}")
+                return result
+
+            return journal_wrapper
+
+        return journal_decorator
+
+    def put_decorator(self, put_data):
+        @functools.wraps(put_data)
+        def journal_put_wrapper(data):
+            output_row = self._output_rows.pop(id(data), None)
+            if output_row is None or output_row[0] is not data:
+                return put_data(data)
+            row_id = output_row[1]
+            current = gevent.getcurrent()
+            self._putting[current] = row_id
+            try:
+                return put_data(data)
+            finally:
+                self._putting.pop(current, None)
+                # the output is routed to no destination or processed by all of them already
+                self._release(row_id)
+
+        return journal_put_wrapper
+
+    def _track_put(self, node, put):
+        @functools.wraps(put)
+        def journal_track_put(data):
+            row_id = self._putting.get(gevent.getcurrent())
+            if row_id is not None:
+                self.pending[row_id] += 1
+                self._sources.setdefault((node, id(data)), []).append((data, row_id))
+            return put(data)
+
+        return journal_track_put
+
+    def _record(self, node, data, result):
+        inputs = data if node.batch_size else [data]
+        sources = [(self._get_key(one_data), self._pop_source(node, one_data)) for one_data in inputs]
+        if node.no_output or isinstance(result, Exception):
+            # the branch finishes (or fails) in this node, nothing to resume
+            for _, row_id in sources:
+                if row_id is not None:
+                    self._release(row_id)
+            return
+
+        output_keys = []
+        outputs = result if node.batch_size else [result]
+        for output in outputs or []:
+            key = self._get_key(output)
+            if key is not None:
+                row_id = self.checkpoint(key, self._node_id(node), output)
+                self._output_rows[id(output)] = (output, row_id)
+                output_keys.append(key)
+
+        for key, row_id in sources:
+            if row_id is None:
+                continue
+            # the node handles a later version of the data, what it kept before is stale
+            self._release_parked(key, lambda parked_node: parked_node is node)
+            if output_keys:
+                # the branch continues from the new rows
+                self._release(row_id)
+            else:
+                # the data goes on without a key (e.g. split into sections), keep
+                # the row until the data is put together with its key again
+                self._parked.setdefault(key, []).append((node, row_id))
+        if not any(row_id is not None for _, row_id in sources):
+            for key in output_keys:
+                self._release_parked(key, lambda parked_node: True, count=1)
+
+    def checkpoint(self, key, node_id, data):
+        """
+        Saves the output of the node, returns the id of its row.
+        """
+        # pickled on the hub, the other branches of the data can not change it meanwhile
+        payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        row_id = self._execute(
+            "INSERT INTO branch_checkpoint (key, node_id, payload, update_time) VALUES (?, ?, ?, ?)",
+            (str(key), node_id, payload, time.time()),
+        )
+        self.pending[row_id] = 1
+        return row_id
+
+    def discard(self, key):
+        """
+        Removes all the rows of the key, e.g. the task is cancelled.
+        """
+        self._execute("DELETE FROM branch_checkpoint WHERE key = ?", (str(key),))
+
+    def resume(self):
+        """
+        Puts the journaled data back to the registered node groups, should be called after they start.
+
+        Returns the keys of the resumed data.
+        """
+        nodes = {self._node_id(node): node for node in self._all_nodes()}
+        with self.db_lock:
+            rows = self.conn.execute(
+                "SELECT id, key, node_id, payload FROM branch_checkpoint ORDER BY id"
+            ).fetchall()
+
+        resumed_keys = []
+        for row_id, key, node_id, payload in rows:
+            node = nodes.get(node_id)
+            if node is None:
+                logger.warning(f"Journal node {node_id} not found, discard data {key}")
+                self._delete(row_id)
+                continue
+            try:
+                data = pickle.loads(payload)
+            except Exception as e:
+                logger.error(f"Journal load data {key} failed: {e}")
+                self._delete(row_id)
+                continue
+            self.pending[row_id] = 1
+            self._output_rows[id(data)] = (data, row_id)
+            # putting may block on the full queues of the destinations
+            gevent.spawn(node._put_data, data)
+            if key not in resumed_keys:
+                resumed_keys.append(key)
+            logger.info(f"Resume data {key} after node {node_id}")
+        return resumed_keys
+
+    def close(self):
+        with self.db_lock:
+            self.conn.close()
+
+    def _release(self, row_id):
+        self.pending[row_id] -= 1
+        if self.pending[row_id] == 0:
+            del self.pending[row_id]
+            self._delete(row_id)
+
+    def _release_parked(self, key, match, count=None):
+        parked = self._parked.get(key, [])
+        released = [item for item in parked if match(item[0])][:count]
+        for item in released:
+            parked.remove(item)
+        if not parked:
+            self._parked.pop(key, None)
+        # releasing writes to the disk and yields, the lists are updated before
+        for _, row_id in released:
+            self._release(row_id)
+
+    def _delete(self, row_id):
+        self._execute("DELETE FROM branch_checkpoint WHERE id = ?", (row_id,))
+
+    def _pop_source(self, node, data):
+        sources = self._sources.get((node, id(data)))
+        if not sources:
+            return None
+        for i, (source_data, row_id) in enumerate(sources):
+            if source_data is data:
+                del sources[i]
+                break
+        else:
+            return None
+        if not sources:
+            del self._sources[(node, id(data))]
+        return row_id
+
+    def _execute(self, sql, params):
+        def execute():
+            cursor = self.conn.execute(sql, params)
+            self.conn.commit()
+            return cursor.lastrowid
+
+        with self.db_lock:
+            # keep the disk io off the hub
+            return gevent.get_hub().threadpool.apply(execute)
+
+    def _all_nodes(self):
+        from .node import Node
+
+        def find_nodes(node_group):
+            for node in node_group.all_nodes.values():
+                if isinstance(node, Node):
+                    yield node
+                else:
+                    yield from find_nodes(node)
+
+        for node_group in self.node_groups:
+            yield from find_nodes(node_group)
+
+    def _keys(self, inputs):
+        keys = [self._get_key(data) for data in inputs]
+        return [key for key in keys if key is not None]
+
+    def _get_key(self, data):
+        if data is None or isinstance(data, Exception):
+            return None
+        try:
+            return self.key(data)
+        except Exception:
+            return None
+
+    def _node_id(self, node):
+        return ".".join(map(str, node.serial_number)) + ": " + node.__name__
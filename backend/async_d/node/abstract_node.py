@@ -1,6 +1,8 @@
 import logging
 from abc import ABC, abstractmethod
 
+from gevent.event import Event
+
 logger = logging.getLogger(__name__)
 
 
@@ -13,6 +15,10 @@ class AbstractNode(ABC):
         self.head = None
         self.tail = None
         self.is_start = False
+        # set once the node has drained and all of its workers exited,
+        # observers are notified through the registered end callbacks
+        self.end_event = Event()
+        self._end_callbacks = []
 
     def set_name(self, name):
         self.__name__ = name
@@ -20,6 +26,26 @@ class AbstractNode(ABC):
     def set_serial_number(self, serial_number):
         self.serial_number = serial_number
 
+    @property
+    def is_end(self):
+        return self.end_event.is_set()
+
+    def add_end_callback(self, callback):
+        if callback not in self._end_callbacks:
+            self._end_callbacks.append(callback)
+
+    def wait_end(self, timeout=None):
+        return self.end_event.wait(timeout)
+
+    def _notify_end(self):
+        if self.end_event.is_set():
+            return
+        self.is_start = False
+        self.end_event.set()
+        logger.info(f"{self.__name__} end")
+        for callback in self._end_callbacks:
+            callback(self)
+
     @abstractmethod
     def start(self):
         pass
@@ -1,3 +1,4 @@
+import time
 import logging
 import traceback
 import functools
@@ -6,7 +7,7 @@ from typing import Iterable
 import gevent
 import copy
 from gevent import sleep, spawn
-from gevent.queue import Queue
+from gevent.queue import Queue, Empty, Full
 from tenacity import (
     retry,
     retry_if_not_exception_type,
@@ -18,7 +19,10 @@ from tenacity import (
 from .decorator import *
 
 from .. import ASYNC_D_CONFIG
-from ..exceptions import NodeProcessingError, NodeStop
+from ..exceptions import NodeProcessingError, NodeStop, TaskCancelled
+from ..cancel import cancel_key, is_cancelled, track
+from ..executor import get_executor
+from ..shared_copy import shared_deepcopy
 from .abstract_node import AbstractNode
 from .node_link import NodeLink
 
@@ -38,7 +42,14 @@ class Node(AbstractNode, NodeLink):
         discard_none_output=False,
         skip_error=True,
         timeout=None,
-        put_deepcopy_data=False
+        put_deepcopy_data=False,
+        put_shared_data=False,
+        batch_size=None,
+        batch_timeout=None,
+        scheduler=None,
+        min_worker_num=None,
+        max_worker_num=None,
+        executor=None,
     ) -> None:
         super().__init__()
         self.timeout = timeout if timeout else ASYNC_D_CONFIG.get("timeout", None)
@@ -48,13 +59,33 @@ class Node(AbstractNode, NodeLink):
         self.queue_size = (
             queue_size if queue_size else ASYNC_D_CONFIG.get("queue_size", 1)
         )
+        # bounds for the autoscaler, the worker pool is fixed if not set
+        self.min_worker_num = min_worker_num if min_worker_num else self.worker_num
+        self.max_worker_num = max_worker_num if max_worker_num else self.worker_num
+        assert (
+            self.min_worker_num <= self.worker_num <= self.max_worker_num
+        ), f"Node {proc_func.__name__} worker_num should be in [min_worker_num, max_worker_num]"
+        # micro-batching: proc_func receives a list of at most batch_size items,
+        # collected within batch_timeout ms after the first item arrives
+        self.batch_size = batch_size
+        self.batch_timeout = (
+            batch_timeout
+            if batch_timeout is not None
+            else ASYNC_D_CONFIG.get("batch_timeout", 0)
+        )
+        assert not (
+            no_input and batch_size
+        ), f"Node {proc_func.__name__} has no input, batch_size should not be set"
 
         self.__name__ = proc_func.__name__
         self.head = self
         self.tail = self
         self.is_start = False
 
-        self.src_queue = Queue(self.queue_size)
+        # scheduler is a queue factory taking the queue size, e.g. a partial of FairQueue
+        self.src_queue = (
+            scheduler(self.queue_size) if scheduler else Queue(self.queue_size)
+        )
         self.criterias = {}
         self.src_nodes = {}
         self.dst_nodes = {}
@@ -66,6 +97,12 @@ class Node(AbstractNode, NodeLink):
         self.discard_none_output = discard_none_output
         self.skip_error = skip_error
         self.put_deepcopy_data = put_deepcopy_data
+        # copy-on-write handoff: the last destination takes the original data,
+        # the others get a copy sharing the immutable parts of the data
+        self.put_shared_data = put_shared_data
+        # "process" or a concurrent.futures.Executor, proc_func runs in it
+        # instead of the worker greenlet, for CPU-bound picklable functions
+        self.executor = executor
         
         # first decorator will first wrap, as the inner decorator
         self.get_decorators = []
@@ -75,6 +112,11 @@ class Node(AbstractNode, NodeLink):
 
         self.tasks = []  # store all worker tasks
         self.executing_data_queue = []
+        self._running_worker_num = 0
+        self._is_ending = False
+        # id(data): (data, time the data was put), only kept once a PipelineAnalyser measures the queue wait
+        self.enqueue_time = None
+        self.retry_count = 0
 
     def start(self):
         """
@@ -87,18 +129,64 @@ class Node(AbstractNode, NodeLink):
         logger.info(
             f"Node {self.__name__} start, src_nodes: {self.src_nodes}, dst_nodes: {self.dst_nodes}"
         )
+        # upstream may have already finished before this node is started
+        self.on_upstream_end()
         return self.tasks
 
     def end(self):
         """
         Signals the end of the pipeline by putting a stop flag in the source queue.
         """
+        if self._is_ending:
+            return
+        self._is_ending = True
         for _ in range(self.worker_num):
             self.src_queue.put(NodeStop())
 
+    def scale_workers(self, worker_num):
+        """
+        Grows or shrinks the worker pool to worker_num, within [min_worker_num, max_worker_num].
+        """
+        worker_num = min(max(worker_num, self.min_worker_num), self.max_worker_num)
+        if not self.is_start or self._is_ending:
+            return self.worker_num
+        self.tasks = [task for task in self.tasks if not task.dead]
+        while self.worker_num < worker_num:
+            self._add_worker()
+        while self.worker_num > worker_num:
+            # the worker which takes the stop flag exits
+            try:
+                self.src_queue.put_nowait(NodeStop())
+            except Full:
+                break
+            self.worker_num -= 1
+        return self.worker_num
+
+    def on_upstream_end(self):
+        """
+        Called by the source nodes when they finish, stop this node once all of them are finished.
+        """
+        if self.is_start and not self._is_ending and self._is_upstream_end():
+            logger.info(f"Node {self.__name__} upstream end")
+            # the stop flags may block on a full queue, do not block the notifier
+            spawn(self.end)
+
     def put(self, data):
+        if self.enqueue_time is not None:
+            # keeping the data alive until it is got, so its id is not reused meanwhile
+            self.enqueue_time[id(data)] = (data, time.monotonic())
         self.src_queue.put(data)
 
+    def track_enqueue_time(self):
+        if self.enqueue_time is None:
+            self.enqueue_time = {}
+
+    def pop_enqueue_time(self, data):
+        if self.enqueue_time is None:
+            return None
+        _, enqueue_time = self.enqueue_time.pop(id(data), (None, None))
+        return enqueue_time
+
     def connect(self, node, criteria=None):
         self.set_dst_node(node)
         node.set_src_node(self)
@@ -168,14 +256,24 @@ class Node(AbstractNode, NodeLink):
         self.proc_decorators = new_decorators
 
     def _spawn_workers(self):
+        self._running_worker_num = self.worker_num
         for i in range(self.worker_num):
             task = spawn(self._func_wrapper, i)
             self.tasks.append(task)
 
-        self.get_data_generator = self._get_data()
+        if self.batch_size:
+            self.get_data_generator = self._get_batch_data()
+        else:
+            self.get_data_generator = self._get_data()
         self.is_start = True
         return self.tasks
 
+    def _add_worker(self):
+        self.worker_num += 1
+        self._running_worker_num += 1
+        task = spawn(self._func_wrapper, len(self.tasks))
+        self.tasks.append(task)
+
     def _func_wrapper(self, task_id):
         """
         Wraps the processing function and handles concurrency.
@@ -190,32 +288,68 @@ class Node(AbstractNode, NodeLink):
                     if isinstance(data, NodeStop):
                         raise NodeStop()
                     self.executing_data_queue.append(data)
-                result = self._proc_data(data)
-                self._put_data(result)
+                if self.batch_size:
+                    self._proc_batch_data(data)
+                else:
+                    result = self._proc_cancellable_data(data)
+                    if not isinstance(result, TaskCancelled):
+                        self._put_data(result)
             except NodeStop:
                 logger.info(f"Node {self.__name__} No. {task_id} stop")
                 break
             finally:
                 if data in self.executing_data_queue:
                     self.executing_data_queue.remove(data)
-            if task_id == 0 and self._is_upstream_end():
-                logger.info(f"Node {self.__name__} No. {task_id} upstream end")
-                self.end()
-                break
             sleep(0)
-        if all(task.ready() for task in self.tasks if task != gevent.getcurrent()):
+        self._running_worker_num -= 1
+        if self._running_worker_num == 0:
             logger.info(f"Node {self.__name__} No. {task_id} all other tasks finished")
-            self.is_start = False
-            
+            self._notify_end()
+
+    def _notify_end(self):
+        super()._notify_end()
+        self._notify_downstream_end()
+
     def _get_data(self):
         while self.is_start:
             data = self.src_queue.get()
             yield from self._get_one_data(data)
         yield NodeStop()
 
+    def _get_batch_data(self):
+        batch = []
+        deadline = None
+        while self.is_start:
+            try:
+                if not batch:
+                    data = self.src_queue.get()
+                elif (remaining := deadline - time.monotonic()) > 0:
+                    data = self.src_queue.get(timeout=remaining)
+                else:
+                    data = self.src_queue.get_nowait()
+            except Empty:
+                yield batch
+                batch = []
+                continue
+            for one_data in self._get_one_data(data):
+                if isinstance(one_data, NodeStop):
+                    if batch:
+                        yield batch
+                        batch = []
+                    yield one_data
+                    continue
+                batch.append(one_data)
+                if len(batch) == 1:
+                    deadline = time.monotonic() + self.batch_timeout / 1000
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = []
+        yield NodeStop()
+
     def _get_one_data(self, data):
         if isinstance(data, NodeStop):
             yield NodeStop()
+            return
         if self.is_data_iterable:
             assert isinstance(
                 data, Iterable
@@ -231,27 +365,77 @@ class Node(AbstractNode, NodeLink):
         """
         if self.discard_none_output and data is None:
             return
-        for node in self.dst_nodes.values():
-            if not self.criterias.get(node.__name__, None) or self.criterias[
-                node.__name__
-            ](data):
-                if self.put_deepcopy_data:
-                    node.put(copy.deepcopy(data))
-                else:
-                    node.put(data)
+        dst_nodes = [
+            node
+            for node in self.dst_nodes.values()
+            if not self.criterias.get(node.__name__, None)
+            or self.criterias[node.__name__](data)
+        ]
+        for i, node in enumerate(dst_nodes):
+            if self.put_deepcopy_data:
+                node.put(copy.deepcopy(data))
+            elif self.put_shared_data and i < len(dst_nodes) - 1:
+                node.put(shared_deepcopy(data))
+            else:
+                node.put(data)
+
+    def _proc_cancellable_data(self, data):
+        """
+        Processes the data in a child greenlet tracked by its cancel key, so
+        cancelling the key kills the processing but not the worker.
+        """
+        key = cancel_key(data)
+        if key is None:
+            return self._proc_data(data)
+        if is_cancelled(key):
+            logger.info(f"Node {self.__name__} drop the data of cancelled {key}")
+            return TaskCancelled(key)
+        task = spawn(self._proc_data, data)
+        track(task, key, stage=self.__name__)
+        result = task.get()
+        if isinstance(result, TaskCancelled):
+            logger.info(f"Node {self.__name__} cancelled the processing of {key}")
+        return result
+
+    def _proc_batch_data(self, batch):
+        """
+        Processes a batch with one call of proc_func and fans the results out one by one.
+        """
+        cancelled = [data for data in batch if is_cancelled(cancel_key(data))]
+        if cancelled:
+            logger.info(f"Node {self.__name__} drop {len(cancelled)} data of cancelled tasks")
+            batch = [data for data in batch if data not in cancelled]
+            if not batch:
+                return
+        if self.skip_error:
+            for data in batch:
+                if isinstance(data, Exception):
+                    self._put_data(data)
+            batch = [data for data in batch if not isinstance(data, Exception)]
+            if not batch:
+                return
+        results = self._proc_data(batch)
+        if results is None or isinstance(results, Exception):
+            self._put_data(results)
+            return
+        for result in results:
+            self._put_data(result)
 
     def _error_decorator(self, func):
         @retry(
             stop=stop_after_attempt(5),
             wait=wait_exponential_jitter(max=10),
             retry=retry_if_exception_type(Exception),
+            before_sleep=self._count_retry,
         )
         @functools.wraps(func)
         def input_wrapper(data):
-            if self.no_input:
-                result = func()
+            args = () if self.no_input else (data,)
+            executor = get_executor(self.executor)
+            if executor:
+                result = executor.submit(func, *args).result()
             else:
-                result = func(data)
+                result = func(*args)
             return result
 
         @functools.wraps(func)
@@ -271,10 +455,5 @@ class Node(AbstractNode, NodeLink):
 
         return error_wrapper
 
-    def _is_upstream_end(self):
-        if self.src_nodes and all(
-            node.is_start == False for node in self.src_nodes.values()
-        ):
-            return True
-        else:
-            return False
+    def _count_retry(self, retry_state):
+        self.retry_count += 1
@@ -25,7 +25,7 @@ class NodeLink(ABC):
     @abstractmethod
     def set_src_node(self, node):
         pass
-    
+
     @abstractmethod
     def set_dst_node(self, node):
         pass
@@ -33,11 +33,27 @@ class NodeLink(ABC):
     @abstractmethod
     def put(self, data):
         pass
-    
+
     @abstractmethod
     def connect(self, node, criteria=lambda data: True):
         pass
 
+    @abstractmethod
+    def on_upstream_end(self):
+        pass
+
+    def _notify_downstream_end(self):
+        for node in list(self.dst_nodes.values()):
+            node.on_upstream_end()
+
+    def _is_upstream_end(self):
+        if self.src_nodes and all(
+            node.is_end for node in self.src_nodes.values()
+        ):
+            return True
+        else:
+            return False
+
     def __rshift__(self, other):
         self.connect(other)
         return other
@@ -1,8 +1,6 @@
 import logging
 from abc import ABC, abstractmethod
 
-import gevent
-from gevent import spawn
 from ..node.abstract_node import AbstractNode
 
 logger = logging.getLogger(__name__)
@@ -14,7 +12,6 @@ class NodeGroup(AbstractNode, ABC):
         assert len(all_nodes) != 0, f"No node to compose the node group {self.__name__}"
         self.all_nodes = {node.__name__: node for node in all_nodes}
         self._connect_nodes()
-        self._watch_nodes = gevent.spawn(self._watch_nodes)
 
     @abstractmethod
     def _connect_nodes(self):
@@ -22,31 +19,35 @@ class NodeGroup(AbstractNode, ABC):
             f"Not implemented the self._connect_nodes method in {self.__name__}"
         )
 
-    def _watch_nodes(self):
-        while self.is_start:
-            if all([not node.is_start for node in self.all_nodes.values()]):
-                self.is_start = False
-            gevent.sleep(5)
+    def _on_node_end(self, node):
+        # the group finishes as soon as its last inner node drains
+        if all(node.is_end for node in self.all_nodes.values()):
+            self._notify_end()
 
     def start(self):
         if self.serial_number is None:
             self.serial_number = [0]
         for i, node in enumerate(self.all_nodes.values()):
             node.set_serial_number(self.serial_number + [i])
+            node.add_end_callback(self._on_node_end)
             node.start()
         self.is_start = True
         return
 
-    def end(self):
+    def end(self, timeout=None):
         heads = self._find_head_nodes()
         for head in heads:
             head.end()
-        self._watch_nodes.join()
+        if not self.wait_end(timeout):
+            logger.warning(f"Node group {self.__name__} not finished in {timeout}s")
+            return
         self.is_start = False
 
     def _find_head_nodes(self):
         nodes = []
         for node in self.all_nodes.values():
-            if any([src not in self.all_nodes.values() for src in node.src_nodes]):
+            if not node.src_nodes or any(
+                [src not in self.all_nodes.values() for src in node.src_nodes.values()]
+            ):
                 nodes.append(node)
         return nodes
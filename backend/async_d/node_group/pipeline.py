@@ -1,7 +1,6 @@
 import logging
 from abc import ABC, abstractmethod
 
-import gevent
 from .node_group import NodeGroup
 from ..node.node_link import NodeLink
 from ..node.abstract_node import AbstractNode
@@ -56,6 +55,13 @@ class Pipeline(NodeGroup, NodeLink):
     def put(self, data):
         self.head.put(data)
 
+    def on_upstream_end(self):
+        self.head.on_upstream_end()
+
+    def _notify_end(self):
+        super()._notify_end()
+        self._notify_downstream_end()
+
     def connect(self, node, criteria=lambda data: True):
         self.tail.set_dst_node(node)
         node.set_src_node(self)
@@ -0,0 +1,78 @@
+import math
+import logging
+from heapq import heappush, heappop
+
+from gevent.queue import Queue
+
+from .exceptions import NodeStop
+
+logger = logging.getLogger(__name__)
+
+
+class FairQueue(Queue):
+    """
+    Source queue which serves items in weighted fair order instead of FIFO.
+
+    Every item belongs to a flow given by `flow_key` (e.g. task_id or user_id).
+    Items are ordered by their virtual finish time, `start + cost / weight`, so a
+    flow with a large backlog or expensive items can not starve the small ones,
+    and a flow of weight w gets w times the share of a flow of weight 1.
+    An optional `priority` (e.g. a deadline timestamp) takes precedence over
+    the fair order, lower value is served first.
+
+    Stop flags are always served after the data, errors are served at once.
+    """
+
+    def __init__(
+        self,
+        maxsize=None,
+        flow_key=None,
+        cost=None,
+        flow_weight=None,
+        priority=None,
+    ):
+        self.flow_key = flow_key if flow_key else lambda data: getattr(data, "task_id", None)
+        self.cost = cost if cost else lambda data: 1
+        self.flow_weight = flow_weight if flow_weight else lambda key: 1
+        self.priority = priority if priority else lambda data: 0
+        super().__init__(maxsize)
+
+    def _init(self, maxsize, items=()):
+        self.queue = []
+        self.virtual_time = 0
+        self.flow_finish_time = {}
+        self.seq = 0
+        for item in items:
+            self._put(item)
+
+    def _qsize(self):
+        return len(self.queue)
+
+    def _put(self, item):
+        if isinstance(item, NodeStop):
+            priority, finish_time = math.inf, math.inf
+        elif isinstance(item, Exception):
+            priority, finish_time = -math.inf, self.virtual_time
+        else:
+            key = self.flow_key(item)
+            start_time = max(self.virtual_time, self.flow_finish_time.get(key, 0))
+            finish_time = start_time + self.cost(item) / self.flow_weight(key)
+            self.flow_finish_time[key] = finish_time
+            priority = self.priority(item)
+        self.seq += 1
+        heappush(self.queue, (priority, finish_time, self.seq, item))
+
+    def _get(self):
+        _, finish_time, _, item = heappop(self.queue)
+        if finish_time != math.inf:
+            self.virtual_time = max(self.virtual_time, finish_time)
+            # forget the idle flows, they restart from the current virtual time
+            self.flow_finish_time = {
+                key: time
+                for key, time in self.flow_finish_time.items()
+                if time > self.virtual_time
+            }
+        return item
+
+    def _peek(self):
+        return self.queue[0][-1]
@@ -0,0 +1,17 @@
+import copy
+
+
+def shared_deepcopy(data):
+    """
+    Deep copies the data while sharing the parts it declares as immutable.
+
+    Data could implement a `shared_objects()` method returning the sub objects
+    that are never mutated after creation, they are put into the deepcopy memo
+    so the copy references them instead of cloning them.
+    """
+    memo = {}
+    shared_objects = getattr(data, "shared_objects", None)
+    if callable(shared_objects):
+        for obj in shared_objects():
+            memo[id(obj)] = obj
+    return copy.deepcopy(data, memo)
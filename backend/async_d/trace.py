@@ -0,0 +1,125 @@
+import time
+import functools
+import itertools
+from contextlib import contextmanager
+
+import gevent
+from gevent.local import local
+
+# the trace context of the current greenlet: (trace, span stack)
+_local = local()
+
+
+class Span:
+    def __init__(self, name, parent=None, args=None):
+        self.name = name
+        self.parent = parent
+        self.args = args or {}
+        self.greenlet_id = id(gevent.getcurrent())
+        self.start_time = time.time()
+        self.end_time = None
+
+    def finish(self):
+        self.end_time = time.time()
+
+
+class Trace:
+    """
+    All the spans of one traced item, e.g. one survey through the whole pipeline.
+    """
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.spans = []
+        self._lanes = {}
+        self._lane_counter = itertools.count(1)
+
+    def add_span(self, span):
+        self.spans.append(span)
+
+    def to_chrome_trace(self):
+        """
+        Exports the spans in the Chrome trace event format, viewable in
+        chrome://tracing or Perfetto. Each greenlet gets its own lane.
+        """
+        events = []
+        for span in self.spans:
+            end_time = span.end_time if span.end_time is not None else time.time()
+            if span.greenlet_id not in self._lanes:
+                self._lanes[span.greenlet_id] = next(self._lane_counter)
+            args = dict(span.args)
+            if span.parent is not None:
+                args["parent"] = span.parent.name
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": args.pop("category", "span"),
+                    "ph": "X",
+                    "ts": span.start_time * 1e6,
+                    "dur": (end_time - span.start_time) * 1e6,
+                    "pid": str(self.trace_id),
+                    "tid": self._lanes[span.greenlet_id],
+                    "args": args,
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def current_trace():
+    context = getattr(_local, "context", None)
+    return context[0] if context else None
+
+
+@contextmanager
+def trace_context(trace):
+    """
+    Makes the trace current in this greenlet, the spans opened inside are added to it.
+    """
+    old_context = getattr(_local, "context", None)
+    _local.context = (trace, [])
+    try:
+        yield trace
+    finally:
+        _local.context = old_context
+
+
+@contextmanager
+def trace_span(name, **args):
+    """
+    Records a span in the current trace, does nothing if the greenlet is not traced.
+    """
+    context = getattr(_local, "context", None)
+    if context is None:
+        yield None
+        return
+    trace, stack = context
+    span = Span(name, parent=stack[-1] if stack else None, args=args)
+    trace.add_span(span)
+    stack.append(span)
+    try:
+        yield span
+    finally:
+        span.finish()
+        stack.pop()
+
+
+def bind_trace(func, name=None):
+    """
+    Carries the trace context of the current greenlet into func, which is going
+    to run in a newly spawned greenlet. A span named `name` wraps the call if set.
+    """
+    context = getattr(_local, "context", None)
+    if context is None:
+        return func
+    trace, stack = context
+    parent_stack = list(stack)
+
+    @functools.wraps(func)
+    def traced_func(*args, **kwargs):
+        _local.context = (trace, list(parent_stack))
+        if name is None:
+            return func(*args, **kwargs)
+        with trace_span(name):
+            return func(*args, **kwargs)
+
+    return traced_func
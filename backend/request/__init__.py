@@ -5,5 +5,9 @@ logger = logging.getLogger(__name__)
 
 from .openai import OpenAIRequest
 from .local import LocalRequest
-from .wrapper import RequestWrapper
+from .wrapper import RequestWrapper, run_async, close_async_clients
+from .cache import CachePolicy
+from .hedge import HedgePolicy
+from .limiter import is_client_error, is_context_length_error
+from .stream import stop_after_md_block, stop_after_tags
 
@@ -0,0 +1,78 @@
+import os
+import json
+import logging
+
+import gevent
+from gevent.event import AsyncResult
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Coalesces the concurrent requests of many greenlets to one batched call.
+
+    A request waits at most max_wait seconds for others with the same
+    params, a batch is sent as soon as it has max_batch_size requests.
+    send(instances, params) must return the answers in the order of the
+    instances, a failed batch raises its error in every caller, which
+    retries on its own (and is batched again).
+    """
+
+    def __init__(self, send, max_batch_size=16, max_wait=0.02):
+        self.send = send
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = {}  # params key: (params, [(instance, AsyncResult)])
+        self._timers = {}  # params key: timer greenlet
+        self.batch_count = 0
+        self.request_count = 0
+
+    def submit(self, instance, params):
+        key = json.dumps(params, sort_keys=True, default=str)
+        result = AsyncResult()
+        _, batch = self._pending.setdefault(key, (params, []))
+        batch.append((instance, result))
+        if len(batch) >= self.max_batch_size:
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = gevent.spawn_later(self.max_wait, self._flush, key)
+        return result.get()
+
+    def _flush(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None and timer is not gevent.getcurrent():
+            timer.kill(block=False)
+        params, batch = self._pending.pop(key, (None, None))
+        if batch:
+            # 在独立的greenlet中发送，某个调用方被取消时不影响同一批的其他请求
+            gevent.spawn(self._send_batch, params, batch)
+
+    def _send_batch(self, params, batch):
+        self.batch_count += 1
+        self.request_count += len(batch)
+        try:
+            answers = self.send([instance for instance, _ in batch], params)
+            if len(answers) != len(batch):
+                raise ValueError(
+                    f"Batch of {len(batch)} instances got {len(answers)} answers"
+                )
+        except Exception as e:
+            for _, result in batch:
+                result.set_exception(e)
+            return
+        logger.debug(f"Sent batch of {len(batch)} instances")
+        for (_, result), answer in zip(batch, answers):
+            result.set(answer)
+
+
+def load_batch_config():
+    """
+    The batch size and wait time of the local model server from the environment
+    variables LOCAL_MAX_BATCH_SIZE and LOCAL_BATCH_WAIT_MS. Batching is off by
+    default (1), the server has to accept several instances per /infer request.
+    """
+    return {
+        "max_batch_size": int(os.environ.get("LOCAL_MAX_BATCH_SIZE", 1)),
+        "max_wait": float(os.environ.get("LOCAL_BATCH_WAIT_MS", 20)) / 1000,
+    }
@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+
+import gevent
+from gevent.lock import Semaphore
+
+logger = logging.getLogger(__name__)
+
+
+class CachePolicy:
+    """
+    Per call site cache policy of RequestWrapper.completion.
+
+    ttl: seconds a cached response stays valid, overrides the ttl of the cache
+    validate: callable(result), the result is cached (and a cached result
+        is used) only if it returns truthy without raising, so a response the
+        call site fails to parse is requested again instead of replayed
+    """
+
+    def __init__(self, ttl=None, validate=None):
+        self.ttl = ttl
+        self.validate = validate
+
+    def is_valid(self, result):
+        if self.validate is None:
+            return True
+        try:
+            return bool(self.validate(result))
+        except Exception:
+            return False
+
+
+def make_cache_key(model, messages, kwargs):
+    content = json.dumps(
+        {"model": model, "messages": messages, "kwargs": kwargs},
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def make_prefix_key(prefix):
+    """
+    Short stable key of a shared prompt prefix, sent as the prompt cache hint
+    so the requests sharing the prefix are served from the same cache.
+    """
+    return hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:32]
+
+
+class ResponseCache:
+    """
+    Content addressed LLM response cache in a SQLite file.
+
+    Responses are keyed by the hash of (model, messages, sampling kwargs).
+    When the total size of the cached responses exceeds max_size bytes, the
+    least recently used ones are evicted. Entries older than ttl seconds
+    (0 for never) are treated as missing.
+    """
+
+    def __init__(self, path, max_size=1024 * 1024 * 1024, ttl=0):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.db_lock = Semaphore(1)
+        self.hit_count = 0
+        self.miss_count = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS response ("
+            "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, "
+            "create_time REAL, access_time REAL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS response_access_time ON response (access_time)"
+        )
+        self.conn.commit()
+        self.total_size = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM response"
+        ).fetchone()[0]
+
+    def get(self, key, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+
+        def select():
+            row = self.conn.execute(
+                "SELECT response, size, create_time FROM response WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            response, size, create_time = row
+            if ttl and time.time() - create_time > ttl:
+                self.conn.execute("DELETE FROM response WHERE key = ?", (key,))
+                self.conn.commit()
+                self.total_size -= size
+                return None
+            self.conn.execute(
+                "UPDATE response SET access_time = ? WHERE key = ?", (time.time(), key)
+            )
+            self.conn.commit()
+            return response
+
+        response = self._execute(select)
+        if response is None:
+            self.miss_count += 1
+        else:
+            self.hit_count += 1
+        return response
+
+    def set(self, key, model, response):
+        size = len(response.encode("utf-8"))
+
+        def insert():
+            row = self.conn.execute(
+                "SELECT size FROM response WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO response VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now),
+            )
+            self.total_size += size - (row[0] if row else 0)
+            if self.total_size > self.max_size:
+                self._evict()
+            self.conn.commit()
+
+        self._execute(insert)
+
+    def delete(self, key):
+        def remove():
+            row = self.conn.execute(
+                "SELECT size FROM response WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self.conn.execute("DELETE FROM response WHERE key = ?", (key,))
+                self.conn.commit()
+                self.total_size -= row[0]
+
+        self._execute(remove)
+
+    def close(self):
+        with self.db_lock:
+            self.conn.close()
+
+    def _evict(self):
+        # evict the least recently used responses down to 90% of the max size
+        target_size = self.max_size * 0.9
+        rows = self.conn.execute(
+            "SELECT key, size FROM response ORDER BY access_time"
+        ).fetchall()
+        evicted_keys = []
+        for key, size in rows:
+            if self.total_size <= target_size:
+                break
+            evicted_keys.append((key,))
+            self.total_size -= size
+        self.conn.executemany("DELETE FROM response WHERE key = ?", evicted_keys)
+        logger.info(f"Evict {len(evicted_keys)} responses from cache {self.path}")
+
+    def _execute(self, func):
+        with self.db_lock:
+            # keep the disk io off the hub
+            return gevent.get_hub().threadpool.apply(func)
+
+
+_response_cache = None
+_response_cache_lock = Semaphore(1)
+
+
+def get_response_cache():
+    """
+    The response cache shared by all the RequestWrappers, configured by the
+    environment variables LLM_CACHE_PATH (empty to disable), LLM_CACHE_MAX_SIZE_MB
+    and LLM_CACHE_TTL (seconds, 0 for never expire).
+    """
+    global _response_cache
+    path = os.environ.get("LLM_CACHE_PATH")
+    if not path:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            max_size = float(os.environ.get("LLM_CACHE_MAX_SIZE_MB", 1024)) * 1024 * 1024
+            ttl = float(os.environ.get("LLM_CACHE_TTL", 0))
+            _response_cache = ResponseCache(path, max_size=max_size, ttl=ttl)
+            logger.info(f"LLM response cache enabled at {path}")
+    return _response_cache
@@ -10,6 +10,8 @@ from tenacity import (
     retry_if_exception_type
 )
 
+from .limiter import rate_limit_notifier
+
 logger = logging.getLogger(__name__)
 
 # proxy = "http://127.0.0.1:7890"
@@ -31,20 +33,66 @@ class GoogleRequest:
     @retry(
         wait=wait_random_exponential(multiplier=2, max=60),
         stop=stop_after_attempt(10),
-        retry=retry_if_exception_type(Exception)  # 网络、限流、服务端错误等都重试
+        retry=retry_if_exception_type(Exception),  # 网络、限流、服务端错误等都重试
+        before_sleep=rate_limit_notifier(lambda e: getattr(e, "code", None) == 429),
     )
     def completion(self, messages, **kwargs) -> str:
+        response = self.client.models.generate_content(
+            model=self.model,
+            contents=self._format_contents(messages)
+        )
+        return self._parse_response(response)
+
+    @retry(
+        wait=wait_random_exponential(multiplier=2, max=60),
+        stop=stop_after_attempt(10),
+        retry=retry_if_exception_type(Exception),
+        before_sleep=rate_limit_notifier(lambda e: getattr(e, "code", None) == 429),
+    )
+    async def acompletion(self, messages, **kwargs) -> str:
+        response = await self.client.aio.models.generate_content(
+            model=self.model,
+            contents=self._format_contents(messages)
+        )
+        return self._parse_response(response)
 
-        contents = [
+    def stream_completion(self, messages, **kwargs):
+        """
+        Yields (text delta, token usage) of each chunk. Closing the generator closes the http stream.
+        """
+        stream = self.client.models.generate_content_stream(
+            model=self.model,
+            contents=self._format_contents(messages)
+        )
+        try:
+            for response in stream:
+                yield response.text or "", self._get_token_usage(response)
+        finally:
+            if hasattr(stream, "close"):
+                stream.close()
+
+    async def astream_completion(self, messages, **kwargs):
+        stream = await self.client.aio.models.generate_content_stream(
+            model=self.model,
+            contents=self._format_contents(messages)
+        )
+        try:
+            async for response in stream:
+                yield response.text or "", self._get_token_usage(response)
+        finally:
+            if hasattr(stream, "aclose"):
+                await stream.aclose()
+
+    def _get_token_usage(self, response):
+        return getattr(response.usage_metadata, "total_token_count", None)
+
+    def _format_contents(self, messages):
+        return [
             {"role": m["role"], "parts": [types.Part.from_text(text=m["content"])]}
             for m in messages
         ]
-            
-        response = self.client.models.generate_content(
-            model=self.model,
-            contents=contents
-        )
-        
+
+    def _parse_response(self, response):
         text = getattr(response, "text", None)
         token_usage = response.usage_metadata.total_token_count
         if not text:
@@ -0,0 +1,86 @@
+import math
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class HedgePolicy:
+    """
+    Opt-in hedging of RequestWrapper.completion: when a request has not
+    answered after the rolling `percentile` latency of its model, a duplicate
+    request is sent (to `alternate`, another RequestWrapper, if given), the
+    first answer wins and the other request is killed.
+
+    budget: max fraction of the requests of the model that may be hedged
+    min_samples: latencies needed before the percentile is trusted
+    min_delay: seconds to wait at least before hedging
+    """
+
+    def __init__(
+        self, percentile=95, budget=0.05, min_samples=20, min_delay=1.0, alternate=None
+    ):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.alternate = alternate
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Builds the policy from the "hedge" entry of a neuron config, None if not configured.
+        """
+        if not config:
+            return None
+        return cls(
+            percentile=config.get("percentile", 95),
+            budget=config.get("budget", 0.05),
+            min_samples=config.get("min_samples", 20),
+            min_delay=config.get("min_delay", 1.0),
+        )
+
+
+class HedgeStats:
+    """
+    Rolling latencies and hedge counts of one model.
+    """
+
+    def __init__(self, window=500):
+        self.latencies = deque(maxlen=window)
+        self.request_count = 0
+        self.hedge_count = 0
+        self.hedge_win_count = 0
+
+    def record(self, latency):
+        self.latencies.append(latency)
+
+    def percentile(self, percent):
+        if not self.latencies:
+            return None
+        latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1, math.ceil(len(latencies) * percent / 100) - 1)
+        return latencies[max(index, 0)]
+
+    def get_delay(self, policy):
+        """
+        Seconds to wait before hedging, None if the latency history is too short.
+        """
+        if len(self.latencies) < policy.min_samples:
+            return None
+        return max(policy.min_delay, self.percentile(policy.percentile))
+
+    def try_hedge(self, policy):
+        if self.hedge_count + 1 > policy.budget * self.request_count:
+            return False
+        self.hedge_count += 1
+        return True
+
+
+_hedge_stats = {}  # model: HedgeStats
+
+
+def get_hedge_stats(model):
+    if model not in _hedge_stats:
+        _hedge_stats[model] = HedgeStats()
+    return _hedge_stats[model]
@@ -0,0 +1,387 @@
+import os
+import re
+import json
+import time
+import asyncio
+import inspect
+import logging
+import functools
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+
+import gevent
+import gevent.event
+from tenacity import BaseRetrying, stop_after_attempt, retry_if_exception
+
+logger = logging.getLogger(__name__)
+
+# the limiter state is only changed between yields, the greenlets and the
+# coroutines on the event loop share one thread, so no lock is needed
+RATE_LIMIT_PAUSE = 1.0
+MAX_ATTEMPTS = 6
+
+
+def estimate_tokens(messages):
+    """
+    Rough prompt token count: about 4 ascii characters or 1 other character per token.
+    """
+    count = 0
+    for message in messages:
+        content = message["content"]
+        ascii_count = sum(1 for char in content if ord(char) < 128)
+        count += ascii_count // 4 + (len(content) - ascii_count) + 4
+    return count
+
+
+def get_total_tokens(token_usage):
+    if isinstance(token_usage, (int, float)):
+        return token_usage
+    return getattr(token_usage, "total_tokens", None)
+
+
+def get_status_codes(exception):
+    response = getattr(exception, "response", None)
+    return [
+        code for code in (
+            getattr(exception, "status_code", None),
+            getattr(exception, "code", None),
+            getattr(response, "status_code", None),
+        )
+        if isinstance(code, int)
+    ]
+
+
+def is_rate_limit_error(exception):
+    return 429 in get_status_codes(exception)
+
+
+def is_client_error(exception):
+    """
+    A 4xx error other than timeout (408) and rate limit (429), e.g. the
+    context is too long, the request is wrong and fails on any backend.
+    """
+    return any(400 <= code < 500 and code not in (408, 429) for code in get_status_codes(exception))
+
+
+CONTEXT_LENGTH_PATTERN = re.compile(
+    r"context[ _]length|maximum number of tokens|too many tokens|too long", re.IGNORECASE
+)
+
+
+def is_context_length_error(exception):
+    """
+    A client error because the prompt is longer than the context of the
+    model, the caller could retry with a shorter prompt.
+    """
+    if 413 in get_status_codes(exception):
+        return True
+    return is_client_error(exception) and bool(CONTEXT_LENGTH_PATTERN.search(str(exception)))
+
+
+def call_once(method, *args, **kwargs):
+    """
+    Calls a tenacity decorated request method without its own retries, the
+    caller retries instead (RequestWrapper through the limiter, Router on the
+    other backends).
+    """
+    retry_with = getattr(method, "retry_with", None)
+    if retry_with is None:
+        return method(*args, **kwargs)
+    return retry_with(stop=stop_after_attempt(1), reraise=True)(
+        method.__self__, *args, **kwargs
+    )
+
+
+class TokenBucket:
+    """
+    Reservation style token bucket refilled at rate_per_minute. A reservation
+    always succeeds and may drive the bucket negative, the caller waits the
+    returned seconds until the reserved tokens are refilled.
+    """
+
+    def __init__(self, rate_per_minute):
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.fill_rate = rate_per_minute / 60
+        self.update_time = time.monotonic()
+
+    def reserve(self, amount):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+        return max(0.0, -self.tokens / self.fill_rate)
+
+    def adjust(self, amount):
+        """
+        Gives back (positive) or takes more (negative) tokens after the real usage is known.
+        """
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.update_time) * self.fill_rate
+        )
+        self.update_time = now
+
+
+class ModelLimiter:
+    """
+    Limits the requests to one model, shared by all the RequestWrappers of the model.
+
+    rpm, tpm: request and token budgets per minute, enforced by token buckets
+    max_concurrency: upper bound of the requests in flight. The actual
+        concurrency limit adapts AIMD style: +1 per window of successful
+        requests, halved on a rate limit error (at most once per second) and
+        x0.9 when the latency exceeds latency_target. A rate limit error
+        also pauses new requests for the Retry-After time.
+    max_attempts: attempts of a request, each one acquires the limiter and
+        reserves the budgets again, see retrying
+
+    The waiting requests get the slots in arrival order, a released slot
+    wakes the first of them.
+    """
+
+    def __init__(
+        self,
+        model,
+        rpm=None,
+        tpm=None,
+        max_concurrency=20,
+        min_concurrency=1,
+        latency_target=None,
+        max_attempts=MAX_ATTEMPTS,
+    ):
+        self.model = model
+        self.request_bucket = TokenBucket(rpm) if rpm else None
+        self.token_bucket = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.latency_target = latency_target
+        self.max_attempts = max_attempts
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.pause_until = 0
+        self.last_decrease_time = 0
+        self.rate_limit_count = 0
+        self.waiters = deque()  # wake up callbacks of the waiting requests, in arrival order
+
+    @contextmanager
+    def acquire(self, estimated_tokens=0):
+        """
+        Holds a concurrency slot for one request, yields a dict to put the
+        token usage of the request into.
+        """
+        if self.waiters or not self._try_acquire():
+            event = gevent.event.Event()
+            wake = event.set
+            self.waiters.append(wake)
+            try:
+                while not (self.waiters[0] is wake and self._try_acquire()):
+                    event.wait(timeout=self._pause_remaining())
+                    event.clear()
+            finally:
+                self.waiters.remove(wake)
+                self._wake_next()
+        usage = {}
+        try:
+            wait_time = self._reserve(estimated_tokens)
+            if wait_time > 0:
+                gevent.sleep(wait_time)
+            start_time = time.monotonic()
+            yield usage
+        except BaseException:
+            self._release_slot()
+            raise
+        else:
+            self._release(start_time, estimated_tokens, usage)
+
+    @asynccontextmanager
+    async def async_acquire(self, estimated_tokens=0):
+        """
+        asyncio version of acquire, waits on the event loop instead of the greenlet.
+        """
+        if self.waiters or not self._try_acquire():
+            event = asyncio.Event()
+            # woken from the greenlets too, which do not wake the selector of the loop by themselves
+            wake = functools.partial(asyncio.get_running_loop().call_soon_threadsafe, event.set)
+            self.waiters.append(wake)
+            try:
+                while not (self.waiters[0] is wake and self._try_acquire()):
+                    try:
+                        await asyncio.wait_for(event.wait(), self._pause_remaining())
+                    except asyncio.TimeoutError:
+                        pass
+                    event.clear()
+            finally:
+                self.waiters.remove(wake)
+                self._wake_next()
+        usage = {}
+        try:
+            wait_time = self._reserve(estimated_tokens)
+            if wait_time > 0:
+                await asyncio.sleep(wait_time)
+            start_time = time.monotonic()
+            yield usage
+        except BaseException:
+            self._release_slot()
+            raise
+        else:
+            self._release(start_time, estimated_tokens, usage)
+
+    def retrying(self, method, report_rate_limit=True):
+        """
+        The retry policy of a tenacity decorated request method (the errors
+        to retry and the wait between attempts) with at most max_attempts,
+        None if the method does not retry. The caller runs each attempt in
+        acquire and the method through call_once, so the retries are limited
+        and budgeted as any other request. The client errors are not
+        retried, the rate limit errors slow the model down unless
+        report_rate_limit is False (Router reports them itself).
+        """
+        retrying = getattr(method, "retry", None)
+        if not isinstance(retrying, BaseRetrying):
+            return None
+
+        def before_sleep(retry_state):
+            exception = retry_state.outcome.exception()
+            if report_rate_limit and is_rate_limit_error(exception):
+                self.on_rate_limit(get_retry_after(exception))
+            logger.warning(
+                f"Retry request to {self.model} after attempt {retry_state.attempt_number} failed: {exception}"
+            )
+
+        return retrying.copy(
+            stop=stop_after_attempt(self.max_attempts),
+            # a wrong request (e.g. too long) fails again, leave it to the caller
+            retry=retrying.retry & retry_if_exception(lambda e: not is_client_error(e)),
+            before_sleep=before_sleep,
+            reraise=True,
+        )
+
+    def on_rate_limit(self, retry_after=None):
+        now = time.monotonic()
+        self.rate_limit_count += 1
+        self.pause_until = max(self.pause_until, now + (retry_after or RATE_LIMIT_PAUSE))
+        if now - self.last_decrease_time > 1:
+            self.limit = max(self.min_concurrency, self.limit / 2)
+            self.last_decrease_time = now
+            logger.warning(
+                f"Rate limited on {self.model}, concurrency limit decreased to {int(self.limit)}"
+            )
+
+    def snapshot(self):
+        return {
+            "model": self.model,
+            "concurrency_limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "rate_limit_count": self.rate_limit_count,
+        }
+
+    def _pause_remaining(self):
+        remaining = self.pause_until - time.monotonic()
+        return remaining if remaining > 0 else None
+
+    def _wake_next(self):
+        if self.waiters:
+            self.waiters[0]()
+
+    def _try_acquire(self):
+        if time.monotonic() < self.pause_until:
+            return False
+        if self.in_flight >= max(int(self.limit), self.min_concurrency):
+            return False
+        self.in_flight += 1
+        return True
+
+    def _reserve(self, estimated_tokens):
+        wait_time = 0
+        if self.request_bucket:
+            wait_time = max(wait_time, self.request_bucket.reserve(1))
+        if self.token_bucket:
+            wait_time = max(wait_time, self.token_bucket.reserve(estimated_tokens))
+        return wait_time
+
+    def _release_slot(self):
+        self.in_flight -= 1
+        self._wake_next()
+
+    def _release(self, start_time, estimated_tokens, usage):
+        latency = time.monotonic() - start_time
+        total_tokens = usage.get("total_tokens")
+        if self.token_bucket and total_tokens is not None:
+            self.token_bucket.adjust(estimated_tokens - total_tokens)
+
+        now = time.monotonic()
+        if self.latency_target and latency > self.latency_target:
+            if now - self.last_decrease_time > 1:
+                self.limit = max(self.min_concurrency, self.limit * 0.9)
+                self.last_decrease_time = now
+        else:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+        self._release_slot()
+
+
+def get_retry_after(exception):
+    headers = getattr(getattr(exception, "response", None), "headers", None)
+    try:
+        return float(headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def rate_limit_notifier(is_rate_limit):
+    """
+    Builds the tenacity before_sleep hook of a request backend method, which
+    reports the rate limit errors to the limiter of the backend model.
+    """
+
+    def before_sleep(retry_state):
+        exception = retry_state.outcome.exception()
+        if is_rate_limit(exception):
+            request = retry_state.args[0]
+            get_limiter(request.model).on_rate_limit(get_retry_after(exception))
+
+    return before_sleep
+
+
+_limiters = {}  # model: ModelLimiter
+LIMITER_KEYS = set(inspect.signature(ModelLimiter).parameters) - {"model"}
+
+
+def load_rate_limits():
+    """
+    The limits of each model from the environment variable LLM_RATE_LIMITS, a
+    json object of {model: {"rpm":, "tpm":, "max_concurrency":, "latency_target":,
+    "max_attempts":}}, the "default" entry applies to the models not listed.
+    """
+    rate_limits = os.environ.get("LLM_RATE_LIMITS")
+    if not rate_limits:
+        return {}
+    try:
+        return json.loads(rate_limits)
+    except json.JSONDecodeError as e:
+        logger.error(f"Invalid LLM_RATE_LIMITS: {e}")
+        return {}
+
+
+def get_limiter(model, max_concurrency=20):
+    """
+    The limiter of the model, created on first use. max_concurrency is only
+    used if the model is not configured in LLM_RATE_LIMITS.
+    """
+    if model not in _limiters:
+        rate_limits = load_rate_limits()
+        config = {"max_concurrency": max_concurrency}
+        config.update(rate_limits.get(model, rate_limits.get("default", {})))
+        unknown_keys = set(config) - LIMITER_KEYS
+        if unknown_keys:
+            logger.warning(f"Ignore unknown LLM_RATE_LIMITS keys of {model}: {sorted(unknown_keys)}")
+            config = {key: value for key, value in config.items() if key in LIMITER_KEYS}
+        _limiters[model] = ModelLimiter(model, **config)
+        logger.info(f"Create limiter for {model}: {config}")
+    return _limiters[model]
+
+
+def get_all_limiters():
+    return list(_limiters.values())
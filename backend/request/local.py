@@ -1,4 +1,6 @@
 import os
+import asyncio
+import weakref
 import requests
 from requests.exceptions import HTTPError
 import json
@@ -12,29 +14,93 @@ from tenacity import (
     before_sleep_log,
     retry_if_exception_type
 )
+from .limiter import rate_limit_notifier
+from .batcher import MicroBatcher, load_batch_config
 import logging
 logger = logging.getLogger(__name__)
 
 
+def is_rate_limit(e):
+    return getattr(getattr(e, "response", None), "status_code", None) == 429
+
+
 class LocalRequest:
-    def __init__(self, port):
-        self.url = f"http://localhost:{port}/infer"
+    # 同一个url的请求共用一个session，复用其keep-alive连接池
+    _sessions = {}  # url: requests.Session
+    # aiohttp的session绑定在事件循环上，每个事件循环各自共享
+    _async_sessions = weakref.WeakKeyDictionary()  # loop: {url: aiohttp.ClientSession}
+    # 服务端/infer接受多条instances，同一个url的并发请求合并成一批发送，批量prefill的吞吐高得多
+    _batchers = {}  # url: MicroBatcher
+
+    def __init__(self, port=None, model=None, url=None, max_batch_size=None, batch_wait=None):
+        self.model = model
+        self.url = url or f"http://localhost:{port}/infer"
+        if self.url not in self._batchers:
+            config = load_batch_config()
+            if max_batch_size is not None:
+                config["max_batch_size"] = max_batch_size
+            if batch_wait is not None:
+                config["max_wait"] = batch_wait
+            self._batchers[self.url] = (
+                MicroBatcher(self._post, **config) if config["max_batch_size"] > 1 else None
+            )
         logger.warning(f"Token counter is not supported in LocalRequest, each request will be counted as 1 token")
 
+    @property
+    def batcher(self):
+        return self._batchers[self.url]
+
+    @property
+    def session(self):
+        if self.url not in self._sessions:
+            self._sessions[self.url] = requests.Session()
+        return self._sessions[self.url]
+
+    @property
+    def async_session(self):
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        sessions = self._async_sessions.setdefault(loop, {})
+        if self.url not in sessions or sessions[self.url].closed:
+            sessions[self.url] = aiohttp.ClientSession(
+                headers={"Content-Type": "application/json"}
+            )
+        return sessions[self.url]
+
+    @classmethod
+    async def aclose_sessions(cls):
+        """
+        Closes the aiohttp sessions of the running event loop, should be
+        awaited before the loop finishes, see request.run_async.
+        """
+        sessions = cls._async_sessions.pop(asyncio.get_running_loop(), {})
+        for session in sessions.values():
+            await session.close()
+
     @retry(
         wait=wait_random_exponential(multiplier=2, max=60),
         stop=stop_after_attempt(30),
-        retry=retry_if_exception_type((JSONDecodeError, HTTPError)) # 如果不是这几个错就不retry了
+        retry=retry_if_exception_type((JSONDecodeError, HTTPError)), # 如果不是这几个错就不retry了
+        before_sleep=rate_limit_notifier(is_rate_limit),
     )
     def completion(self, messages, **kwargs):
+        config = self._format_config_params(kwargs)
+        if self.batcher is not None:
+            answer = self.batcher.submit(messages, config)
+        else:
+            answer = self._post([messages], config)[0]
+        return answer, 1
+
+    def _post(self, instances, config):
+        result = None
         try:
-            config = self._format_config_params(kwargs)
-            data = {"instances": [messages], "params": config}
-            result = requests.post(
+            data = {"instances": instances, "params": config}
+            result = self.session.post(
                 self.url, json=data, headers={"Content-Type": "application/json"}
             )
             result.raise_for_status()
-            answer = json.loads(result.content)[0]
+            answers = json.loads(result.content)
         except JSONDecodeError as e:
             logger.error(
                 f"JSONDecodeError in LocalRequest.completion: {e}\nResult: {result.content}"
@@ -46,6 +112,42 @@ class LocalRequest:
         except Exception as e:
             logger.error(f"Unexpected Error in LocalRequest.completion: {e}\n")
             raise
+        return answers
+
+    @retry(
+        wait=wait_random_exponential(multiplier=2, max=60),
+        stop=stop_after_attempt(30),
+        retry=retry_if_exception_type((JSONDecodeError, HTTPError)),
+        before_sleep=rate_limit_notifier(is_rate_limit),
+    )
+    async def acompletion(self, messages, **kwargs):
+        config = self._format_config_params(kwargs)
+        data = {"instances": [messages], "params": config}
+        content = None
+        try:
+            async with self.async_session.post(self.url, json=data) as result:
+                content = await result.read()
+                if result.status >= 400:
+                    # 与requests一致，通过response带上状态码和响应头
+                    response = requests.Response()
+                    response.status_code = result.status
+                    response.headers.update(result.headers)
+                    raise HTTPError(
+                        f"{result.status} {result.reason} for url: {self.url}",
+                        response=response,
+                    )
+            answer = json.loads(content)[0]
+        except JSONDecodeError as e:
+            logger.error(
+                f"JSONDecodeError in LocalRequest.acompletion: {e}\nResult: {content}"
+            )
+            raise
+        except HTTPError as e:
+            logger.warning(f"HTTPError in LocalRequest.acompletion: {e}\nResult: {content}")
+            raise
+        except Exception as e:
+            logger.error(f"Unexpected Error in LocalRequest.acompletion: {e}\n")
+            raise
         return answer, 1
 
     def _format_config_params(self, kwargs):
@@ -0,0 +1,502 @@
+import os
+import re
+import json
+import math
+import random
+import string
+import asyncio
+import logging
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import gevent
+from tenacity import (
+    retry,
+    stop_after_attempt,
+    wait_random_exponential,
+    retry_if_exception_type
+)
+from .limiter import estimate_tokens, rate_limit_notifier, call_once
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILE = {
+    "ttft_mean": 1.0,  # seconds before the first token, lognormal
+    "ttft_sigma": 0.5,
+    "tokens_per_second": 50,  # 0 means the output takes no time
+    "error_rate": 0.0,  # 500 errors, retried by the caller
+    "rate_limit_rate": 0.0,  # 429 errors with Retry-After
+    "retry_after": 1,
+    "malformed_rate": 0.0,  # answers the caller cannot parse
+    "sentences": [1, 3],  # sentences per description, controls the output tokens
+    "sections": [3, 5],  # sections of a generated outline
+    "subsections": [0, 2],
+    "group_size": 4,
+    "score_range": [6.0, 9.5],  # outline scores
+    "relevance_range": [40, 100],  # snippet and web page scores
+    "seed": None,
+}
+
+SENTENCES = [
+    "The reviewed studies address this aspect from complementary perspectives",
+    "Reported results vary with the datasets and evaluation protocols used",
+    "Several works propose lightweight variants that trade accuracy for efficiency",
+    "A common limitation is the lack of evaluation on realistic large scale settings",
+    "Comparing the experimental designs explains most of the divergent conclusions",
+    "Future work should unify the benchmarks to make the methods comparable",
+    "The theoretical analysis supports the empirical findings only partially",
+    "Combining the two lines of research is a promising direction",
+]
+SECTION_TITLES = [
+    "Background and Motivation",
+    "Problem Formulation",
+    "Representative Methods",
+    "Datasets and Benchmarks",
+    "Evaluation and Comparison",
+    "Applications",
+    "Open Challenges",
+    "Future Directions",
+]
+SUBSECTION_TITLES = ["Early Approaches", "Recent Advances", "Limitations", "Analysis"]
+
+
+class MockAPIError(Exception):
+    def __init__(self, status_code, message, retry_after=None):
+        super().__init__(f"{status_code} {message}")
+        self.status_code = status_code
+        self.response = MockResponse(status_code, retry_after)
+
+
+class MockResponse:
+    def __init__(self, status_code, retry_after=None):
+        self.status_code = status_code
+        self.headers = {"retry-after": str(retry_after)} if retry_after else {}
+
+
+class MockUsage:
+    def __init__(self, prompt_tokens, completion_tokens):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = prompt_tokens + completion_tokens
+
+    def __repr__(self):
+        return f"MockUsage(prompt_tokens={self.prompt_tokens}, completion_tokens={self.completion_tokens})"
+
+
+def is_rate_limit(e):
+    return isinstance(e, MockAPIError) and e.status_code == 429
+
+
+def load_mock_profile(model):
+    """
+    The profile of the model from the environment variable LLM_MOCK_CONFIG, a
+    json object of {model: {profile}}, the "default" entry applies to the
+    models not listed, see DEFAULT_PROFILE for the keys.
+    """
+    profile = dict(DEFAULT_PROFILE)
+    config = os.environ.get("LLM_MOCK_CONFIG")
+    if config:
+        try:
+            config = json.loads(config)
+            profile.update(config.get(model, config.get("default", {})))
+        except json.JSONDecodeError as e:
+            logger.error(f"Invalid LLM_MOCK_CONFIG: {e}")
+    return profile
+
+
+class PromptMatcher:
+    """
+    Finds the prompt family of a message by the literal text of the prompt
+    templates (en and zh), and the values of the template fields.
+    """
+
+    MIN_SCORE = 0.8
+
+    def __init__(self):
+        # the templates are only needed by the mock backend, request does not depend on src otherwise
+        from src.prompts import get_prompts
+
+        self.templates = []  # (name, literal chunks, pattern)
+        for language in ["en", "zh"]:
+            prompts = get_prompts(language)
+            for name in dir(prompts):
+                template = getattr(prompts, name)
+                if "_PROMPT" in name and isinstance(template, str):
+                    try:
+                        self.templates.append((name, *self._compile(template)))
+                    except ValueError:
+                        # not a format template, e.g. a json example in braces
+                        continue
+
+    def match(self, text):
+        best_name, best_score, best_pattern = None, (0, 0), None
+        for name, chunks, pattern in self.templates:
+            total = sum(len(chunk) for chunk in chunks)
+            if total == 0:
+                continue
+            matched = sum(len(chunk) for chunk in chunks if chunk in text)
+            # the template fully contained wins, a longer template is more specific
+            score = (matched / total, matched)
+            if score > best_score:
+                best_name, best_score, best_pattern = name, score, pattern
+        if best_score[0] < self.MIN_SCORE:
+            return None, {}
+        match = best_pattern.search(text)
+        return best_name, match.groupdict() if match else {}
+
+    def _compile(self, template):
+        chunks, pattern, fields = [], "", set()
+        for literal, field, _, _ in string.Formatter().parse(template):
+            # the callers may rewrite the bibkey lists of a prompt (process_bibkeys), so
+            # the bracketed parts of the template match any bracketed text
+            parts = re.split(r"(\[[^\[\]\n]*\])", literal)
+            for i, part in enumerate(parts):
+                if i % 2:
+                    pattern += r"\[[^\[\]\n]*\]"
+                else:
+                    pattern += re.escape(part)
+                    if part.strip():
+                        chunks.append(part.strip())
+            if field is None:
+                continue
+            if not field.isidentifier():
+                raise ValueError(f"Invalid field {field}")
+            if field in fields:
+                pattern += f"(?P={field})"
+            else:
+                pattern += f"(?P<{field}>.*?)"
+                fields.add(field)
+        return chunks, re.compile(pattern, re.DOTALL)
+
+
+class MockRequest:
+    """
+    Offline backend answering every prompt family of src/prompts with text the
+    callers can parse (outlines, digests, suggestions, <SCORE> tags, group
+    lists...), with tunable latency, errors and output length, to run the
+    whole pipeline without a network, see load_mock_profile.
+    """
+
+    _matcher = None
+
+    def __init__(self, model="mock", profile=None):
+        self.model = model
+        self.profile = dict(DEFAULT_PROFILE)
+        self.profile.update(profile or load_mock_profile(model))
+        self.random = random.Random(self.profile["seed"])
+        self.request_count = 0
+
+    @property
+    def matcher(self):
+        if MockRequest._matcher is None:
+            MockRequest._matcher = PromptMatcher()
+        return MockRequest._matcher
+
+    @retry(
+        wait=wait_random_exponential(multiplier=0.5, max=10),
+        stop=stop_after_attempt(10),
+        retry=retry_if_exception_type(MockAPIError),
+        before_sleep=rate_limit_notifier(is_rate_limit),
+    )
+    def completion(self, messages, **kwargs):
+        answer, token_usage, latency = self._generate(messages)
+        gevent.sleep(latency)
+        return answer, token_usage
+
+    @retry(
+        wait=wait_random_exponential(multiplier=0.5, max=10),
+        stop=stop_after_attempt(10),
+        retry=retry_if_exception_type(MockAPIError),
+        before_sleep=rate_limit_notifier(is_rate_limit),
+    )
+    async def acompletion(self, messages, **kwargs):
+        answer, token_usage, latency = self._generate(messages)
+        await asyncio.sleep(latency)
+        return answer, token_usage
+
+    @retry(
+        wait=wait_random_exponential(multiplier=0.5, max=10),
+        stop=stop_after_attempt(10),
+        retry=retry_if_exception_type(MockAPIError),
+        before_sleep=rate_limit_notifier(is_rate_limit),
+    )
+    def _create_stream(self, messages):
+        answer, token_usage, _ = self._generate(messages)
+        gevent.sleep(self._sample_ttft())
+        return answer, token_usage
+
+    @retry(
+        wait=wait_random_exponential(multiplier=0.5, max=10),
+        stop=stop_after_attempt(10),
+        retry=retry_if_exception_type(MockAPIError),
+        before_sleep=rate_limit_notifier(is_rate_limit),
+    )
+    async def _acreate_stream(self, messages):
+        answer, token_usage, _ = self._generate(messages)
+        await asyncio.sleep(self._sample_ttft())
+        return answer, token_usage
+
+    def stream_completion(self, messages, **kwargs):
+        """
+        Yields (text delta, token usage) like OpenAIRequest.stream_completion,
+        the output time is spread over the chunks.
+        """
+        answer, token_usage = call_once(self._create_stream, messages)
+        chunks = self._split_chunks(answer)
+        for i, chunk in enumerate(chunks):
+            gevent.sleep(self._output_time(chunk))
+            yield chunk, token_usage if i == len(chunks) - 1 else None
+
+    async def astream_completion(self, messages, **kwargs):
+        answer, token_usage = await call_once(self._acreate_stream, messages)
+        chunks = self._split_chunks(answer)
+        for i, chunk in enumerate(chunks):
+            await asyncio.sleep(self._output_time(chunk))
+            yield chunk, token_usage if i == len(chunks) - 1 else None
+
+    def answer(self, text):
+        """
+        The answer to the prompt text, without latency and errors.
+        """
+        name, fields = self.matcher.match(text)
+        generate = getattr(self, f"_answer_{name.lower()}", None) if name else None
+        if generate is None:
+            return self._paragraph(self._get_bibkeys(text))
+        return generate(text, fields)
+
+    def _generate(self, messages):
+        self.request_count += 1
+        rand = self.random.random()
+        if rand < self.profile["rate_limit_rate"]:
+            raise MockAPIError(429, "Mock rate limit", self.profile["retry_after"])
+        if rand < self.profile["rate_limit_rate"] + self.profile["error_rate"]:
+            raise MockAPIError(500, "Mock internal server error")
+
+        text = "\n".join(message["content"] for message in messages)
+        if self.random.random() < self.profile["malformed_rate"]:
+            answer = "I am sorry, I can not finish this task."
+        else:
+            answer = self.answer(text)
+        token_usage = MockUsage(
+            estimate_tokens(messages), estimate_tokens([{"content": answer}])
+        )
+        latency = self._sample_ttft() + self._output_time(answer)
+        return answer, token_usage, latency
+
+    def _sample_ttft(self):
+        mean, sigma = self.profile["ttft_mean"], self.profile["ttft_sigma"]
+        if mean <= 0:
+            return 0
+        # lognormal with the configured mean
+        return self.random.lognormvariate(math.log(mean) - sigma**2 / 2, sigma)
+
+    def _output_time(self, text):
+        if not self.profile["tokens_per_second"]:
+            return 0
+        return estimate_tokens([{"content": text}]) / self.profile["tokens_per_second"]
+
+    def _split_chunks(self, answer, size=16):
+        return [answer[i : i + size] for i in range(0, len(answer), size)] or [""]
+
+    # ----- text helpers -----
+
+    def _randint(self, key):
+        low, high = self.profile[key]
+        return self.random.randint(low, high)
+
+    def _cite(self, bibkeys, count=2):
+        if not bibkeys:
+            return ""
+        cited = self.random.sample(bibkeys, min(count, len(bibkeys)))
+        return " [" + ", ".join(f"'{bibkey}'" for bibkey in cited) + "]"
+
+    def _paragraph(self, bibkeys=None):
+        sentences = self.random.sample(SENTENCES, min(self._randint("sentences"), len(SENTENCES)))
+        return " ".join(f"{sentence}{self._cite(bibkeys)}." for sentence in sentences)
+
+    def _get_bibkeys(self, text):
+        bibkeys = re.findall(r"Bibkey: '([^'\n]+)'", text)
+        for group in re.findall(r"\[([^\[\]\n]+)\]", text):
+            for bibkey in group.split(","):
+                bibkey = bibkey.strip().strip("'\"").strip()
+                if re.fullmatch(r"[\w\-:./]+", bibkey) and not bibkey.startswith("BIBKEY"):
+                    bibkeys.append(bibkey)
+        return list(dict.fromkeys(bibkeys))
+
+    def _score(self, key, digits=1):
+        low, high = self.profile[key]
+        return round(self.random.uniform(low, high), digits)
+
+    def _outline(self, title, bibkeys):
+        lines = [f"# {title}"]
+        section_count = self._randint("sections")
+        for i, section in enumerate(self.random.sample(SECTION_TITLES, section_count)):
+            lines += self._outline_section(f"## {i + 1} {section}", bibkeys)
+            for j in range(self._randint("subsections")):
+                lines += self._outline_section(
+                    f"### {i + 1}.{j + 1} {SUBSECTION_TITLES[j % len(SUBSECTION_TITLES)]}", bibkeys
+                )
+        return "\n".join(lines)
+
+    def _outline_section(self, heading, bibkeys):
+        return [
+            heading,
+            "Digest Construction: ",
+            self._paragraph(bibkeys),
+            "Digest Analysis: ",
+            self._paragraph(bibkeys),
+        ]
+
+    def _suggestion(self, text):
+        return f"Rationale:\n{self._paragraph()}\n\n```suggestion\n{self._paragraph(self._get_bibkeys(text))}\n```"
+
+    # ----- prompt families -----
+
+    def _answer_group_prompt(self, text, fields):
+        bibkeys = re.findall(r"Bibkey: '([^'\n]+)'", fields.get("titles", text))
+        self.random.shuffle(bibkeys)
+        size = self.profile["group_size"]
+        groups = []
+        for i in range(0, len(bibkeys), size):
+            papers = ", ".join(f'"{bibkey}"' for bibkey in bibkeys[i : i + size])
+            groups.append(f"Group {i // size + 1}:\nPapers: [{papers}]\nReason: Similar research direction.")
+        groups = "\n".join(groups)
+        return f"Rationale:\nGroup by research direction.\n\nGroup Result:\n```markdown\n{groups}\n```"
+
+    def _answer_init_outline_prompt(self, text, fields):
+        title = fields.get("title", "Survey")
+        return f"```markdown\n{self._outline(title, self._get_bibkeys(text))}\n```"
+
+    _answer_concat_outline_prompt = _answer_init_outline_prompt
+
+    def _answer_modify_outline_prompt(self, text, fields):
+        old_outline = fields.get("old_outline", "").strip()
+        if not old_outline.startswith("#"):
+            return self._answer_init_outline_prompt(text, fields)
+        # 保持大纲结构，在最后一节补充一句描述
+        return f"```markdown\n{old_outline}\n{self._paragraph(self._get_bibkeys(text))}\n```"
+
+    _answer_residual_modify_outline_prompt = _answer_modify_outline_prompt
+
+    def _answer_single_digest_prompt(self, text, fields):
+        match = re.search(r"Bibkey[^\n]*\n\[['\"]([^'\"\]]+)['\"]\]", text)
+        bibkeys = [match.group(1)] if match else []
+        lines = []
+        for line in fields.get("outline_example", "").strip().split("\n"):
+            if re.match(r"^#+\s", line):
+                lines.append(line)
+                if not line.startswith("# "):
+                    lines.append(self._paragraph(bibkeys))
+        digest = "\n".join(lines)
+        suggestion = self._paragraph(bibkeys)
+        return f"Paper Digest:\n```markdown\n{digest}\n```\n\nSuggestion:\n```suggestion\n{suggestion}\n```"
+
+    _answer_single_digest_prefix_prompt = _answer_single_digest_prompt
+
+    def _answer_digest_base_prompt(self, text, fields):
+        return self._suggestion(text)
+
+    _answer_digest_free_prompt = _answer_digest_base_prompt
+    _answer_outline_convolution_prompt = _answer_digest_base_prompt
+
+    def _answer_outline_entropy_prompt(self, text, fields):
+        return f"Rationale:\n{self._paragraph()}\n\nScore: <SCORE>{self._score('score_range')}</SCORE>"
+
+    def _answer_orchestra_prompt(self, text, fields):
+        bibkeys = self._get_bibkeys(fields.get("digest", text))
+        paragraphs = "\n\n".join(self._paragraph(bibkeys) for _ in range(2))
+        return f"```markdown\n{paragraphs}\n```"
+
+    def _answer_summary_prompt(self, text, fields):
+        bibkeys = self._get_bibkeys(fields.get("subcontents", "") + fields.get("digest", text))
+        return f"```markdown\n{self._paragraph(bibkeys)}\n```"
+
+    def _answer_polish_prompt(self, text, fields):
+        return f"```markdown\n{fields.get('content', '').strip()}\n```"
+
+    def _answer_chart_prompt(self, text, fields):
+        content = fields.get("content", text)
+        match = re.search(r"^#+\s*[\d\.]*\s+(.+)\n+([^#\n][^\n]*)", content, re.MULTILINE)
+        if not match:
+            return "No suitable chart."
+        section_title = match.group(1).strip()
+        sentence = re.split(r"(?<=\.)\s", match.group(2).strip())[0]
+        return (
+            f"Section Title: {section_title}\nPosition Sentence: {sentence}\nFigure Title: Overview of {section_title}\n"
+            f'```mermaid\ngraph TD\n    A["{section_title}"] --> B["Methods"]\n    A --> C["Challenges"]\n```\n'
+        )
+
+    def _answer_query_expand_prompt_with_abstract(self, text, fields):
+        topic = fields.get("topic", "topic").strip()
+        queries = [topic] + [f"{topic} {aspect}" for aspect in ["methods", "benchmarks", "challenges"]]
+        return "```markdown\n" + "".join(f"{query};\n" for query in queries) + "```"
+
+    _answer_query_expand_prompt_without_abstract = _answer_query_expand_prompt_with_abstract
+
+    def _answer_llm_check_prompt(self, text, fields):
+        queries = ",".join(re.findall(r"'([^']+)'", fields.get("queries", "")))
+        return f"AI's assessment: No modifications needed.\nThis round's output queries: {queries}"
+
+    def _answer_user_check_prompt(self, text, fields):
+        return ",".join(re.findall(r"'([^']+)'", fields.get("queries", "")))
+
+    def _answer_snippet_filter_prompt(self, text, fields):
+        return f"Reason: {self._paragraph()}\nSimilarity score: <SCORE>{int(self._score('relevance_range'))}</SCORE>"
+
+    def _answer_page_refine_prompt(self, text, fields):
+        topic = fields.get("topic", "").strip()
+        content = fields.get("raw_content", "").strip()
+        return f"<TITLE>{topic}: {content[:40].strip()}</TITLE>\n<CONTENT>{content}</CONTENT>"
+
+    def _answer_similarity_prompt(self, text, fields):
+        topic = fields.get("topic", "").strip()
+        return (
+            f"Rationale: {self._paragraph()}\n"
+            f"Relevance score: <SCORE>{int(self._score('relevance_range'))}</SCORE>\n"
+            f"Title: <TITLE>{topic}</TITLE>"
+        )
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """
+    /infer stand-in of a local model server for LocalRequest: takes
+    {"instances": [messages], "params": {}} and answers the list of texts.
+    """
+
+    mock = None
+
+    def do_POST(self):
+        try:
+            data = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            results = [self.mock._generate(messages) for messages in data["instances"]]
+            # 一批请求并行推理，耗时取最慢的一条；重试由客户端负责
+            gevent.sleep(max(latency for _, _, latency in results))
+            answers = [answer for answer, _, _ in results]
+            status, body = 200, json.dumps(answers, ensure_ascii=False)
+        except MockAPIError as e:
+            status, body = e.status_code, json.dumps({"error": str(e)})
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(port, model="mock"):
+    MockHandler.mock = MockRequest(model=model)
+    server = ThreadingHTTPServer(("0.0.0.0", port), MockHandler)
+    logger.info(f"Mock LLM server listening on port {port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock LLM server compatible with LocalRequest")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--model", type=str, default="mock", help="model name to read from LLM_MOCK_CONFIG")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    serve(args.port, args.model)
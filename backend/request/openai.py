@@ -1,5 +1,7 @@
 import os
-from openai import OpenAI, InternalServerError, RateLimitError, APIError
+import asyncio
+import weakref
+from openai import OpenAI, AsyncOpenAI, InternalServerError, RateLimitError, APIError
 from tenacity import (
     retry,
     stop_after_attempt,
@@ -7,45 +9,161 @@ from tenacity import (
     before_sleep_log,
     retry_if_exception_type
 )
+from .limiter import rate_limit_notifier, call_once
 import logging
 logger = logging.getLogger(__name__)
 
 
 class OpenAIRequest:
-    def __init__(self, model):
-        self.client = OpenAI(
-            api_key=os.environ.get("OPENAI_API_KEY"),
-            base_url=os.environ.get("OPENAI_API_BASE"),
-        )
+    # 同一个base url的请求共用一个客户端，复用其keep-alive连接池
+    _clients = {}  # (base_url, api_key): OpenAI
+    # 异步客户端的连接池绑定在事件循环上，每个事件循环各自共享
+    _async_clients = weakref.WeakKeyDictionary()  # loop: {(base_url, api_key): AsyncOpenAI}
+
+    def __init__(self, model, base_url=None, api_key=None):
+        self.api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        self.base_url = base_url or os.environ.get("OPENAI_API_BASE")
         self.model = model
 
+    @property
+    def supports_prompt_cache_key(self):
+        # 其他兼容OpenAI接口的服务（vLLM、DeepSeek等）自动按前缀缓存，但可能拒绝未知参数
+        return self.base_url is None or "api.openai.com" in self.base_url
+
+    @property
+    def client(self):
+        key = (self.base_url, self.api_key)
+        if key not in self._clients:
+            self._clients[key] = OpenAI(api_key=self.api_key, base_url=self.base_url)
+        return self._clients[key]
+
+    @property
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        clients = self._async_clients.setdefault(loop, {})
+        key = (self.base_url, self.api_key)
+        if key not in clients:
+            clients[key] = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
+        return clients[key]
+
+    @classmethod
+    async def aclose_clients(cls):
+        """
+        Closes the async clients of the running event loop, should be awaited
+        before the loop finishes, see request.run_async.
+        """
+        clients = cls._async_clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            await client.close()
+
     @retry(
         wait=wait_random_exponential(multiplier=2, max=60),
         stop=stop_after_attempt(100),
-        retry=retry_if_exception_type((RateLimitError, InternalServerError, APIError)) # 如果不是这几个错就不retry了
+        retry=retry_if_exception_type((RateLimitError, InternalServerError, APIError)), # 如果不是这几个错就不retry了
+        before_sleep=rate_limit_notifier(lambda e: isinstance(e, RateLimitError)),
         )
     def completion(self, messages, **kwargs):
         try:
             response = self.client.chat.completions.create(
                 model=self.model, messages=messages, **kwargs
             )
-            # 新增检查：确保响应包含有效的 choices 数据
-            if not response.choices or len(response.choices) == 0:
-                error_msg = "OpenAI API returned empty choices in response"
-                logger.debug(error_msg)
-                raise ValueError(error_msg)
-            answer = response.choices[0].message.content
-            token_usage = response.usage
-
-        except RateLimitError as e:
+            return self._parse_response(response)
+        except Exception as e:
+            self._log_error(e, messages)
+            raise
+
+    @retry(
+        wait=wait_random_exponential(multiplier=2, max=60),
+        stop=stop_after_attempt(100),
+        retry=retry_if_exception_type((RateLimitError, InternalServerError, APIError)),
+        before_sleep=rate_limit_notifier(lambda e: isinstance(e, RateLimitError)),
+        )
+    async def acompletion(self, messages, **kwargs):
+        try:
+            response = await self.async_client.chat.completions.create(
+                model=self.model, messages=messages, **kwargs
+            )
+            return self._parse_response(response)
+        except Exception as e:
+            self._log_error(e, messages)
+            raise
+
+    @retry(
+        wait=wait_random_exponential(multiplier=2, max=60),
+        stop=stop_after_attempt(100),
+        retry=retry_if_exception_type((RateLimitError, InternalServerError, APIError)),
+        before_sleep=rate_limit_notifier(lambda e: isinstance(e, RateLimitError)),
+        )
+    def _create_stream(self, messages, **kwargs):
+        try:
+            return self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+                **kwargs,
+            )
+        except Exception as e:
+            self._log_error(e, messages)
+            raise
+
+    @retry(
+        wait=wait_random_exponential(multiplier=2, max=60),
+        stop=stop_after_attempt(100),
+        retry=retry_if_exception_type((RateLimitError, InternalServerError, APIError)),
+        before_sleep=rate_limit_notifier(lambda e: isinstance(e, RateLimitError)),
+        )
+    async def _acreate_stream(self, messages, **kwargs):
+        try:
+            return await self.async_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+                **kwargs,
+            )
+        except Exception as e:
+            self._log_error(e, messages)
+            raise
+
+    def stream_completion(self, messages, **kwargs):
+        """
+        Yields (text delta, token usage) of each chunk, the usage is only set
+        in the last chunk. Closing the generator closes the http stream. The
+        stream is opened once, RequestWrapper retries the failed requests.
+        """
+        stream = call_once(self._create_stream, messages, **kwargs)
+        try:
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                yield delta or "", chunk.usage
+        finally:
+            stream.close()
+
+    async def astream_completion(self, messages, **kwargs):
+        stream = await call_once(self._acreate_stream, messages, **kwargs)
+        try:
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                yield delta or "", chunk.usage
+        finally:
+            await stream.close()
+
+    def _parse_response(self, response):
+        # 新增检查：确保响应包含有效的 choices 数据
+        if not response.choices or len(response.choices) == 0:
+            error_msg = "OpenAI API returned empty choices in response"
+            logger.debug(error_msg)
+            raise ValueError(error_msg)
+        answer = response.choices[0].message.content
+        token_usage = response.usage
+        return answer, token_usage
+
+    def _log_error(self, e, messages):
+        if isinstance(e, RateLimitError):
             logger.warning(f"Rate limit exceeded in OpenAIRequest.completion: {e}")
-            raise 
-        except InternalServerError as e:
+        elif isinstance(e, InternalServerError):
             logger.warning(f"Internal server error in OpenAIRequest.completion: {e}")
             # logger.warning(f"Prompt: {messages}")
-            raise 
-        except Exception as e:
+        elif not isinstance(e, ValueError):
             logger.error(f"Unexpected error in OpenAIRequest.completion: {e}. messages: \n{messages}")
-            raise 
-                
-        return answer, token_usage
@@ -0,0 +1,343 @@
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+
+from tenacity import (
+    retry,
+    stop_after_attempt,
+    wait_random_exponential,
+    retry_if_exception,
+)
+
+from .local import LocalRequest
+from .openai import OpenAIRequest
+from .google import GoogleRequest
+from .mock import MockRequest
+from .limiter import (
+    get_limiter,
+    get_retry_after,
+    is_rate_limit_error,
+    is_client_error,
+    call_once,
+)
+
+logger = logging.getLogger(__name__)
+
+EWMA_ALPHA = 0.2
+MAX_CONSECUTIVE_FAILURES = 3
+MAX_EJECTION_TIME = 300
+# a request with a prompt prefix stays on the backend caching the prefix unless it costs more than this times another one
+PREFIX_AFFINITY_SLACK = 2
+
+
+def is_retryable(exception):
+    return isinstance(exception, Exception) and not is_client_error(exception)
+
+
+class Backend:
+    """
+    One endpoint of a logical model and its health.
+    """
+
+    def __init__(self, name, request, weight=1):
+        self.name = name
+        self.request = request
+        self.weight = weight
+        self.latency = None  # EWMA of the latency in seconds
+        self.error_rate = 0.0  # EWMA of the failures
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.ejection_count = 0
+        self.ejected_until = 0
+
+    def is_available(self, now):
+        return now >= self.ejected_until
+
+    def cost(self, default_latency):
+        latency = self.latency if self.latency is not None else default_latency
+        return latency * (self.in_flight + 1) * (1 + 4 * self.error_rate) / self.weight
+
+    def on_success(self, latency):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += EWMA_ALPHA * (latency - self.latency)
+        self.error_rate *= 1 - EWMA_ALPHA
+        self.consecutive_failures = 0
+        self.ejection_count = 0
+
+    def on_failure(self, exception):
+        self.error_rate += EWMA_ALPHA * (1 - self.error_rate)
+        self.consecutive_failures += 1
+        if is_rate_limit_error(exception):
+            # the quota of the backend is used up, leave it until the quota is back
+            self.eject(get_retry_after(exception) or 5)
+        elif self.consecutive_failures >= MAX_CONSECUTIVE_FAILURES:
+            self.eject(min(MAX_EJECTION_TIME, 10 * 2 ** self.ejection_count))
+            self.ejection_count += 1
+
+    def eject(self, seconds):
+        self.ejected_until = max(self.ejected_until, time.monotonic() + seconds)
+        logger.warning(f"Eject backend {self.name} for {seconds:.0f}s")
+
+    def snapshot(self):
+        return {
+            "name": self.name,
+            "latency": self.latency,
+            "error_rate": self.error_rate,
+            "in_flight": self.in_flight,
+            "ejected": not self.is_available(time.monotonic()),
+        }
+
+
+class Router:
+    """
+    Spreads the requests of a logical model over several backends, has the
+    same interface as the request backends so RequestWrapper uses it as its
+    request pool.
+
+    Each request goes to the cheaper of two random available backends (power
+    of two choices), the cost grows with the latency EWMA, the requests in
+    flight and the error rate, and shrinks with the weight. A backend is
+    ejected after consecutive failures (10s, doubled each time, at most 5
+    minutes) or for the Retry-After time on a rate limit error, a failed
+    request is retried on the other backends (RequestWrapper calls the router
+    once per attempt, each attempt goes through the model limiter). A client error (4xx other
+    than 408 and 429) is the fault of the request, it is neither counted
+    against the backend nor retried.
+
+    The requests with the same prompt_cache_key (the hash of a shared prompt
+    prefix) prefer the same backend, which has the prefix in its cache, the
+    key is only passed on to the backends supporting it.
+    """
+
+    supports_prompt_cache_key = True
+
+    def __init__(self, model, backends):
+        if not backends:
+            raise ValueError(f"No backend for model {model}")
+        self.model = model
+        self.backends = backends
+
+    @retry(
+        wait=wait_random_exponential(multiplier=0.5, max=30),
+        stop=stop_after_attempt(10),
+        retry=retry_if_exception(is_retryable),
+        reraise=True,
+    )
+    def completion(self, messages, prompt_cache_key=None, **kwargs):
+        backend = self._choose(prompt_cache_key)
+        kwargs = self._get_backend_kwargs(backend, kwargs, prompt_cache_key)
+        start_time = self._start(backend)
+        try:
+            result = call_once(backend.request.completion, messages, **kwargs)
+        except Exception as e:
+            self._fail(backend, e)
+            raise
+        except BaseException:
+            # killed, e.g. the task is cancelled or the hedged request lost
+            backend.in_flight -= 1
+            raise
+        self._succeed(backend, start_time)
+        return result
+
+    @retry(
+        wait=wait_random_exponential(multiplier=0.5, max=30),
+        stop=stop_after_attempt(10),
+        retry=retry_if_exception(is_retryable),
+        reraise=True,
+    )
+    async def acompletion(self, messages, prompt_cache_key=None, **kwargs):
+        backend = self._choose(prompt_cache_key)
+        kwargs = self._get_backend_kwargs(backend, kwargs, prompt_cache_key)
+        start_time = self._start(backend)
+        try:
+            result = await call_once(backend.request.acompletion, messages, **kwargs)
+        except Exception as e:
+            self._fail(backend, e)
+            raise
+        except BaseException:
+            # killed, e.g. the task is cancelled or the hedged request lost
+            backend.in_flight -= 1
+            raise
+        self._succeed(backend, start_time)
+        return result
+
+    def stream_completion(self, messages, prompt_cache_key=None, **kwargs):
+        backend = self._choose(prompt_cache_key)
+        kwargs = self._get_backend_kwargs(backend, kwargs, prompt_cache_key)
+        start_time = self._start(backend)
+        try:
+            if hasattr(backend.request, "stream_completion"):
+                yield from backend.request.stream_completion(messages, **kwargs)
+            else:
+                yield call_once(backend.request.completion, messages, **kwargs)
+        except GeneratorExit:
+            # closed by the caller once the output is enough, also a success
+            self._succeed(backend, start_time)
+            raise
+        except Exception as e:
+            self._fail(backend, e)
+            raise
+        except BaseException:
+            backend.in_flight -= 1
+            raise
+        else:
+            self._succeed(backend, start_time)
+
+    async def astream_completion(self, messages, prompt_cache_key=None, **kwargs):
+        backend = self._choose(prompt_cache_key)
+        kwargs = self._get_backend_kwargs(backend, kwargs, prompt_cache_key)
+        start_time = self._start(backend)
+        stream = None
+        try:
+            if hasattr(backend.request, "astream_completion"):
+                stream = backend.request.astream_completion(messages, **kwargs)
+                async for chunk in stream:
+                    yield chunk
+            else:
+                yield await call_once(backend.request.acompletion, messages, **kwargs)
+        except GeneratorExit:
+            self._succeed(backend, start_time)
+            raise
+        except Exception as e:
+            self._fail(backend, e)
+            raise
+        except BaseException:
+            backend.in_flight -= 1
+            raise
+        else:
+            self._succeed(backend, start_time)
+        finally:
+            if stream is not None:
+                await stream.aclose()
+
+    def snapshot(self):
+        return {"model": self.model, "backends": [b.snapshot() for b in self.backends]}
+
+    def _choose(self, prefix_key=None):
+        now = time.monotonic()
+        available = [b for b in self.backends if b.is_available(now)]
+        if not available:
+            # all ejected, try the one coming back first
+            return min(self.backends, key=lambda b: b.ejected_until)
+        if len(available) == 1:
+            return available[0]
+        latencies = [b.latency for b in available if b.latency is not None]
+        # backends without a measurement look as fast as the fastest one, so they get tried
+        default_latency = min(latencies) if latencies else 1.0
+        if prefix_key:
+            # rendezvous hashing, only the prefixes of a removed backend move
+            preferred = max(
+                available,
+                key=lambda b: hashlib.md5(f"{prefix_key}:{b.name}".encode()).digest(),
+            )
+            other = random.choice([b for b in available if b is not preferred])
+            if preferred.cost(default_latency) <= PREFIX_AFFINITY_SLACK * other.cost(default_latency):
+                return preferred
+            return other
+        candidates = random.sample(available, 2)
+        return min(candidates, key=lambda b: b.cost(default_latency))
+
+    def _get_backend_kwargs(self, backend, kwargs, prompt_cache_key):
+        if prompt_cache_key and getattr(backend.request, "supports_prompt_cache_key", False):
+            return dict(kwargs, prompt_cache_key=prompt_cache_key)
+        return kwargs
+
+    def _start(self, backend):
+        backend.in_flight += 1
+        return time.monotonic()
+
+    def _succeed(self, backend, start_time):
+        backend.in_flight -= 1
+        backend.on_success(time.monotonic() - start_time)
+
+    def _fail(self, backend, exception):
+        backend.in_flight -= 1
+        if is_client_error(exception):
+            # the request itself is wrong, not the backend, e.g. the context is too long
+            logger.warning(f"Request to {self.model} rejected by backend {backend.name}: {exception}")
+            return
+        backend.on_failure(exception)
+        logger.warning(f"Request to backend {backend.name} of {self.model} failed: {exception}")
+        now = time.monotonic()
+        if is_rate_limit_error(exception) and not any(
+            b.is_available(now) for b in self.backends
+        ):
+            # every backend is out of quota, slow down the model as a whole
+            get_limiter(self.model).on_rate_limit(get_retry_after(exception))
+
+
+def build_backend(config):
+    infer_type = config.get("infer_type", "OpenAI")
+    if infer_type == "OpenAI":
+        request = OpenAIRequest(
+            model=config["model"],
+            base_url=config.get("base_url"),
+            api_key=config.get("api_key"),
+        )
+        name = f"{config['model']}@{request.base_url}"
+    elif infer_type == "Google":
+        request = GoogleRequest(model=config["model"])
+        name = f"{config['model']}@google"
+    elif infer_type == "local":
+        request = LocalRequest(
+            port=config.get("port"),
+            model=config.get("model"),
+            url=config.get("url"),
+            max_batch_size=config.get("max_batch_size"),
+            batch_wait=config.get("batch_wait"),
+        )
+        name = request.url
+    elif infer_type == "mock":
+        request = MockRequest(model=config.get("model", "mock"), profile=config.get("profile"))
+        name = f"{request.model}@mock"
+    else:
+        raise ValueError(
+            f"Invalid infer_type: {infer_type}, should be OpenAI, Google, local or mock"
+        )
+    return Backend(config.get("name", name), request, weight=config.get("weight", 1))
+
+
+_routers = {}  # model: Router
+
+
+def load_routes():
+    """
+    The backends of each logical model from the environment variable
+    LLM_ROUTES, a json object of {model: [backend config]}, a backend config
+    has infer_type (OpenAI, Google or local), model, base_url and api_key
+    (OpenAI), port or url and optional max_batch_size and batch_wait (local),
+    an optional profile (mock, see request.mock.DEFAULT_PROFILE), and an
+    optional name and weight.
+    """
+    routes = os.environ.get("LLM_ROUTES")
+    if not routes:
+        return {}
+    try:
+        return json.loads(routes)
+    except json.JSONDecodeError as e:
+        logger.error(f"Invalid LLM_ROUTES: {e}")
+        return {}
+
+
+def get_router(model):
+    """
+    The router of the logical model shared by all the RequestWrappers, None
+    if the model is not routed.
+    """
+    if model not in _routers:
+        routes = load_routes()
+        if model not in routes:
+            return None
+        backends = [build_backend(config) for config in routes[model]]
+        _routers[model] = Router(model, backends)
+        logger.info(f"Route {model} to {[b.name for b in backends]}")
+    return _routers[model]
+
+
+def get_all_routers():
+    return list(_routers.values())
@@ -0,0 +1,38 @@
+class StopAfterMarkers:
+    """
+    Stop predicate of a streaming completion, true once all the markers have
+    appeared in the text in order. The text only grows during a stream, so the
+    search continues from where the last call stopped. A new instance is
+    needed for each request.
+    """
+
+    def __init__(self, *markers):
+        self.markers = markers
+        self.index = 0
+        self.position = 0
+
+    def __call__(self, text):
+        while self.index < len(self.markers):
+            marker = self.markers[self.index]
+            found = text.find(marker, self.position)
+            if found == -1:
+                # the marker may be cut at the end of the current text
+                self.position = max(self.position, len(text) - len(marker) + 1)
+                return False
+            self.position = found + len(marker)
+            self.index += 1
+        return True
+
+
+def stop_after_md_block(label="markdown"):
+    """
+    Stops the stream once the first ```label block is closed, as parse_md_content only reads that block.
+    """
+    return StopAfterMarkers(f"```{label}\n", "\n```")
+
+
+def stop_after_tags(*tags):
+    """
+    Stops the stream once the tags are closed in order, e.g. stop_after_tags("TITLE", "CONTENT").
+    """
+    return StopAfterMarkers(*[f"</{tag}>" for tag in tags])
@@ -0,0 +1,235 @@
+import os
+import json
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import gevent
+from async_d.cancel import current_key, current_stage
+from .limiter import estimate_tokens, get_total_tokens
+
+logger = logging.getLogger(__name__)
+
+MAX_TASK_NUM = 10000
+OTHER_STAGE = "other"
+
+
+def split_tokens(token_usage, message=None):
+    """
+    (prompt tokens, completion tokens) of a request.
+    """
+    prompt_tokens = getattr(token_usage, "prompt_tokens", None)
+    if prompt_tokens is not None:
+        return prompt_tokens, getattr(token_usage, "completion_tokens", None) or 0
+    # only the total is known (Google, early stopped streams), split it by the estimated prompt length
+    total_tokens = get_total_tokens(token_usage) or 0
+    prompt_tokens = min(estimate_tokens(message), total_tokens) if message else 0
+    return prompt_tokens, total_tokens - prompt_tokens
+
+
+class UsageCounter:
+    """
+    Calls, tokens and cost of a group of requests.
+    """
+
+    __slots__ = ("calls", "prompt_tokens", "completion_tokens", "cost")
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+
+    @property
+    def total_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, prompt_tokens, completion_tokens, cost):
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cost += cost
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "cost": round(self.cost, 6),
+        }
+
+
+class TaskUsage:
+    """
+    Usage of one task in total, by stage (the pipeline node the request is
+    sent from) and by model, with the optional budget of the task.
+    """
+
+    def __init__(self, task_id, max_tokens=None, max_cost=None):
+        self.task_id = task_id
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.total = UsageCounter()
+        self.stages = {}  # stage: UsageCounter
+        self.models = {}  # model: UsageCounter
+        self.version = 0  # bumped on each record, to persist only the changed usages
+        self._warned = False
+
+    def add(self, model, stage, prompt_tokens, completion_tokens, cost):
+        for counters, key in ((self.stages, stage), (self.models, model)):
+            if key not in counters:
+                counters[key] = UsageCounter()
+            counters[key].add(prompt_tokens, completion_tokens, cost)
+        self.total.add(prompt_tokens, completion_tokens, cost)
+        self.version += 1
+        if self.is_over_budget() and not self._warned:
+            self._warned = True
+            logger.warning(
+                f"Task {self.task_id} is over its budget: {self.total.total_tokens} tokens "
+                f"(max {self.max_tokens}), cost {self.total.cost:.4f} (max {self.max_cost})"
+            )
+
+    def is_over_budget(self):
+        if self.max_tokens and self.total.total_tokens >= self.max_tokens:
+            return True
+        if self.max_cost and self.total.cost >= self.max_cost:
+            return True
+        return False
+
+    def to_dict(self):
+        return {
+            **self.total.to_dict(),
+            "max_tokens": self.max_tokens,
+            "max_cost": self.max_cost,
+            "over_budget": self.is_over_budget(),
+            "stages": {stage: c.to_dict() for stage, c in self.stages.items()},
+            "models": {model: c.to_dict() for model, c in self.models.items()},
+        }
+
+
+def load_prices():
+    """
+    The prices of the models from the environment variable LLM_PRICES, a json
+    object of {model: [prompt price, completion price]} per million tokens.
+    """
+    prices = os.environ.get("LLM_PRICES")
+    if not prices:
+        return {}
+    try:
+        return json.loads(prices)
+    except json.JSONDecodeError as e:
+        logger.error(f"Invalid LLM_PRICES: {e}")
+        return {}
+
+
+def load_default_budget():
+    """
+    The token budget of a task from the environment variable TASK_TOKEN_BUDGET, None if not limited.
+    """
+    return int(os.environ.get("TASK_TOKEN_BUDGET", 0)) or None
+
+
+_prices = None
+_total = UsageCounter()  # all the requests of the process
+_task_usages = OrderedDict()  # task_id: TaskUsage, the least recently used first
+_scopes = {}  # greenlet: (task_id, stage) set by usage_scope
+
+
+def get_cost(model, prompt_tokens, completion_tokens):
+    global _prices
+    if _prices is None:
+        _prices = load_prices()
+    price = _prices.get(model)
+    if not price:
+        return 0.0
+    return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1e6
+
+
+def _get_task_usage(task_id):
+    usage = _task_usages.get(task_id)
+    if usage is None:
+        usage = _task_usages[task_id] = TaskUsage(task_id, max_tokens=load_default_budget())
+        while len(_task_usages) > MAX_TASK_NUM:
+            _task_usages.popitem(last=False)
+    else:
+        _task_usages.move_to_end(task_id)
+    return usage
+
+
+def current_task():
+    """
+    The (task_id, stage) the current greenlet works for, from the pipeline
+    node running it or else from usage_scope.
+    """
+    task_id = current_key()
+    if task_id is not None:
+        return task_id, current_stage()
+    return _scopes.get(gevent.getcurrent(), (None, None))
+
+
+@contextmanager
+def usage_scope(task_id, stage):
+    """
+    Counts the requests of the current greenlet outside the pipeline nodes
+    (e.g. the search before the pipeline) to the task and stage.
+    """
+    greenlet = gevent.getcurrent()
+    old_scope = _scopes.get(greenlet)
+    _scopes[greenlet] = (task_id, stage)
+    try:
+        yield
+    finally:
+        if old_scope is None:
+            _scopes.pop(greenlet, None)
+        else:
+            _scopes[greenlet] = old_scope
+
+
+def record_usage(model, token_usage, message=None):
+    """
+    Adds the usage of a request to the process total and to the task and
+    stage the current greenlet works for, O(1) per request.
+    """
+    prompt_tokens, completion_tokens = split_tokens(token_usage, message)
+    cost = get_cost(model, prompt_tokens, completion_tokens)
+    _total.add(prompt_tokens, completion_tokens, cost)
+
+    task_id, stage = current_task()
+    if task_id is not None:
+        _get_task_usage(task_id).add(
+            model, stage or OTHER_STAGE, prompt_tokens, completion_tokens, cost
+        )
+
+
+def set_task_budget(task_id, max_tokens=None, max_cost=None):
+    usage = _get_task_usage(task_id)
+    usage.max_tokens = max_tokens
+    usage.max_cost = max_cost
+    return usage
+
+
+def get_task_usage(task_id):
+    """
+    The TaskUsage of the task, None if it has not sent any request.
+    """
+    return _task_usages.get(task_id)
+
+
+def pop_task_usage(task_id):
+    return _task_usages.pop(task_id, None)
+
+
+def is_over_budget(task_id=None):
+    """
+    Whether the task (the current one by default) has used up its budget, the
+    pipeline skips its optional work (refine iterations, further blocks) then.
+    """
+    if task_id is None:
+        task_id, _ = current_task()
+    usage = _task_usages.get(task_id)
+    return usage is not None and usage.is_over_budget()
+
+
+def get_total_usage():
+    return _total
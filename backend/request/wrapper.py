@@ -1,39 +1,306 @@
+import time
+import asyncio
+from copy import deepcopy
 from typing import List, Dict
-from gevent.lock import Semaphore
+
+import gevent
+from async_d import trace_span, bind_trace, check_cancelled
+from async_d.cancel import track_children
 from .local import LocalRequest
 from .openai import OpenAIRequest
 from .google import GoogleRequest
+from .mock import MockRequest
+from .cache import CachePolicy, make_cache_key, make_prefix_key, get_response_cache
+from .limiter import get_limiter, estimate_tokens, get_total_tokens, call_once
+from .hedge import get_hedge_stats
+from .router import Router, get_router
+from .usage import record_usage, current_task, usage_scope
 
 import logging
 logger = logging.getLogger(__name__)
 
 
 
-class RequestWrapper:
-    _connection_semaphore = {}
-    _calls_count = 0 # 用来统计api的调用次数
-    _token_usage_history = [] # 用来统计每次调用时使用的token数
+async def close_async_clients():
+    """
+    Closes the connection pools acompletion opened in the running event loop.
+    """
+    await OpenAIRequest.aclose_clients()
+    await LocalRequest.aclose_sessions()
+
+
+def run_async(coro):
+    """
+    asyncio.run that closes the connection pools of the loop before it
+    finishes, the requests in the coroutine share them.
+    """
+    async def main():
+        try:
+            return await coro
+        finally:
+            await close_async_clients()
+
+    return asyncio.run(main())
 
+
+class RequestWrapper:
     def __init__(self, model="gemini-2.0-flash-thinking-exp-1219", infer_type="OpenAI", connection=20, port=None):
         if not model:
             model = "gemini-2.0-flash-thinking-exp-1219"
         
         self.request_pool = None
         self.model = model
-        self._connection_semaphore[model] = Semaphore(connection)
+        # 同一模型的所有wrapper共用一个限流器，connection为其最大并发数（LLM_RATE_LIMITS中未配置时）
+        self.limiter = get_limiter(model, max_concurrency=connection)
 
-        if infer_type == "OpenAI":
+        router = get_router(model)
+        if router is not None:
+            # LLM_ROUTES中配置了多个后端的模型，由router在后端间分配请求
+            self.request_pool = router
+        elif infer_type == "OpenAI":
             self.request_pool = OpenAIRequest(model=model)
         elif infer_type == "Google":
             self.request_pool = GoogleRequest(model=model)  
         elif infer_type == "local":
-            self.request_pool = LocalRequest(port=port)
+            self.request_pool = LocalRequest(port=port, model=model)
+        elif infer_type == "mock":
+            # 离线基准测试用，按LLM_MOCK_CONFIG模拟延迟、错误和输出长度
+            self.request_pool = MockRequest(model=model)
         else:
             raise ValueError(
-                f"Invalid infer_type: {infer_type}, should be OpenAI or local"
+                f"Invalid infer_type: {infer_type}, should be OpenAI, Google, local or mock"
             )
 
-    def completion(self, message, **kwargs):
+    def completion(self, message, cache=None, stop_when=None, hedge=None, prefix=None, **kwargs):
+        """
+        cache: 调用方对结果可复用的请求（如打分、过滤）传入True或CachePolicy，
+            相同的(model, message, kwargs)直接返回缓存的结果，需配置LLM_CACHE_PATH
+        stop_when: 调用方只需要输出开头部分时（如第一个```markdown块、<SCORE>标签）传入停止条件，
+            以流式请求，stop_when(已生成的文本)为真时立即关闭连接，不再为后面的输出付出时间和token，
+            见stream.py中的stop_after_md_block和stop_after_tags。后端不支持流式时照常请求
+        hedge: HedgePolicy，请求超过该模型的滚动p9x延迟仍未返回时再发一个相同的请求，取先返回的结果
+        prefix: 多个请求共用的提示词开头（如同一综述的指令和大纲），放在message之前，
+            并作为prompt_cache_key提示传给支持的后端，使这些请求命中同一份前缀缓存
+        """
+        message = self._format_message(message, prefix)
+        prefix_key = make_prefix_key(prefix) if prefix else None
+        policy, cache_key = self._get_cache_policy(cache, message, kwargs, stop_when)
+        if policy:
+            result = self._get_cached_result(policy, cache_key)
+            if result is not None:
+                return result
+
+        # 所属任务已取消时不再请求，节省额度
+        check_cancelled()
+        with trace_span("completion", category="request", model=self.model) as span:
+            if hedge:
+                result, token_usage = self._hedged_request(
+                    message, hedge, stop_when, prefix_key, **kwargs
+                )
+            else:
+                result, token_usage = self._request(message, stop_when, prefix_key, **kwargs)
+            if span and token_usage:
+                span.args["prompt_tokens"] = getattr(token_usage, "prompt_tokens", None)
+                span.args["completion_tokens"] = getattr(token_usage, "completion_tokens", None)
+
+        result = self._record_result(result, token_usage, message)
+        if policy and policy.is_valid(result):
+            get_response_cache().set(cache_key, self.model, result)
+        return result
+
+    async def acompletion(self, message, cache=None, stop_when=None, prefix=None, **kwargs):
+        """
+        asyncio版本的completion，供运行在事件循环中的调用方（如爬虫）并发请求，
+        同一事件循环中的请求共用连接池，与completion共用同一模型的限流器。
+        连接池在事件循环结束前需要关闭，用run_async代替asyncio.run运行调用方。
+        """
+        message = self._format_message(message, prefix)
+        policy, cache_key = self._get_cache_policy(cache, message, kwargs, stop_when)
+        if policy:
+            result = self._get_cached_result(policy, cache_key)
+            if result is not None:
+                return result
+
+        check_cancelled()
+        kwargs = self._with_prompt_cache_key(kwargs, make_prefix_key(prefix) if prefix else None)
+        result, token_usage = await self._arequest(message, stop_when, **kwargs)
+
+        result = self._record_result(result, token_usage, message)
+        if policy and policy.is_valid(result):
+            get_response_cache().set(cache_key, self.model, result)
+        return result
+
+    def _request(self, message, stop_when=None, prefix_key=None, **kwargs):
+        kwargs = self._with_prompt_cache_key(kwargs, prefix_key)
+        # 重试在限流器之外，每次尝试重新占用并发并预留rpm/tpm，限流错误时降低并发
+        retrying = self.limiter.retrying(
+            self.request_pool.completion, report_rate_limit=not isinstance(self.request_pool, Router)
+        )
+        if retrying is None:
+            return self._request_once(message, stop_when, **kwargs)
+        # 停止条件是有状态的，每次尝试需要一份未使用过的
+        return retrying(lambda: self._request_once(message, deepcopy(stop_when), **kwargs))
+
+    async def _arequest(self, message, stop_when=None, **kwargs):
+        retrying = self.limiter.retrying(
+            self.request_pool.acompletion, report_rate_limit=not isinstance(self.request_pool, Router)
+        )
+        if retrying is None:
+            return await self._arequest_once(message, stop_when, **kwargs)
+        return await retrying(lambda: self._arequest_once(message, deepcopy(stop_when), **kwargs))
+
+    async def _arequest_once(self, message, stop_when=None, **kwargs):
+        async with self.limiter.async_acquire(estimate_tokens(message)) as usage:
+            if stop_when is not None and hasattr(self.request_pool, "astream_completion"):
+                result, token_usage = await self._astream_completion(message, stop_when, **kwargs)
+            else:
+                result, token_usage = await call_once(self.request_pool.acompletion, message, **kwargs)
+            usage["total_tokens"] = get_total_tokens(token_usage)
+        return result, token_usage
+
+    def _request_once(self, message, stop_when=None, **kwargs):
+        start_time = time.monotonic()
+        with self.limiter.acquire(estimate_tokens(message)) as usage:
+            logger.debug(f"Acquired limiter for {self.model} (in flight={self.limiter.in_flight})")
+            try:
+                if stop_when is not None and hasattr(self.request_pool, "stream_completion"):
+                    result, token_usage = self._stream_completion(message, stop_when, **kwargs)
+                else:
+                    result, token_usage = call_once(self.request_pool.completion, message, **kwargs)
+            except gevent.GreenletExit as e:
+                # 被杀掉的请求（对冲落败、任务取消）已在服务端消耗了token，按估算计入用量，
+                # 其耗时是实际延迟的下限，同样计入延迟统计，否则p9x偏低
+                token_usage = estimate_tokens(message) + estimate_tokens(
+                    [{"content": getattr(e, "partial_text", "")}]
+                )
+                usage["total_tokens"] = token_usage
+                record_usage(self.model, token_usage, message)
+                get_hedge_stats(self.model).record(time.monotonic() - start_time)
+                raise
+            usage["total_tokens"] = get_total_tokens(token_usage)
+        get_hedge_stats(self.model).record(time.monotonic() - start_time)
+        return result, token_usage
+
+    def _hedged_request(self, message, hedge, stop_when=None, prefix_key=None, **kwargs):
+        stats = get_hedge_stats(self.model)
+        stats.request_count += 1
+        delay = stats.get_delay(hedge)
+        if delay is None:
+            return self._request(message, stop_when, prefix_key, **kwargs)
+
+        # 停止条件是有状态的，备份请求需要一份未使用过的
+        hedge_stop_when = deepcopy(stop_when)
+        # 落败的请求在子greenlet中计入用量，需要知道所属的任务和阶段
+        task_id, stage = current_task()
+
+        def scoped_request(request, *args, **kwargs):
+            with usage_scope(task_id, stage):
+                return request(*args, **kwargs)
+
+        primary = gevent.spawn(
+            bind_trace(scoped_request), self._request, message, stop_when, prefix_key, **kwargs
+        )
+        track_children([primary])
+        primary.join(timeout=delay)
+        if (
+            primary.ready()
+            # 限流器已满时再发请求只会排队，不如等原请求
+            or self.limiter.in_flight >= self.limiter.limit
+            or not stats.try_hedge(hedge)
+        ):
+            return primary.get()
+
+        alternate = hedge.alternate or self
+        logger.info(f"Hedge request of {self.model} to {alternate.model} after {delay:.2f}s")
+        duplicate = gevent.spawn(
+            bind_trace(scoped_request), alternate._request, message, hedge_stop_when, prefix_key, **kwargs
+        )
+        track_children([duplicate])
+        pending = [primary, duplicate]
+        try:
+            while pending:
+                for greenlet in gevent.wait(pending, count=1):
+                    pending.remove(greenlet)
+                    if greenlet.successful():
+                        if greenlet is duplicate:
+                            stats.hedge_win_count += 1
+                        return greenlet.value
+            # 两个请求都失败时抛出原请求的异常
+            return primary.get()
+        finally:
+            gevent.killall([primary, duplicate], block=False)
+
+    def _stream_completion(self, message, stop_when, **kwargs):
+        text, token_usage = "", None
+        stream = self.request_pool.stream_completion(message, **kwargs)
+        try:
+            for delta, chunk_usage in stream:
+                text += delta
+                token_usage = chunk_usage or token_usage
+                if delta and stop_when(text):
+                    logger.debug(f"Stop streaming {self.model} at {len(text)} characters")
+                    break
+        except gevent.GreenletExit as e:
+            # 被杀掉时已生成的部分同样计入用量，见_request
+            e.partial_text = text
+            raise
+        finally:
+            stream.close()
+        return text, self._get_stream_token_usage(message, text, token_usage)
+
+    async def _astream_completion(self, message, stop_when, **kwargs):
+        text, token_usage = "", None
+        stream = self.request_pool.astream_completion(message, **kwargs)
+        try:
+            async for delta, chunk_usage in stream:
+                text += delta
+                token_usage = chunk_usage or token_usage
+                if delta and stop_when(text):
+                    logger.debug(f"Stop streaming {self.model} at {len(text)} characters")
+                    break
+        finally:
+            await stream.aclose()
+        return text, self._get_stream_token_usage(message, text, token_usage)
+
+    def _get_stream_token_usage(self, message, text, token_usage):
+        if token_usage is not None:
+            return token_usage
+        # 提前关闭的流拿不到服务端统计的用量，按长度估算
+        return estimate_tokens(message) + estimate_tokens([{"content": text}])
+
+    def _get_cache_policy(self, cache, message, kwargs, stop_when=None):
+        if not cache or get_response_cache() is None:
+            return None, None
+        policy = cache if isinstance(cache, CachePolicy) else CachePolicy()
+        if stop_when is not None:
+            # 提前停止的结果是截断的，不能与完整结果共用缓存
+            kwargs = dict(kwargs, stop_when=getattr(stop_when, "markers", repr(stop_when)))
+        return policy, make_cache_key(self.model, message, kwargs)
+
+    def _get_cached_result(self, policy, cache_key):
+        response_cache = get_response_cache()
+        result = response_cache.get(cache_key, ttl=policy.ttl)
+        if result is None:
+            return None
+        if not policy.is_valid(result):
+            # 调用方无法解析的结果不再复用
+            response_cache.delete(cache_key)
+            return None
+        logger.debug(f"Cache hit for {self.model}, key: {cache_key}")
+        return result
+
+    def _with_prompt_cache_key(self, kwargs, prefix_key):
+        if prefix_key and getattr(self.request_pool, "supports_prompt_cache_key", False):
+            kwargs = dict(kwargs, prompt_cache_key=prefix_key)
+        return kwargs
+
+    def _format_message(self, message, prefix=None):
+        if prefix:
+            # 前缀缓存按token前缀匹配，共用部分必须在最前面
+            if isinstance(message, str):
+                message = prefix + message
+            else:
+                message = [dict(message[0], content=prefix + message[0]["content"])] + message[1:]
         if isinstance(message, str):
             message = [{"role": "user", "content": message}]
         elif isinstance(message, List):
@@ -48,17 +315,12 @@ class RequestWrapper:
                 raise ValueError(
                     "message should be a List[Dict['role':str, 'content':str]]"
                 )
-                
-        if self.model in self._connection_semaphore:
-            with self._connection_semaphore[self.model]:
-                logger.debug(f"Acquired semaphore for {self.model} (remain={self._connection_semaphore[self.model].counter})")
-                result, token_usage = self.request_pool.completion(message, **kwargs)
-        else:
-            result, token_usage = self.request_pool.completion(message, **kwargs)
-            
-        self._calls_count += 1
-        self._token_usage_history.append(token_usage)
-            
+        return message
+
+    def _record_result(self, result, token_usage, message):
+        # 按任务和阶段累计调用次数和token用量，见usage.py
+        record_usage(self.model, token_usage, message)
+
         logger.debug(f"Requesting completion received")
         if not result:
             raise ValueError(
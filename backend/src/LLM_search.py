@@ -10,7 +10,7 @@ from tenacity import retry, stop_after_attempt, before_log, retry_if_exception_t
 import time
 
 sys.path.append("survey_writer")
-from request import RequestWrapper
+from request import RequestWrapper, CachePolicy
 from src.prompts import get_prompts
 
 logger = logging.getLogger(__name__)
@@ -470,20 +470,40 @@ class LLM_search:
             snippet=snippet,
         )
         try:
-            res = self.request_pool.completion(prompt)
-            matches = re.findall(r"<SCORE>(\d+)</SCORE>", res)
-            if not matches:
-                raise ValueError("No valid SCORE found in response.")
-            score = float(matches[-1])
-
-            if score < 0 or score > 100:
-                raise ValueError(f"Invalid similarity score: {score}")
+            res = self.request_pool.completion(
+                prompt, cache=CachePolicy(validate=self._parse_snippet_score)
+            )
+            return self._parse_snippet_score(res)
+        except Exception as e:
+            logger.error(f"Error calculating similarity score: {e}")
+            return 0.0
 
-            return score
+    async def asnippet_filter(self, topic, snippet):
+        """Async version of snippet_filter, used by the concurrent consumers in batch_web_search"""
+        prompt = self.prompts.SNIPPET_FILTER_PROMPT.format(
+            topic=topic,
+            snippet=snippet,
+        )
+        try:
+            res = await self.request_pool.acompletion(
+                prompt, cache=CachePolicy(validate=self._parse_snippet_score)
+            )
+            return self._parse_snippet_score(res)
         except Exception as e:
             logger.error(f"Error calculating similarity score: {e}")
             return 0.0
 
+    def _parse_snippet_score(self, res):
+        matches = re.findall(r"<SCORE>(\d+)</SCORE>", res)
+        if not matches:
+            raise ValueError("No valid SCORE found in response.")
+        score = float(matches[-1])
+
+        if score < 0 or score > 100:
+            raise ValueError(f"Invalid similarity score: {score}")
+
+        return score
+
     def batch_web_search(self, queries: list, topic: str, top_n: int = 20) -> list:
         """
         Perform batch web search for multiple queries and return filtered results by relevance.
@@ -558,7 +578,7 @@ class LLM_search:
                             url, snippet = queue.get_nowait()
                             try:
                                 if snippet:
-                                    score = self.snippet_filter(topic, snippet)
+                                    score = await self.asnippet_filter(topic, snippet)
                                     scored_urls.append((score, url))
                                     logger.info(
                                         f"Snippet similarity Score: {score}, rest {queue.qsize()}/{total_url}, Processed URL: {url}, "
@@ -258,6 +258,27 @@ def get_global_pipeline_status():
     return jsonify(response)
 
 
+@api_bp.route('/pipeline_metrics', methods=['GET'])
+def get_pipeline_metrics():
+    """获取各Pipeline节点的延迟直方图指标
+
+    返回:
+        每个节点的执行延迟、排队等待时间（秒，p50/p95/p99）以及错误和重试次数
+    """
+    from async_d import PipelineAnalyser
+
+    pipelines = pipeline_task_manager.pipelines if pipeline_task_manager else {}
+    pipeline_analyser = PipelineAnalyser()
+
+    return jsonify({
+        'success': True,
+        'pipelines': {
+            lang: pipeline_analyser.get_metrics(pipeline)
+            for lang, pipeline in pipelines.items()
+        }
+    })
+
+
 @api_bp.route('/tasks', methods=['GET'])
 def list_tasks():
     """获取任务列表
@@ -582,6 +603,10 @@ def delete_task(task_id: str):
     """
     task_manager = get_task_manager()
     
+    # 停止Pipeline中该任务的处理，释放额度给其他任务
+    if pipeline_task_manager:
+        pipeline_task_manager.cancel_task(task_id)
+    
     if task_manager.delete_task(task_id):
         return jsonify({
             'success': True,
@@ -7,7 +7,7 @@ import re
 import sys
 
 sys.path.append("survey_writer")
-from request import RequestWrapper
+from request import RequestWrapper, CachePolicy, stop_after_tags
 from typing import List
 from src.prompts import get_prompts
 import logging
@@ -107,7 +107,10 @@ class AsyncCrawler:
             prompt = self.prompts.SIMILARITY_PROMPT.format(
                 topic=data["topic"], content=data["filtered"]
             )
-            res = self.request_pool.completion(prompt)
+            res = await self.request_pool.acompletion(
+                prompt,
+                cache=CachePolicy(validate=lambda res: re.search(r"<SCORE>(\d+)</SCORE>", res)),
+            )
 
             score = re.search(r"<SCORE>(\d+)</SCORE>", res)
             if not score:
@@ -130,7 +133,14 @@ class AsyncCrawler:
             prompt = self.prompts.PAGE_REFINE_PROMPT.format(
                 topic=data["topic"], raw_content=data["raw_content"]
             )
-            res = self.request_pool.completion(prompt)
+            res = await self.request_pool.acompletion(
+                prompt,
+                cache=CachePolicy(
+                    validate=lambda res: re.search(r"<TITLE>(.*?)</TITLE>", res, re.DOTALL)
+                    and re.search(r"<CONTENT>(.*?)</CONTENT>", res, re.DOTALL)
+                ),
+                stop_when=stop_after_tags("TITLE", "CONTENT"),
+            )
             title = re.search(r"<TITLE>(.*?)</TITLE>", res, re.DOTALL)
             content = re.search(r"<CONTENT>(.*?)</CONTENT>", res, re.DOTALL)
 
@@ -4,6 +4,8 @@ from typing import Dict, Optional
 from gevent import spawn, joinall
 from gevent.lock import Semaphore
 
+from async_d import bind_trace, check_cancelled
+from async_d.cancel import track_children
 from src.base_method.data import Dataset
 import logging
 logger = logging.getLogger(__name__)
@@ -34,21 +36,25 @@ class Module(ABC):
                 return e
             
         try:
+            # 任务被取消后不再发起新的子任务，已发起的子任务随任务一起被结束
+            check_cancelled()
             if len(args) == 1 and isinstance(args[0], Dataset):
                 tasks = []
                 batch_data = args[0]
                 for data in batch_data:
                     tasks.append(
                         spawn(
-                            self.forward, *data, **kwargs
+                            bind_trace(self.forward, self.__name__), *data, **kwargs
                         )
                     )
+                track_children(tasks)
                 joinall(tasks)
                 return [get_task_result(task) for task in tasks]
             else:
                 task = spawn(
-                    self.forward, *args, **kwargs
+                    bind_trace(self.forward, self.__name__), *args, **kwargs
                 )
+                track_children([task])
                 task.join()
                 return get_task_result(task)
         except Exception as e:
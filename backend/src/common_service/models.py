@@ -1,11 +1,35 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float, Text
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float, Text, inspect, text
 from sqlalchemy.orm import relationship
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timezone
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 db = SQLAlchemy()
 
+# 后来新增到已有表的列：(表名, 列名, 列类型)，db.create_all()不会修改已存在的表
+ADDED_COLUMNS = [
+    ('tasks', 'token_usage', 'TEXT'),
+]
+
+
+def upgrade_schema():
+    """给已存在的表补上新增的列，可重复执行，需在应用上下文中调用"""
+    inspector = inspect(db.engine)
+    # PostgreSQL下多个进程同时启动时，IF NOT EXISTS避免重复添加报错
+    if_not_exists = 'IF NOT EXISTS ' if db.engine.dialect.name == 'postgresql' else ''
+    for table, column, column_type in ADDED_COLUMNS:
+        if not inspector.has_table(table):
+            continue
+        if column in {c['name'] for c in inspector.get_columns(table)}:
+            continue
+        with db.engine.begin() as conn:
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {if_not_exists}{column} {column_type}'))
+        logger.info(f"数据库表{table}已添加列{column}")
+
+
 class User(db.Model):
     """用户表"""
     __tablename__ = 'users'
@@ -117,6 +141,9 @@ class Task(db.Model):
     # 任务结果数据（JSON格式存储）
     result_data = Column(Text)
     
+    # token用量和预算（JSON格式存储）
+    token_usage = Column(Text)
+    
     # 重试次数
     retry_count = Column(Integer, default=0)
     max_retries = Column(Integer, default=3)
@@ -156,6 +183,12 @@ class Task(db.Model):
             except json.JSONDecodeError:
                 data['result_data'] = {}
         
+        if self.token_usage:
+            try:
+                data['token_usage'] = json.loads(self.token_usage)
+            except json.JSONDecodeError:
+                data['token_usage'] = {}
+        
         # 计算执行时间字符串
         if self.start_time and self.end_time:
             execution_time = self.end_time - self.start_time
@@ -191,6 +224,11 @@ class Task(db.Model):
                 return {}
         return {}
     
+    def set_token_usage(self, usage_dict):
+        """设置任务的token用量"""
+        if usage_dict:
+            self.token_usage = json.dumps(usage_dict, ensure_ascii=False)
+    
     def is_expired(self):
         """检查任务是否过期"""
         current_time = datetime.now(timezone.utc)
@@ -54,6 +54,8 @@ class PipelineConfig:
     search_model_infer_type: str = ''
     search_engine: str = ''
     search_each_query_result: int = 0
+    journal_dir: str = ''
+    trace_dir: str = ''
 
 
 @dataclass
@@ -194,6 +196,10 @@ class AppConfig:
         self.pipeline.search_model_infer_type = get_optional_env('PIPELINE_SEARCH_MODEL_INFER_TYPE')
         self.pipeline.search_engine = get_optional_env('PIPELINE_SEARCH_ENGINE')
         self.pipeline.search_each_query_result = get_optional_env('PIPELINE_SEARCH_EACH_QUERY_RESULT', int)
+        # 在途数据的检查点目录，为空时不记录，重启后无法恢复
+        self.pipeline.journal_dir = get_optional_env('PIPELINE_JOURNAL_DIR', '')
+        # 每个Survey的耗时瀑布图（Chrome trace格式）输出目录，为空时不记录
+        self.pipeline.trace_dir = get_optional_env('PIPELINE_TRACE_DIR', '')
         
         # API配置
         self.api.host = get_optional_env('API_HOST', '0.0.0.0')
@@ -301,7 +307,9 @@ class AppConfig:
                 'search_model': self.pipeline.search_model,
                 'search_model_infer_type': self.pipeline.search_model_infer_type,
                 'search_engine': self.pipeline.search_engine,
-                'search_each_query_result': self.pipeline.search_each_query_result
+                'search_each_query_result': self.pipeline.search_each_query_result,
+                'journal_dir': self.pipeline.journal_dir,
+                'trace_dir': self.pipeline.trace_dir
             },
             'api': {
                 'host': self.api.host,
@@ -12,8 +12,9 @@ import logging
 logger = logging.getLogger(__name__)
 
 class ContentNode(TreeNode):
-    def __init__(self, outline_node, digests, block_cycle_count):
+    def __init__(self, outline_node, digests, block_cycle_count, task_id=None):
         super().__init__()
+        self.task_id = task_id
         self.content = ""
         self.block_cycle_count = block_cycle_count
         self.digests = digests
@@ -81,6 +82,11 @@ class ContentNode(TreeNode):
         survey_label = f"{self.survey_title}(Block cycle count: {self.block_cycle_count})"
         return survey_label
 
+    @property
+    def trace_id(self):
+        # sections are traced together with the survey they are split from, see Survey.trace_id
+        return self.task_id or self.survey_title
+
     def title(self, with_index=True):
         prefix = "#" * (self.depth + 1)
         if with_index:
@@ -105,7 +111,8 @@ class ContentNode(TreeNode):
 
 
 class Content:
-    def __init__(self, outline, digests, block_cycle_count):
+    def __init__(self, outline, digests, block_cycle_count, task_id=None):
+        self.task_id = task_id
         self.outline = outline
         self.digests = digests
         self.block_cycle_count = block_cycle_count
@@ -129,16 +136,38 @@ class Content:
         else:
             raise StopIteration()
 
+    def __getstate__(self):
+        # a gevent queue can not be pickled (e.g. by the journal), keep the waiting content nodes instead
+        state = self.__dict__.copy()
+        if self.waiting_content is not None:
+            state["waiting_content"] = (
+                list(self.waiting_content.queue),
+                self.waiting_content.is_shutdown,
+            )
+        return state
+
+    def __setstate__(self, state):
+        waiting_content = state.pop("waiting_content", None)
+        self.__dict__.update(state)
+        self.waiting_content = None
+        if waiting_content is not None:
+            content_nodes, is_shutdown = waiting_content
+            self.waiting_content = Queue()
+            for content_node in content_nodes:
+                self.waiting_content.put(content_node)
+            if is_shutdown:
+                self.waiting_content.shutdown()
+
     def init_content(self):
         self.waiting_content = Queue()
-        self.root = ContentNode(self.outline.root, self.digests, self.block_cycle_count)
+        self.root = ContentNode(self.outline.root, self.digests, self.block_cycle_count, self.task_id)
         for section in self.outline.root.son:
             self._init_content_node(section, self.root)
         self.root.update_section()
         pass
 
     def _init_content_node(self, outline_node, parent_content_node):
-        content_node = ContentNode(outline_node, self.digests, self.block_cycle_count)
+        content_node = ContentNode(outline_node, self.digests, self.block_cycle_count, self.task_id)
         parent_content_node.add_son(content_node)
         for subsection in outline_node.son:
             self._init_content_node(subsection, content_node)
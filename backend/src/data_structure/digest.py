@@ -9,6 +9,7 @@ from src.exceptions import (
     MdNotFoundError,
 )
 from ..utils.process_str import parse_md_content, remove_illegal_bibkeys, get_section_title
+from ..utils.tokenizer import count_tokens, truncate_tokens
 import logging
 
 logger = logging.getLogger(__name__)
@@ -31,11 +32,8 @@ class DigestNode(TreeNode):
 
 
 class Digest:
-    TOKEN_RATIO = 3.6875
-    MAX_TOKEN = 800000
-    MAX_LENGTH = int(
-        MAX_TOKEN * TOKEN_RATIO
-    )  # arxiv average length / token = 3.2, window size = 120,000, Prompt length 15k characters, assert max output length 16k token
+    TOKEN_RATIO = 3.6875  # arxiv average length / token = 3.2
+    MAX_TOKEN = 800000  # longer papers are truncated, the digest module splits the long ones into chunks
 
     def __init__(self, paper_infos, survey_title):
         self.survey_title = survey_title
@@ -47,16 +45,17 @@ class Digest:
         for paper_info in paper_infos:
             origin_content = self.pre_proc_paper(paper_info["txt"])
             abstract = paper_info.get("abstract", "")
-            paper_token = paper_info.get("txt_token", self.MAX_TOKEN)
+            paper_token = paper_info.get("txt_token") or count_tokens(origin_content)
             if abstract:
                 abstract = self._del_citation(abstract)
             else:
                 abstract = origin_content[:500]
             if paper_token > self.MAX_TOKEN:
                 logger.warning(
-                    f"Total length of origin_content {paper_info['txt_token']} exceeds estimated max token {self.MAX_TOKEN}, scaling down content lengths."
+                    f"Total length of origin_content {paper_token} exceeds max token {self.MAX_TOKEN}, truncating content."
                 )
-                origin_content = origin_content[: int(self.MAX_LENGTH)]
+                origin_content = truncate_tokens(origin_content, self.MAX_TOKEN)
+                paper_token = self.MAX_TOKEN
             paper = {
                 "title": paper_info["title"],
                 "bibkey": paper_info["bibkey"],
@@ -152,6 +151,44 @@ class Digest:
             raise e
         return self
 
+    def parse_partial_digest(self, raw_digest: str, sections):
+        """
+        Parses a digest of only the given outline sections (in the order of
+        the outline), self.root holds them under the survey title.
+        """
+        try:
+            md_content = self.get_digest_from_str(raw_digest)
+            root = self._parse_md(md_content.split("\n"))
+            root.update_section()
+            digest_sections = root.all_section[1:]
+            if len(digest_sections) != len(sections):
+                raise StructureNotCorrespondingError(
+                    f"Digest section number {len(digest_sections)} does not match changed section number {len(sections)}"
+                )
+            for outline_section, digest_section in zip(sections, digest_sections):
+                if self._normalize_title(outline_section.title) != self._normalize_title(digest_section.title):
+                    raise StructureNotCorrespondingError(
+                        f"Digest section title: '{digest_section.title}' does not match outline section title: '{outline_section.title}'"
+                    )
+            self.root = root
+        except Exception as e:
+            logger.warning(
+                f"Error in parsing partial digest (Survey: {self.survey_title} Bibkey: {', '.join(self.bibkeys)}): {e}"
+            )
+            self.root = None
+            raise e
+        return self
+
+    def rebuild(self, outline, descriptions):
+        """
+        Builds the digest of the outline from the descriptions of its
+        sections (in the order of outline.root.all_section).
+        """
+        self.parse_raw_digest(f"```markdown\n{outline.all_skeleton(with_index=True)}\n```", outline)
+        for section, description in zip(self.root.all_section, descriptions):
+            section.description = description
+        return self
+
     def parse_suggestion(self, raw_result, bibkey):
         old_suggestions = self.suggestions
         try:
@@ -235,10 +272,14 @@ class Digest:
         if rest_bibkeys := ref_set - self.bibkeys:
             raise BibkeyNotFoundError(rest_bibkeys)
 
+    @staticmethod
+    def _normalize_title(title):
+        return re.sub(r"\s+", " ", title.lower()).strip()
+
     def find_matching_section(self, root, outline):
         def is_corresponding(outline_sec, digest_sec):
-            outline_title = re.sub(r"\s+", " ", outline_sec.title.lower()).strip()
-            digest_title = re.sub(r"\s+", " ", digest_sec.title.lower()).strip()
+            outline_title = self._normalize_title(outline_sec.title)
+            digest_title = self._normalize_title(digest_sec.title)
             ret = (
                 outline_title == digest_title and outline_sec.index == digest_sec.index
             )
@@ -168,6 +168,34 @@ class Skeleton:
 
         return "\n".join(outline).strip()
 
+    def match_sections(self, old_skeleton):
+        """
+        Diffs the skeleton against old_skeleton, returns {position in
+        all_section: position in old_skeleton.root.all_section} of the
+        sections with the same title, index and description (construction
+        and analysis) in both, the other sections are new or changed.
+        """
+        def normalize(text):
+            return re.sub(r"\s+", " ", text).strip().lower()
+
+        def section_key(node):
+            return (
+                normalize(node.title),
+                tuple(node.index),
+                normalize(node.construction),
+                normalize(node.analysis),
+            )
+
+        old_positions = {
+            section_key(node): i for i, node in enumerate(old_skeleton.root.all_section)
+        }
+        matched = {}
+        for i, node in enumerate(self.root.all_section):
+            key = section_key(node)
+            if key in old_positions:
+                matched[i] = old_positions[key]
+        return matched
+
     def update(self, raw_outline):
         self.parse_raw_skeleton(self.survey_title, raw_outline)
         return self
@@ -30,6 +30,10 @@ class Survey:
         self.content = None
 
         self.block_cycle_count = 0
+        # 上一轮生成digest时的大纲，后续block只为变化的章节重新生成digest
+        self.digest_outline = None
+        # digest后是否不再进行下一个block，每个block由HiddenPipeline.iter_criteria判断一次
+        self.stop_iteration = False
         
         self.skeleton_batch_size = 0
         self.digest_batch_size = 0
@@ -43,6 +47,8 @@ class Survey:
         self.self_refine_score = []
         self.best_of = 0
         self.refine_count = 0
+        # 提前结束的卷积层和精炼轮次: [{"block_cycle_count", "stage", "step", "reason"}]
+        self.early_stop = []
         
         self.cite_ratio = 0
 
@@ -67,6 +73,10 @@ class Survey:
         else:
             raise StopIteration()
 
+    def shared_objects(self):
+        # papers are never modified after loading, share them between pipeline branches
+        return [self.papers, *self.papers.values()]
+
     @property
     def abstracts(self):
         return {
@@ -86,13 +96,30 @@ class Survey:
         survey_label = f"{self.title}(Block cycle count: {self.block_cycle_count})"
         return survey_label
 
+    @property
+    def trace_id(self):
+        # 同一主题的多个任务各自追踪，没有task_id时（如命令行运行）才用标题
+        return self.task_id or self.title
+
     def init_content(self):
-        self.content = Content(self.skeleton, self.digests, self.block_cycle_count)
+        self.content = Content(self.skeleton, self.digests, self.block_cycle_count, self.task_id)
         self.content.init_content()
 
     def add_content(self, content):
         self.content.add_content(content)
 
+    def record_early_stop(self, stage, step, reason):
+        if not hasattr(self, "early_stop"):
+            self.early_stop = []
+        self.early_stop.append(
+            {
+                "block_cycle_count": self.block_cycle_count,
+                "stage": stage,
+                "step": step,
+                "reason": reason,
+            }
+        )
+
     def update_outline(self, outline:str):
         self.skeleton.update(outline)
         return self
@@ -120,6 +147,7 @@ class Survey:
             "result_num": self.result_num,
             "best_of": self.best_of,
             "refine_count": self.refine_count,
+            "early_stop": getattr(self, "early_stop", []),
             "cite_ratio": self.cite_ratio,
             "outline": self.skeleton.all_skeleton(construction=True, analysis=True, with_index=True, with_label=False),
             "outline_suggestion": self.skeleton.suggestion,
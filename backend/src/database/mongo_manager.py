@@ -13,8 +13,8 @@ import logging
 import time
 import threading
 from datetime import datetime
-from typing import Optional, Dict, List, Any
-from pymongo import MongoClient, ASCENDING
+from typing import Optional, Dict, List, Any, Tuple
+from pymongo import MongoClient, ASCENDING, ReplaceOne
 from pymongo.errors import ConnectionFailure
 from src.config_manager import MongoConfig
 
@@ -159,28 +159,31 @@ class MongoManager:
                     logger.warning(f"操作失败，第{attempt + 1}次重试: {str(e)}")
                     time.sleep(self.retry_delay * (attempt + 1))
     
+    def _build_survey_document(self, task_id: str, survey_data: Dict[str, Any]) -> Dict[str, Any]:
+        """构建survey文档"""
+        # 确保survey_data中包含正确的task_id
+        survey_data_with_task_id = survey_data.copy()
+        survey_data_with_task_id["task_id"] = task_id
+        
+        return {
+            "task_id": task_id,
+            "title": survey_data.get("title", ""),
+            "survey_data": survey_data_with_task_id,  # 使用包含task_id的副本
+            "created_at": datetime.now(),
+            "status": "completed",
+            "metadata": {
+                "cite_ratio": survey_data.get("cite_ratio", 0),
+                "content_length": len(survey_data.get("content", "")),
+                "references_count": len(survey_data.get("papers", []))
+            }
+        }
+
     def save_survey(self, task_id: str, survey_data: Dict[str, Any]) -> bool:
         """保存survey数据"""
         
         def _save_operation():
             collection = self._db[self.collection_name]
-            
-            # 确保survey_data中包含正确的task_id
-            survey_data_with_task_id = survey_data.copy()
-            survey_data_with_task_id["task_id"] = task_id
-            
-            document = {
-                "task_id": task_id,
-                "title": survey_data.get("title", ""),
-                "survey_data": survey_data_with_task_id,  # 使用包含task_id的副本
-                "created_at": datetime.now(),
-                "status": "completed",
-                "metadata": {
-                    "cite_ratio": survey_data.get("cite_ratio", 0),
-                    "content_length": len(survey_data.get("content", "")),
-                    "references_count": len(survey_data.get("papers", []))
-                }
-            }
+            document = self._build_survey_document(task_id, survey_data)
             
             # 使用upsert模式，如果task_id已存在则更新
             result = collection.replace_one(
@@ -201,6 +204,35 @@ class MongoManager:
         except Exception as e:
             logger.error(f"保存Survey失败: task_id={task_id}, error={str(e)}")
             return False
+
+    def save_surveys(self, surveys: List[Tuple[str, Dict[str, Any]]]) -> bool:
+        """批量保存survey数据，一次往返写入多个(task_id, survey_data)"""
+        if not surveys:
+            return True
+        
+        def _save_operation():
+            collection = self._db[self.collection_name]
+            requests = [
+                ReplaceOne(
+                    {"task_id": task_id},
+                    self._build_survey_document(task_id, survey_data),
+                    upsert=True
+                )
+                for task_id, survey_data in surveys
+            ]
+            result = collection.bulk_write(requests, ordered=False)
+            logger.info(
+                f"Survey批量保存成功: count={len(surveys)}, "
+                f"upserted={result.upserted_count}, modified={result.modified_count}"
+            )
+            return True
+        
+        try:
+            return self._retry_operation(_save_operation)
+        except Exception as e:
+            task_ids = [task_id for task_id, _ in surveys]
+            logger.error(f"批量保存Survey失败: task_ids={task_ids}, error={str(e)}")
+            return False
     
     def get_survey(self, task_id: str) -> Optional[Dict[str, Any]]:
         """根据task_id获取survey数据"""
@@ -1,8 +1,7 @@
 import json
 import os
-import re
 import gevent
-from async_d import Node
+from async_d import Node, run_in_process, is_cancelled
 from async_d import Sequential
 from gevent.fileobject import FileObject
 from gevent.lock import Semaphore
@@ -12,7 +11,7 @@ from src.data_structure import Survey
 from src.data_structure.content import ContentNode
 from .orchestra_module import OrchestraModule
 from .figure_module import FigureModule
-from src.utils.process_str import str2list, remove_illegal_bibkeys
+from src.utils.process_str import change_bibkeys_to_index
 
 # 首先定义logger
 logger = logging.getLogger(__name__)
@@ -29,6 +28,7 @@ except ImportError as e:
 
 class DecodePipeline(Sequential):
     def __init__(self, config, output_file=None, worker_num=10, use_database=True):
+        min_worker_num = worker_num
         worker_num = worker_num * 10
         self.config = config
         self.output_file = output_file
@@ -66,7 +66,12 @@ class DecodePipeline(Sequential):
             self.unpack_survey, worker_num=worker_num, queue_size=worker_num
         )
         self.orchestra_module = OrchestraModule(self.config)
-        self.orchestra_node = Node(self.orchestra_module, worker_num=worker_num)
+        self.orchestra_node = Node(
+            self.orchestra_module,
+            worker_num=worker_num,
+            min_worker_num=min_worker_num,
+            max_worker_num=worker_num * 2,
+        )
         self.assemble_node = Node(
             self.assemble_survey,
             worker_num=worker_num,
@@ -78,13 +83,19 @@ class DecodePipeline(Sequential):
         )
         self.chart_module = FigureModule(self.config)
         self.chart_node = Node(
-            self.chart_module, worker_num=worker_num, queue_size=worker_num
+            self.chart_module,
+            worker_num=worker_num,
+            queue_size=worker_num,
+            min_worker_num=min_worker_num,
+            max_worker_num=worker_num * 2,
         )
         self.save_node = Node(
-            self.save_survey,
+            self.save_surveys,
             no_output=True,
             worker_num=worker_num,
             queue_size=worker_num,
+            batch_size=worker_num,
+            batch_timeout=500,
         )
         super().__init__(
             [
@@ -108,6 +119,11 @@ class DecodePipeline(Sequential):
     def _get_data_from_registered_survey(self):
         while True:
             with self.dict_semaphore:
+                # 已取消任务的survey不会再组装完成，直接移除
+                for survey_label, survey in list(self.executing_survey.items()):
+                    if is_cancelled(survey[0].task_id):
+                        self.executing_survey.pop(survey_label)
+                        logger.info(f"Drop cancelled survey: {survey_label}")
                 for survey in self.executing_survey.values():
                     try:
                         content = next(survey[1])
@@ -142,36 +158,14 @@ class DecodePipeline(Sequential):
             raise ValueError(f"Invalid survey type, current data type {type(survey)}")
 
     def change_bibkey_to_index(self, survey):
-        cite_reg = re.compile(r"\[([^\]]+)\]")
+        # 引用替换是纯CPU计算，只把章节文本和bibkey发送到进程池，避免序列化整个survey
         bibkeys = list(survey.papers.keys())
-        bibkey_count_dict = {bibkey: 0 for bibkey in bibkeys}
-        for content_section in survey.content.root.all_section:
-
-            def replace_bibkey(match):
-                bibkey_str = match.group(1)
-                bibkey_list = str2list(bibkey_str)
-                indices = []
-                for bibkey in bibkey_list:
-                    bibkey = bibkey.strip().replace("-", "_")
-                    try:
-                        bibkey_count_dict[bibkey] += 1
-                        indices.append(bibkeys.index(bibkey) + 1)
-                    except Exception as e:
-                        pass
-                indices = list(set(indices))
-                indices = sorted(indices)
-                indices = [str(index) for index in indices]
-                if indices:
-                    return f"[{','.join(indices)}]"
-                else:
-                    return ""
-
-            content_section.content = remove_illegal_bibkeys(
-                content_section.content, legal_bibkeys=bibkeys
-            )
-            content_section.content = cite_reg.sub(
-                replace_bibkey, content_section.content
-            )
+        sections = survey.content.root.all_section
+        contents, bibkey_count_dict = run_in_process(
+            change_bibkeys_to_index, [section.content for section in sections], bibkeys
+        )
+        for section, content in zip(sections, contents):
+            section.content = content
 
         # 统计没有被引用的论文比例
         not_cited_count = sum(1 for count in bibkey_count_dict.values() if count == 0)
@@ -184,6 +178,24 @@ class DecodePipeline(Sequential):
 
         return survey
 
+    def save_surveys(self, surveys):
+        """批量保存survey，数据库批量写入失败时逐个回退到save_survey"""
+        saved_surveys = []
+        db_surveys = [survey for survey in surveys if survey.task_id] if self.use_database else []
+        if db_surveys:
+            try:
+                from src.database.mongo_manager import get_mongo_manager
+                mongo_manager = get_mongo_manager()
+                if mongo_manager.save_surveys([(survey.task_id, survey.to_dict()) for survey in db_surveys]):
+                    saved_surveys = db_surveys
+                    logger.info(f"Survey批量保存到数据库成功: task_ids={[survey.task_id for survey in db_surveys]}")
+            except Exception as e:
+                logger.error(f"数据库批量保存异常: count={len(db_surveys)}, error={str(e)}")
+
+        for survey in surveys:
+            if survey not in saved_surveys:
+                self.save_survey(survey)
+
     def save_survey(self, survey):
         """保存survey，优先使用数据库，文件存储作为备选方案"""
         survey_data = survey.to_dict()
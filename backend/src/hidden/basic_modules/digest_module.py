@@ -1,9 +1,17 @@
 from typing import List
-from tenacity import retry, stop_after_attempt, after_log, retry_if_exception_type
-from request import RequestWrapper
+from copy import deepcopy
+from tenacity import (
+    retry,
+    stop_after_attempt,
+    after_log,
+    retry_if_exception_type,
+    retry_if_exception,
+)
+from request import RequestWrapper, HedgePolicy, is_context_length_error
 from src.base_method.module import Neuron, Module
 from src.base_method.data import Dataset
-from src.data_structure import Digest, Survey
+from src.data_structure import Digest, Survey, Skeleton
+from src.utils.tokenizer import count_tokens, truncate_tokens
 from src.exceptions import (
     BibkeyNotFoundError,
     StructureNotCorrespondingError,
@@ -12,6 +20,7 @@ from src.exceptions import (
 from src.utils.process_str import (
     list2str,
     remove_illegal_bibkeys,
+    split_by_sections,
 )
 import logging
 
@@ -25,52 +34,189 @@ class DigestModule(Module):
         super().__init__()
         prompts = get_prompts(language)
         self.module = SingleDigestModule(config, prompts)
+        # 后续block只为大纲中变化的部分重新生成digest，其余部分沿用上一轮的结果，
+        # 变化的部分超过max_changed_ratio时全部重新生成
+        self.incremental = config.get("incremental", True)
+        self.max_changed_ratio = config.get("max_changed_ratio", 0.5)
 
     def forward(self, survey: Survey):
         outline = survey.skeleton
-        dataset = Dataset([(digest, outline) for digest in survey.digests.values()])
+        matched_sections = self._match_sections(survey)
+        dataset = Dataset(
+            [(digest, outline, matched_sections) for digest in survey.digests.values()]
+        )
         digest_list = self.module(dataset)
         survey.update_digests(digest_list)
+        survey.digest_outline = outline.all_skeleton(
+            construction=True, analysis=True, with_index=True
+        )
         logger.info(f"All Digest Finished: Survey: {survey.title}")
         return survey
 
+    def _match_sections(self, survey: Survey):
+        """
+        The unchanged sections of the outline since the last digest, None to digest all sections.
+        """
+        digest_outline = getattr(survey, "digest_outline", None)
+        if not self.incremental or not digest_outline:
+            return None
+        old_outline = Skeleton(survey.papers.keys()).parse_raw_skeleton(
+            survey.title, f"```markdown\n{digest_outline}\n```"
+        )
+        sections = survey.skeleton.root.all_section
+        matched_sections = survey.skeleton.match_sections(old_outline)
+        changed_count = len(sections) - len(matched_sections)
+        logger.info(
+            f"Survey {survey.title} outline changed {changed_count} of {len(sections)} sections since the last digest"
+        )
+        if changed_count > self.max_changed_ratio * len(sections):
+            return None
+        return matched_sections
+
 
 class SingleDigestModule(Module):
     def __init__(self, config, prompts: PromptsProtocol):
         super().__init__()
         self.single_digest_neuron = SingleDigestNeuron(config["single"], prompts)
         self.merge_digest_neuron = MergeDigestNeuron(config["merge"])
+        # 超过max_paper_tokens的论文按章节切分为多段，各段并行生成digest后合并，0关闭切分
+        self.max_paper_tokens = config.get("max_paper_tokens", 64000)
 
-    def forward(self, digest: Digest, outline):
+    def forward(self, digest: Digest, outline, matched_sections=None):
+        if matched_sections is not None and digest.root is not None:
+            return self._incremental_forward(digest, outline, matched_sections)
         topic = digest.survey_title
         digest.suggestions = {}
         paper_infos = digest.get_paper_infos()
         for paper_info in paper_infos:
             paper_info["content"] = paper_info["origin_content"]
         bibkeys = list2str(digest.bibkeys)
-        dataset = Dataset([(paper_info, outline, digest, Digest([], topic)) for paper_info in paper_infos])
-        logger.info(f"Multiple Digest Generate Start, Count {len(dataset)} in survey {topic}: {bibkeys} ")
-        
-        digests = self.single_digest_neuron(
-            dataset
-        )
-        digests = [digest for digest in digests if (digest is not None and digest is not Exception)]
+        logger.info(f"Multiple Digest Generate Start, Count {len(paper_infos)} in survey {topic}: {bibkeys} ")
+
+        digests = self._digest_papers(paper_infos, outline, digest)
         digest = self.merge_digest_neuron(digests, paper_infos, outline, digest)
         logger.info(f"Multiple Digest Generate Finished: {bibkeys} in survey {topic}")
         return digest
 
+    def _incremental_forward(self, digest: Digest, outline, matched_sections):
+        """
+        Digests the papers only for the changed sections, the unchanged ones
+        keep their descriptions from the last digest.
+        """
+        topic = digest.survey_title
+        bibkeys = list2str(digest.bibkeys)
+        old_sections = digest.root.all_section
+        changed_sections = [
+            section
+            for i, section in enumerate(outline.root.all_section)
+            if i not in matched_sections and section.depth > 0
+        ]
+        new_digests = []
+        if changed_sections:
+            paper_infos = digest.get_paper_infos()
+            for paper_info in paper_infos:
+                paper_info["content"] = paper_info["origin_content"]
+            logger.info(
+                f"Incremental Digest Generate Start, Count {len(paper_infos)}, {len(changed_sections)} changed sections in survey {topic}: {bibkeys}"
+            )
+            new_digests = self._digest_papers(
+                paper_infos, outline, digest, changed_sections
+            )
+
+        changed_descriptions = {}
+        for position, section in enumerate(changed_sections):
+            changed_descriptions[id(section)] = MergeDigestNeuron.merge_descriptions(
+                new_digests, position + 1
+            )
+        descriptions = []
+        for i, section in enumerate(outline.root.all_section):
+            if i in matched_sections:
+                descriptions.append(old_sections[matched_sections[i]].description)
+            else:
+                descriptions.append(changed_descriptions.get(id(section), ""))
+
+        new_digest = Digest([], topic)
+        new_digest.paper_infos = deepcopy(digest.paper_infos)
+        new_digest.suggestions = dict(digest.suggestions)
+        for d in new_digests:
+            new_digest.suggestions.update(d.suggestions)
+        new_digest.rebuild(outline, descriptions)
+        logger.info(
+            f"Incremental Digest Generate Finished: {bibkeys}, reused {len(matched_sections)} sections in survey {topic}"
+        )
+        return new_digest
+
+    def _digest_papers(self, paper_infos, outline, digest: Digest, sections=None):
+        """
+        The single digest of each paper (the failed ones left out), the chunks
+        of the long papers are digested in parallel with the other papers and
+        merged into one digest per paper.
+        """
+        topic = digest.survey_title
+        chunks = []  # (index of the paper, paper info of the chunk)
+        for i, paper_info in enumerate(paper_infos):
+            chunks.extend((i, chunk_info) for chunk_info in self._split_paper(paper_info))
+        extra_args = () if sections is None else (sections,)
+        results = self.single_digest_neuron(
+            Dataset(
+                [
+                    (chunk_info, outline, digest, Digest([], topic), *extra_args)
+                    for _, chunk_info in chunks
+                ]
+            )
+        )
+
+        paper_digests = [[] for _ in paper_infos]
+        for (i, _), result in zip(chunks, results):
+            if isinstance(result, Digest) and result.root is not None:
+                paper_digests[i].append(result)
+        digests = []
+        for paper_info, chunk_digests in zip(paper_infos, paper_digests):
+            if len(chunk_digests) == 1:
+                digests.append(chunk_digests[0])
+            elif chunk_digests:
+                digests.append(MergeDigestNeuron.merge_chunk_digests(chunk_digests, paper_info))
+        return digests
+
+    def _split_paper(self, paper_info):
+        """
+        The paper info of each chunk of the paper, the paper itself if it is
+        not longer than max_paper_tokens.
+        """
+        if not self.max_paper_tokens or paper_info.get("origin_token", 0) <= self.max_paper_tokens:
+            return [paper_info]
+        contents = split_by_sections(paper_info["origin_content"], self.max_paper_tokens)
+        if len(contents) <= 1:
+            return [paper_info]
+        logger.info(
+            f"Split paper {paper_info['bibkey']} of {paper_info['origin_token']} tokens into {len(contents)} chunks"
+        )
+        return [
+            dict(paper_info, content=content, origin_content=content)
+            for content in contents
+        ]
+
 
 class SingleDigestNeuron(Neuron):
     def __init__(self, config, prompts: PromptsProtocol):
         super().__init__()
         self.prompt = prompts.SINGLE_DIGEST_PROMPT
+        # 同一综述的各篇文章共用指令、大纲和格式示例，放在提示词开头作为前缀，
+        # 后端的前缀缓存只需为每篇文章计算文章部分，配置prefix_cache为false时使用原提示词
+        self.prefix_cache = config.get("prefix_cache", True)
+        self.prefix_prompt = prompts.SINGLE_DIGEST_PREFIX_PROMPT
+        self.paper_prompt = prompts.SINGLE_DIGEST_PAPER_PROMPT
+        self.partial_prompt = prompts.SINGLE_DIGEST_PARTIAL_PROMPT
         self.request_pool = RequestWrapper(
             model=config["model"], infer_type=config["infer_type"]
         )
+        # 单篇论文的慢请求会拖住整组digest，可在配置中开启对冲请求
+        self.hedge = HedgePolicy.from_config(config.get("hedge"))
 
     @retry(
         stop=stop_after_attempt(10),
         after=after_log(logger, logging.WARNING),
+        # 格式错误原样重试，超出上下文长度时缩短论文后重试，见下方的异常处理
         retry=retry_if_exception_type(
             (
                 BibkeyNotFoundError,
@@ -79,49 +225,83 @@ class SingleDigestNeuron(Neuron):
                 IndexError,
                 ValueError,
             )
-        ),
+        ) | retry_if_exception(is_context_length_error),
     )
-    def forward(self, paper_info, outline, digest, new_digest):
+    def forward(self, paper_info, outline, digest, new_digest, sections=None):
+        """
+        sections: 只为这些大纲章节生成digest（增量模式），完整的大纲仍作为上下文
+        """
         outline_content = outline.all_skeleton(construction=True, with_index=True)
         outline_content = remove_illegal_bibkeys(
             outline_content, digest.bibkeys, raise_warning=False
         )
-        outline_example = outline.all_skeleton(
-            with_digest_placeholder=True, with_index=True
-        )
+        if sections is None:
+            outline_example = outline.all_skeleton(
+                with_digest_placeholder=True, with_index=True
+            )
+        else:
+            outline_example = self._get_partial_example(outline, sections)
 
         survey_title = outline.survey_title
         paper_bibkey = paper_info["bibkey"]
         paper_content = paper_info["content"]
         paper_content = paper_content.replace("#", "")
-        prompt = self.prompt.format(
-            survey_title=survey_title,
-            paper_bibkey=f"{paper_bibkey}",
-            paper_content=paper_content,
-            survey_outline=outline_content,
-            outline_example=outline_example,
-        )
+        prefix = None
+        if self.prefix_cache:
+            prefix = self.prefix_prompt.format(
+                survey_outline=outline_content,
+                outline_example=outline_example,
+            )
+            if sections is not None:
+                prefix += self.partial_prompt
+            prompt = self.paper_prompt.format(
+                paper_bibkey=f"{paper_bibkey}",
+                paper_content=paper_content,
+            )
+        else:
+            prompt = self.prompt.format(
+                survey_title=survey_title,
+                paper_bibkey=f"{paper_bibkey}",
+                paper_content=paper_content,
+                survey_outline=outline_content,
+                outline_example=outline_example,
+            )
+            if sections is not None:
+                prompt += "\n" + self.partial_prompt
         result = ""
         try:
-            result = self.request_pool.completion(prompt)
+            result = self.request_pool.completion(prompt, prefix=prefix, hedge=self.hedge)
             result = result.replace("['BIBKEY']", f"['{paper_bibkey}']")
+            result = result.replace('["BIBKEY"]', f"['{paper_bibkey}']")
             result = result.replace("[BIBKEY]", f"['{paper_bibkey}']")
             logger.info(f"Single Digest Generate Finished: {paper_bibkey}")
 
             
             new_digest.paper_infos = [paper_info]
             new_digest.parse_suggestion(result, paper_bibkey)
-            new_digest = new_digest.parse_raw_digest(result, outline)
+            if sections is None:
+                new_digest = new_digest.parse_raw_digest(result, outline)
+            else:
+                new_digest = new_digest.parse_partial_digest(result, sections)
         except Exception as e:
             new_digest.failure_count += 1
-            content_len = int(len(paper_content) * 0.5)
-            paper_info["content"] = paper_content[:int(content_len)]
+            if is_context_length_error(e):
+                # 格式错误与论文长度无关，只在超出上下文长度时缩短论文
+                paper_info["content"] = truncate_tokens(
+                    paper_content, count_tokens(paper_content) // 2
+                )
             if new_digest.failure_count >= 5:
                 logger.warning(
                     f"Single Digest Generate Failed: {paper_bibkey}, Error: {e}, \nprompt: {prompt}, \nresult: {result}"
                 )
             if new_digest.failure_count >=9:
-                new_digest.parse_raw_digest(f"```markdown\n{outline.all_skeleton(with_index=True)}\n```", outline)
+                if sections is None:
+                    new_digest.parse_raw_digest(f"```markdown\n{outline.all_skeleton(with_index=True)}\n```", outline)
+                else:
+                    new_digest.parse_partial_digest(
+                        f"```markdown\n{self._get_partial_example(outline, sections, placeholder=False)}\n```",
+                        sections,
+                    )
                 logger.warning(
                     f"Single Digest Generate Failed, return empty: {paper_bibkey}, Error: {e}, \nprompt: {prompt}, \nresult: {result}"
                 )
@@ -129,6 +309,14 @@ class SingleDigestNeuron(Neuron):
             raise
         return new_digest
 
+    def _get_partial_example(self, outline, sections, placeholder=True):
+        contents = [outline.root.get_skeleton(with_index=True)]
+        contents.extend(
+            section.get_skeleton(with_digest_placeholder=placeholder, with_index=True)
+            for section in sections
+        )
+        return "\n".join(contents).strip()
+
 
 class MergeDigestNeuron(Neuron):
     def __init__(self, config):
@@ -153,13 +341,42 @@ class MergeDigestNeuron(Neuron):
     def forward(self, digests: List[Digest], paper_infos, outline, origin_digest):
         new_digest = Digest.from_multiple_digests(digests, outline)
         for i, section in enumerate(new_digest.root.all_section):
-            section.description = ""
-            descriptions = []
-            for digest in digests:
-                d_section = digest.root.all_section[i]
-                if d_section.description:
-                    descriptions.append(
-                        f"Paper bibkey: [{''.join(digest.bibkeys)}]\nDigest: \n{d_section.description}"
-                    )
-            section.description = "--------------------\n".join(descriptions)
-        return new_digest
\ No newline at end of file
+            section.description = self.merge_descriptions(digests, i)
+        return new_digest
+
+    @staticmethod
+    def merge_chunk_digests(digests: List[Digest], paper_info):
+        """
+        One digest of a paper from the digests of its chunks, the descriptions
+        and suggestions of the chunks are joined in the order of the chunks.
+        """
+        new_digest = deepcopy(digests[0])
+        new_digest.paper_infos = [paper_info]
+        for i, section in enumerate(new_digest.root.all_section):
+            section.description = "\n".join(
+                d.root.all_section[i].description
+                for d in digests
+                if d.root.all_section[i].description
+            )
+        new_digest.suggestions = {}
+        for d in digests:
+            for bibkey, suggestion in d.suggestions.items():
+                if bibkey in new_digest.suggestions:
+                    new_digest.suggestions[bibkey] += "\n" + suggestion
+                else:
+                    new_digest.suggestions[bibkey] = suggestion
+        return new_digest
+
+    @staticmethod
+    def merge_descriptions(digests: List[Digest], position):
+        """
+        The descriptions of the section at position of each single paper digest, marked with the bibkey.
+        """
+        descriptions = []
+        for digest in digests:
+            d_section = digest.root.all_section[position]
+            if d_section.description:
+                descriptions.append(
+                    f"Paper bibkey: [{''.join(digest.bibkeys)}]\nDigest: \n{d_section.description}"
+                )
+        return "--------------------\n".join(descriptions)
\ No newline at end of file
@@ -1,6 +1,7 @@
 import re
 from tenacity import retry, stop_after_attempt, after_log, retry_if_exception_type
 
+import math
 import random
 from typing import List
 from request import RequestWrapper
@@ -13,6 +14,7 @@ from src.exceptions import (
     GroupEmptyError,
 )
 from src.utils.process_str import list2str, str2list
+from src.utils.text_cluster import tfidf_vectors, balanced_kmeans
 from src.prompts import get_prompts, PromptsProtocol
 import logging
 
@@ -20,6 +22,8 @@ logger = logging.getLogger(__name__)
 
 
 class GroupModule(Module):
+    SIMILARITY_TEXT_LENGTH = 20000
+
     def __init__(self, config, mode, digest_batch, language: str = "en"):
         super().__init__()
         self.mode = mode
@@ -33,6 +37,8 @@ class GroupModule(Module):
             papers = self._random_group_papers(papers, self.digest_batch)
         elif self.mode == "llm":
             papers = self._llm_group_papers(papers, self.digest_batch, survey.title)
+        elif self.mode == "similarity":
+            papers = self._similarity_group_papers(papers, self.digest_batch)
 
         for paper_batch in papers:
             digest = Digest(paper_batch, survey.title)
@@ -54,6 +60,28 @@ class GroupModule(Module):
         for i in range(0, len(papers), step):
             yield papers[i : i + step]
 
+    def _similarity_group_papers(self, papers, step):
+        """
+        Groups similar papers by the TF-IDF of their title, abstract and the
+        beginning of the text, without LLM requests, each group has at most
+        step papers and the groups are about the same size.
+        """
+        group_num = math.ceil(len(papers) / step)
+        if group_num <= 1:
+            yield from self._sequential_group_papers(papers, step)
+            return
+        texts = [
+            # 标题重复两次以提高其权重，正文只取开头部分
+            f"{paper['title']} {paper['title']} {paper.get('abstract') or ''} {(paper.get('txt') or '')[:self.SIMILARITY_TEXT_LENGTH]}"
+            for paper in papers
+        ]
+        vectors = tfidf_vectors(texts)
+        labels = balanced_kmeans(vectors, group_num, math.ceil(len(papers) / group_num))
+        for group in range(group_num):
+            group_papers = [paper for paper, label in zip(papers, labels) if label == group]
+            if group_papers:
+                yield group_papers
+
     @retry(
         stop=stop_after_attempt(5),
         after=after_log(logger, logging.WARNING),
@@ -1,6 +1,6 @@
 import random
 from typing import Dict
-from request import RequestWrapper
+from request import RequestWrapper, stop_after_md_block
 from src.base_method.module import Neuron, Module
 from src.base_method.data import Dataset
 from src.utils.process_str import list2str
@@ -53,7 +53,8 @@ class SingleSkeletonNeuron(Neuron):
     )
     def forward(self, title, digests:Dict[str, Digest]):
         def format_abstract(digest_list):
-            random.shuffle(digest_list)
+            # 固定顺序，重试和重跑时提示词不变，可复用后端的前缀缓存
+            digest_list = sorted(digest_list, key=lambda digest: sorted(digest.bibkeys))
             result = "\n---------------------\n".join([digest.abstract for digest in digest_list])
             return result
 
@@ -70,7 +71,9 @@ class SingleSkeletonNeuron(Neuron):
         prompt = self.prompt.format(
             title=title, abstracts=format_abstracts, bibkeys=bibkeys
         )
-        new_raw_outline = self.request_pool.completion(prompt)
+        new_raw_outline = self.request_pool.completion(
+            prompt, stop_when=stop_after_md_block("markdown")
+        )
         new_outline = Skeleton(merge_frozensets(digests.keys()))
         new_outline.parse_raw_skeleton(title, new_raw_outline)
         logger.info(f"Single outline finished: Survey {title}.")
@@ -97,14 +100,16 @@ class ConcatSkeletonNeuron(Neuron):
         prompt = self.prompt.format(
             title=survey.title, outlines=concat_results, bibkeys=bibkeys
         )
-        new_outline = self.request.completion(prompt)
+        new_outline = self.request.completion(
+            prompt, stop_when=stop_after_md_block("markdown")
+        )
         survey.skeleton.parse_raw_skeleton(survey.title, new_outline)
         logger.info(f"Concat outline finished: Survey {survey.title}.")
         return survey
 
     def _concat_outlines(self, outlines):
         result = []
-        random.shuffle(outlines)
+        outlines = sorted(outlines, key=lambda outline: sorted(outline.references))
         for i, outline in enumerate(outlines):
             result.append(f"```markdown\n{outline.all_skeleton(construction=True, analysis=True, with_index=False)}\n```")
         result = "\n--------------------------\n".join(result)
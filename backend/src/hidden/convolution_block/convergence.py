@@ -0,0 +1,74 @@
+import logging
+
+from request.usage import is_over_budget
+
+logger = logging.getLogger(__name__)
+
+
+class ConvergencePolicy:
+    """
+    Decides when the refinement of an outline (the convolution layers or the
+    self-refine iterations) stops before its configured depth.
+
+    It stops when the best score reaches max_score - score_tolerance, when
+    neither the best nor the average score improved by min_improvement for
+    `patience` steps, or when the task is over its token budget.
+    """
+
+    def __init__(
+        self, min_improvement=0.1, patience=1, max_score=None, score_tolerance=0.0, enabled=True
+    ):
+        self.min_improvement = min_improvement
+        self.patience = patience
+        self.max_score = max_score
+        self.score_tolerance = score_tolerance
+        self.enabled = enabled
+
+    @classmethod
+    def from_config(cls, config, max_score=None):
+        """
+        Builds the policy from the "early_stop" entry of a module config,
+        false disables the early stop (the token budget still applies).
+        """
+        if config is False:
+            return cls(max_score=max_score, enabled=False)
+        config = config or {}
+        return cls(
+            min_improvement=config.get("min_improvement", 0.1),
+            patience=config.get("patience", 1),
+            max_score=max_score,
+            score_tolerance=config.get("score_tolerance", 0.0),
+            enabled=config.get("enabled", True),
+        )
+
+    def get_stop_reason(self, task_id, best_scores, avg_scores=None):
+        """
+        The reason to stop before the next step, None to go on.
+
+        best_scores: the best score after each step so far, the first one is the start
+        avg_scores: the average score of each step, optional
+        """
+        if is_over_budget(task_id):
+            return "token budget exceeded"
+        if not self.enabled or not best_scores:
+            return None
+
+        best_score = max(best_scores)
+        if self.max_score is not None and best_score >= self.max_score - self.score_tolerance:
+            return f"best score {best_score} reached max score {self.max_score}"
+
+        if len(best_scores) <= self.patience:
+            return None
+        improvement = self._get_improvement(best_scores)
+        if avg_scores and len(avg_scores) > self.patience:
+            improvement = max(improvement, self._get_improvement(avg_scores))
+        if improvement < self.min_improvement:
+            return (
+                f"score improved {improvement:.3f} < {self.min_improvement} "
+                f"in the last {self.patience} steps"
+            )
+        return None
+
+    def _get_improvement(self, scores):
+        # the gain of the last `patience` steps over the best score before them
+        return max(scores[-self.patience:]) - max(scores[: -self.patience])
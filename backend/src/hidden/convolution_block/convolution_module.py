@@ -12,6 +12,7 @@ from src.hidden.convolution_block.neurons import (
     ConvolutionKernelNeuron,
 )
 from src.prompts import get_prompts, PromptsProtocol
+from .convergence import ConvergencePolicy
 
 logger = logging.getLogger(__name__)
 
@@ -36,6 +37,10 @@ class ConvolutionLayerModule(Module):
         self.convolution_module = ConvolutionModule(config, prompts)
         self.modify_neuron = ModifyOutlineNeuron(config["modify"], "residual", prompts)
         self.eval_neuron = EvalOutlineNeuron(config["eval"], prompts)
+        # 分数达到满分或不再提升时提前结束剩余的卷积层
+        self.convergence_policy = ConvergencePolicy.from_config(
+            config.get("early_stop"), self.eval_neuron.max_score
+        )
 
     def forward(
         self,
@@ -65,10 +70,20 @@ class ConvolutionLayerModule(Module):
         scores = [result[2] for result in conv_results_old]
         avg_score = np.mean(scores)
         current_block_avg_scores.append(avg_score)
+        best_scores = [max(origin_outline_score[0], max(scores))]
         logger.info(
             f"Survey {survey.title}, block cycle count {survey.block_cycle_count}, origin outline score: {origin_outline_score[0]}\nCurrent Layer Outline Scores: {scores}, Avg Score: {avg_score}, Max Score: {max(scores)}"
         )
         for layer_idx in range(self.convolution_layer):
+            stop_reason = self.convergence_policy.get_stop_reason(
+                survey.task_id, best_scores, current_block_avg_scores
+            )
+            if stop_reason:
+                logger.info(
+                    f"Survey {survey.title}, block cycle count {survey.block_cycle_count}, stop convolution before layer {layer_idx}: {stop_reason}"
+                )
+                survey.record_early_stop("convolution", layer_idx, stop_reason)
+                break
             logger.info(
                 f"Survey {survey.title}, block cycle count {survey.block_cycle_count}, Convolution Layer: {layer_idx} Start"
             )
@@ -101,6 +116,7 @@ class ConvolutionLayerModule(Module):
             conv_new_scores = [result[2] for result in conv_results_new]
             avg_score = np.mean(conv_new_scores)
             current_block_avg_scores.append(avg_score)
+            best_scores.append(max(conv_new_scores))
 
             if target_result_num > self.result_num:
                 logger.info(
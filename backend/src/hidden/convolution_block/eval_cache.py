@@ -0,0 +1,124 @@
+import re
+import logging
+import difflib
+from collections import OrderedDict
+
+from gevent.event import AsyncResult
+
+logger = logging.getLogger(__name__)
+
+MAX_SURVEY_NUM = 1000
+
+
+def canonicalize_outline(outline):
+    """
+    The outline text without the markdown fence, blank lines and the
+    differences in whitespace, the same outline rendered by
+    Skeleton.all_skeleton gives the same text.
+    """
+    lines = []
+    for line in outline.splitlines():
+        line = re.sub(r"\s+", " ", line).strip()
+        if line and not line.startswith("```"):
+            lines.append(line)
+    return "\n".join(lines)
+
+
+class OutlineEvalCache:
+    """
+    The scores of the outlines of one survey, reused for the same outline in
+    the convolution layers, the self-refine iterations and the later blocks.
+
+    The candidates with the same canonical outline evaluated at the same time
+    wait for one request. With min_similarity, an outline whose lines match a
+    scored outline by at least that ratio (difflib) reuses its score.
+    """
+
+    def __init__(self):
+        self._results = {}  # (namespace, canonical outline): (score, detail)
+        self._pending = {}  # (namespace, canonical outline): AsyncResult
+        self.hit_count = 0
+        self.similar_hit_count = 0
+        self.eval_count = 0
+
+    def get_or_evaluate(self, namespace, outline, evaluate, min_similarity=None):
+        """
+        The (score, detail) of the outline, evaluate() is only called when
+        no equal (or similar enough) outline is scored or being scored.
+
+        namespace: the results of different evaluators (model, max score) are not shared
+        """
+        key = (namespace, canonicalize_outline(outline))
+        if key in self._results:
+            self.hit_count += 1
+            return self._results[key]
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.hit_count += 1
+            return pending.get()
+        if min_similarity is not None:
+            similar = self._find_similar(key, min_similarity)
+            if similar is not None:
+                self.similar_hit_count += 1
+                return similar
+
+        pending = self._pending[key] = AsyncResult()
+        self.eval_count += 1
+        try:
+            result = evaluate()
+        except BaseException as e:
+            # 等待同一大纲的候选一起失败，由各自的重试逻辑处理
+            pending.set_exception(e)
+            raise
+        else:
+            self._results[key] = result
+            pending.set(result)
+            return result
+        finally:
+            self._pending.pop(key, None)
+
+    def stats(self):
+        return {
+            "hit": self.hit_count,
+            "similar_hit": self.similar_hit_count,
+            "eval": self.eval_count,
+        }
+
+    def _find_similar(self, key, min_similarity):
+        namespace, outline = key
+        lines = outline.splitlines()
+        best_ratio, best_result = min_similarity, None
+        for (other_namespace, other_outline), result in self._results.items():
+            if other_namespace != namespace:
+                continue
+            matcher = difflib.SequenceMatcher(None, lines, other_outline.splitlines(), autojunk=False)
+            if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best_ratio, best_result = ratio, result
+        if best_result is not None:
+            logger.debug(f"Reuse the score of an outline with similarity {best_ratio:.3f}")
+        return best_result
+
+
+_caches = OrderedDict()  # survey key: OutlineEvalCache, the least recently used first
+
+
+def get_eval_cache(key):
+    """
+    The cache of the survey, the key is the task_id of the survey (or its
+    title outside the pipeline).
+    """
+    cache = _caches.get(key)
+    if cache is None:
+        cache = _caches[key] = OutlineEvalCache()
+        while len(_caches) > MAX_SURVEY_NUM:
+            _caches.popitem(last=False)
+    else:
+        _caches.move_to_end(key)
+    return cache
+
+
+def pop_eval_cache(key):
+    return _caches.pop(key, None)
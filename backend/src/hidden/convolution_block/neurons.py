@@ -1,11 +1,11 @@
 import logging
 import re
-import random
 
 from copy import deepcopy
 from typing import List, Any
-from request import RequestWrapper
+from request import RequestWrapper, CachePolicy, HedgePolicy, stop_after_md_block, stop_after_tags
 from src.base_method.module import Neuron
+from async_d.cancel import current_key
 
 from src.data_structure import Feedback, Skeleton, Digest
 from src.utils.process_str import list2str, parse_md_content
@@ -15,6 +15,7 @@ from src.exceptions import (
     MdNotFoundError,
 )
 from src.prompts import PromptsProtocol
+from .eval_cache import get_eval_cache
 
 from tenacity import retry, stop_after_attempt, after_log, retry_if_exception_type
 
@@ -60,7 +61,9 @@ class FeedbackClusterNeuron(Neuron):
                 usage=usage,
                 bibkeys=bibkeys,
             )
-            suggestions = self.request_pool.completion(prompt)
+            suggestions = self.request_pool.completion(
+                prompt, stop_when=stop_after_md_block("suggestion")
+            )
             parsed_suggestions = parse_md_content(suggestions, label="suggestion")
             suggestion = Feedback(
                 src_outline=outline.all_skeleton(
@@ -86,7 +89,7 @@ class FeedbackClusterNeuron(Neuron):
             return "\n".join(result)
 
         formatted_digests = []
-        random.shuffle(digests)
+        digests = sorted(digests, key=lambda digest: sorted(digest.bibkeys))
         new_digest = Digest.from_multiple_digests(digests, outline)
         return f"Digest Content: \n{new_digest.all_content(with_title=False)}\nFeedbacks: \n{format_suggestions(new_digest.suggestions)}"
 
@@ -98,6 +101,7 @@ class ConvolutionKernelNeuron(Neuron):
         self.request = RequestWrapper(
             model=config["model"], infer_type=config["infer_type"]
         )
+        self.hedge = HedgePolicy.from_config(config.get("hedge"))
 
     @retry(
         stop=stop_after_attempt(10),
@@ -116,7 +120,8 @@ class ConvolutionKernelNeuron(Neuron):
         self, survey_title, origin_outline, suggestions: List[Feedback], bibkeys
     ):
         def concat_suggestions(suggestions):
-            random.shuffle(suggestions)
+            # 固定顺序，重试和重跑时提示词不变，可复用后端的前缀缓存
+            suggestions = sorted(suggestions, key=lambda suggestion: suggestion.content)
             result = "------------------------------\n".join(
                 [
                     f"Suggestion Content: \n<CONTENT>\n{suggestion.content}\n</CONTENT>\n\nEvaluation: \n<EVALUATION>\n{suggestion.eval_detail}\n</EVALUATION>\n"
@@ -135,7 +140,9 @@ class ConvolutionKernelNeuron(Neuron):
             suggestions=concated_suggestions,
             bibkeys=list2str(bibkeys),
         )
-        merge_suggestion = self.request.completion(prompt)
+        merge_suggestion = self.request.completion(
+            prompt, stop_when=stop_after_md_block("suggestion"), hedge=self.hedge
+        )
         logger.debug(
             f"Convolution Kernel Neuron finished, Prompt: \n{prompt}\nMerged Suggestion: \n{merge_suggestion}"
         )
@@ -159,6 +166,7 @@ class ModifyOutlineNeuron(Neuron):
         self.request = RequestWrapper(
             model=config["model"], infer_type=config["infer_type"]
         )
+        self.hedge = HedgePolicy.from_config(config.get("hedge"))
 
     @retry(
         stop=stop_after_attempt(20),
@@ -180,7 +188,9 @@ class ModifyOutlineNeuron(Neuron):
             old_outline=old_outline,
             bibkeys=list2str(bibkeys),
         )
-        new_raw_outline = self.request.completion(prompt)
+        new_raw_outline = self.request.completion(
+            prompt, stop_when=stop_after_md_block("markdown"), hedge=self.hedge
+        )
         new_outline = Skeleton(bibkeys)
         new_outline = new_outline.parse_raw_skeleton(title, new_raw_outline)
         logger.info(f"Modify Outline finished: Survey {title}")
@@ -211,14 +221,30 @@ class EvalOutlineNeuron(Neuron):
         self.request = RequestWrapper(
             model=config["model"], infer_type=config["infer_type"]
         )
+        self.hedge = HedgePolicy.from_config(config.get("hedge"))
         self.max_score = config["max_score"]
+        # 同一Survey中相同的大纲只打分一次，false关闭，min_similarity为复用相似大纲分数的最小相似度
+        cache_config = config.get("cache", {})
+        self.use_cache = cache_config is not False
+        self.min_similarity = (cache_config or {}).get("min_similarity")
+
+    def forward(self, title, outline) -> tuple[float, Any]:
+        if not self.use_cache:
+            return self._evaluate(title, outline)
+        cache = get_eval_cache(current_key() or title)
+        return cache.get_or_evaluate(
+            (self.request.model, self.max_score),
+            outline,
+            lambda: self._evaluate(title, outline),
+            min_similarity=self.min_similarity,
+        )
 
     @retry(
         stop=stop_after_attempt(15),
         after=after_log(logger, logging.WARNING),
         retry=retry_if_exception_type((IndexError, ValueError)),
     )
-    def forward(self, title, outline) -> tuple[float, Any]:
+    def _evaluate(self, title, outline) -> tuple[float, Any]:
         def parse_score(raw_str):
             reg = re.compile(r"<SCORE>\s*(\d+\.\d+|\d+)\s*</SCORE>", re.DOTALL)
             score = reg.findall(raw_str)[0]
@@ -233,7 +259,13 @@ class EvalOutlineNeuron(Neuron):
             title=title,
             outline=outline,
         )
-        result = self.request.completion(prompt)
+        # 相同大纲的打分直接复用，无法解析出分数的结果不缓存
+        result = self.request.completion(
+            prompt,
+            cache=CachePolicy(validate=parse_score),
+            stop_when=stop_after_tags("SCORE"),
+            hedge=self.hedge,
+        )
         logger.debug(f"Eval Outline finished, Prompt: {prompt}\nResult: {result}")
         score = parse_score(result)
         return score, result
@@ -265,7 +297,9 @@ class SelfRefineNeuron(Neuron):
             outline=old_outline,
             eval_detail=eval_detail,
         )
-        suggestions = self.request.completion(prompt)
+        suggestions = self.request.completion(
+            prompt, stop_when=stop_after_md_block("suggestion")
+        )
         parsed_suggestions = parse_md_content(suggestions, label="suggestion")
         suggestion = Feedback(
             src_outline=old_outline,
@@ -9,6 +9,7 @@ from src.hidden.convolution_block.neurons import (
     EvalOutlineNeuron,
 )
 from src.prompts import PromptsProtocol
+from .convergence import ConvergencePolicy
 
 logger = logging.getLogger(__name__)
 
@@ -18,13 +19,26 @@ class SelfRefineModule(Module):
         self.refine_count = refine_count
         self.best_of = best_of
         self.single_refine_module = SingleRefineModule(config, prompts)
+        # 精炼后的分数达到满分或不再提升时跳过剩余的精炼轮次
+        self.convergence_policy = ConvergencePolicy.from_config(
+            config.get("early_stop"),
+            self.single_refine_module.eval_outline_neuron.max_score,
+        )
 
     def forward(self, survey: Survey) -> List[float]:
         title = survey.title
         bibkeys = survey.papers.keys()
         new_outline = survey.skeleton
         self_refine_score = []
+        best_scores = [new_outline.eval_score] if new_outline.eval_score is not None else []
         for i in range(self.refine_count):
+            stop_reason = self.convergence_policy.get_stop_reason(survey.task_id, best_scores)
+            if stop_reason:
+                logger.info(
+                    f"Self-refine module: Survey {survey.title} stop before refine count {i}: {stop_reason}"
+                )
+                survey.record_early_stop("self_refine", i, stop_reason)
+                break
             old_outline = new_outline.all_skeleton(
                 construction=True, analysis=True, with_index=True
             )
@@ -48,6 +62,7 @@ class SelfRefineModule(Module):
             new_outline = new_outlines[0]
             all_score = [x.eval_score for x in new_outlines]
             self_refine_score.append(all_score)
+            best_scores.append(new_outline.eval_score)
             logger.info(
                 f"Self-refine module: Survey {survey.title} refine count: {i} end, best score: {new_outline.eval_score}, all scores: {all_score}"
             )
@@ -1,10 +1,14 @@
+import functools
 from async_d import Node
 from async_d import Pipeline
+from async_d import FairQueue
 
 from src.hidden.convolution_block.skeleton_module import SkeletonRefineModule
+from src.hidden.convolution_block.eval_cache import pop_eval_cache
 from .basic_modules.digest_module import DigestModule
 from .basic_modules.skeleton_init_module import SkeletonInitModule
 from .basic_modules.group_module import GroupModule
+from request.usage import is_over_budget
 import logging
 logger = logging.getLogger(__name__)
 
@@ -48,14 +52,26 @@ class HiddenPipeline(Pipeline):
             language=language,
         )
 
+        # surveys of all tasks share the nodes, serve them fairly by task and weight by paper count
+        survey_scheduler = functools.partial(
+            FairQueue,
+            flow_key=lambda survey: survey.task_id,
+            cost=lambda survey: len(survey.papers),
+        )
+
         self.group_node = Node(self.group_module, worker_num=worker_num, queue_size=worker_num * 10)
         self.skeleton_init_node = Node(self.skeleton_init_module, worker_num=worker_num, queue_size=worker_num * 10)
         self.digest_node = Node(
-            self.digest_module, put_deepcopy_data=True, worker_num=worker_num * 5, queue_size=worker_num * 20, discard_none_output=True
+            self.digest_module, put_shared_data=True, worker_num=worker_num * 5, queue_size=worker_num * 20, discard_none_output=True,
+            scheduler=survey_scheduler, min_worker_num=worker_num, max_worker_num=worker_num * 10,
+        )
+        self.skeleton_refine_node = Node(
+            self.skeleton_refine_module, worker_num=worker_num * 5, queue_size=worker_num * 20, scheduler=survey_scheduler,
+            min_worker_num=worker_num, max_worker_num=worker_num * 10,
         )
-        self.skeleton_refine_node = Node(self.skeleton_refine_module, worker_num=worker_num * 5, queue_size=worker_num * 20) 
         self.regen_digest_node = Node(
-            self.digest_module, put_deepcopy_data=True, worker_num=worker_num * 5, queue_size=worker_num * 20, discard_none_output=True
+            self.digest_module, put_shared_data=True, worker_num=worker_num * 5, queue_size=worker_num * 20, discard_none_output=True,
+            scheduler=survey_scheduler, min_worker_num=worker_num, max_worker_num=worker_num * 10,
         )
         self.output_node = Node(
             self.output_data, discard_none_output=True, worker_num=worker_num, queue_size=worker_num * 10
@@ -79,10 +95,26 @@ class HiddenPipeline(Pipeline):
         self.digest_node.set_dst_criteria(self.skeleton_refine_node, self.iter_criteria)
 
     def output_data(self, survey):
-        if not self.output_each_block and survey.block_cycle_count < self.block_count:
-            logger.info(f"Survey {survey.title} is not reach block count, not output.")
-            survey = None
+        # 沿用digest节点分发时的判断，预算在两次判断之间可能变化
+        if not survey.stop_iteration:
+            if not self.output_each_block:
+                logger.info(f"Survey {survey.title} is not reach block count, not output.")
+                survey = None
+            return survey
+        # 不再进行后续block的Survey不再需要大纲打分缓存
+        eval_cache = pop_eval_cache(survey.task_id or survey.title)
+        if eval_cache is not None:
+            logger.info(f"Survey {survey.title} outline eval cache: {eval_cache.stats()}")
         return survey
 
     def iter_criteria(self, survey):
-        return survey.block_cycle_count < self.block_count
\ No newline at end of file
+        # 每个block只判断一次，结果记录在survey上供output_data使用
+        survey.stop_iteration = not self._should_iterate(survey)
+        return not survey.stop_iteration
+
+    def _should_iterate(self, survey):
+        if survey.block_cycle_count < self.block_count and is_over_budget(survey.task_id):
+            # 超出token预算的任务不再进行后续的block，直接输出当前结果
+            logger.warning(f"Survey {survey.title} is over its token budget, stop at block cycle count: {survey.block_cycle_count}")
+            return False
+        return survey.block_cycle_count < self.block_count
@@ -11,13 +11,21 @@ Pipeline处理器模块
 import os
 import json
 import time
-import asyncio
 import logging
 import threading
 from typing import Optional, Dict, Any, Callable
 from datetime import datetime
 from abc import ABC, abstractmethod
 
+from async_d import cancel
+from request import run_async
+from request.usage import (
+    set_task_budget,
+    get_task_usage,
+    pop_task_usage,
+    usage_scope,
+    load_default_budget,
+)
 from src.task_manager import TaskStatus, get_task_manager
 from src.path_validator import get_path_validator
 from src.database.mongo_manager import get_mongo_manager
@@ -272,6 +280,9 @@ class PipelineTaskManager:
             params = task['params']
             language = params.get('language', 'en')
             
+            # 设置任务的token预算，超出后跳过可选的优化步骤（剩余的精炼轮次等）
+            self._set_budget(task_id, params)
+            
             # 更新状态：准备中
             self.task_manager.update_task_status(task_id, TaskStatus.PREPARING)
             logger.info(f"[任务 {task_id}] 开始准备任务")
@@ -281,9 +292,10 @@ class PipelineTaskManager:
             
             if params.get('topic'):
                 # 异步处理主题搜索
-                result_task_id = asyncio.run(
-                    self.topic_processor.process(task_id, params)
-                )
+                with usage_scope(task_id, "TopicSearch"):
+                    result_task_id = run_async(
+                        self.topic_processor.process(task_id, params)
+                    )
                 
                 if not result_task_id:
                     # TopicSearchProcessor已经更新了失败状态，这里直接返回
@@ -373,6 +385,51 @@ class PipelineTaskManager:
             logger.error(f"[任务 {task_id}] {error_msg}")
             self.task_manager.update_task_status(task_id, TaskStatus.FAILED, error_msg)
     
+    def _set_budget(self, task_id: str, params: Dict[str, Any]):
+        """任务参数中的token_budget只能收紧TASK_TOKEN_BUDGET配置的预算"""
+        max_tokens = load_default_budget()
+        if params.get('token_budget'):
+            max_tokens = min(filter(None, [max_tokens, int(params['token_budget'])]))
+        usage = set_task_budget(task_id, max_tokens=max_tokens, max_cost=params.get('cost_budget'))
+        if max_tokens or usage.max_cost:
+            logger.info(f"[任务 {task_id}] token预算: {max_tokens}, 费用预算: {usage.max_cost}")
+    
+    def _save_token_usage(self, task_id: str, saved_version: int = 0) -> int:
+        """用量有变化时保存到TaskManager，返回已保存的版本"""
+        usage = get_task_usage(task_id)
+        if usage is None or usage.version == saved_version:
+            return saved_version
+        if self.task_manager.update_token_usage(task_id, usage.to_dict()):
+            return usage.version
+        return saved_version
+    
+    def cancel_task(self, task_id: str) -> int:
+        """
+        取消任务在Pipeline中的处理：队列中的数据在被取出时丢弃，正在执行的协程被结束
+        
+        Returns:
+            被结束的协程数量
+        """
+        killed_count = cancel(task_id)
+        logger.info(f"[任务 {task_id}] 已取消Pipeline处理，结束 {killed_count} 个执行中的协程")
+        return killed_count
+    
+    def resume_tasks(self, task_ids):
+        """继续监控从检查点恢复到Pipeline中的任务"""
+        for task_id in task_ids:
+            task = self.task_manager.get_task(task_id)
+            if not task:
+                logger.warning(f"[任务 {task_id}] 恢复的任务不存在，取消其处理")
+                self.cancel_task(task_id)
+                continue
+            if task.get('status') in (TaskStatus.FAILED.value, TaskStatus.TIMEOUT.value):
+                logger.warning(f"[任务 {task_id}] 恢复的任务已结束，取消其处理")
+                self.cancel_task(task_id)
+                continue
+            logger.info(f"[任务 {task_id}] 已从检查点恢复，重新开始监控")
+            self._set_budget(task_id, task.get('params') or {})
+            self._start_monitoring(task_id)
+    
     def _start_monitoring(self, task_id: str):
         """启动任务监控"""
         monitor_thread = threading.Thread(
@@ -387,17 +444,23 @@ class PipelineTaskManager:
         logger.info(f"[任务 {task_id}] 开始监控Pipeline处理状态")
         
         start_time = time.time()
+        saved_version = 0
         
         while time.time() - start_time < self.timeout:
+            saved_version = self._save_token_usage(task_id, saved_version)
+            
             # 检查数据库中的完成状态
             if self._check_completion_in_database(task_id):
                 logger.info(f"[任务 {task_id}] 检测到Pipeline处理已完成")
                 self.task_manager.update_task_status(task_id, TaskStatus.COMPLETED)
                 break
             
-            # 检查任务是否已经失败
+            # 检查任务是否已经失败或被删除
             task = self.task_manager.get_task(task_id)
-            if task and task.get('status') == TaskStatus.FAILED.value:
+            if not task:
+                logger.info(f"[任务 {task_id}] 任务已删除，停止监控")
+                break
+            if task.get('status') == TaskStatus.FAILED.value:
                 logger.info(f"[任务 {task_id}] 检测到任务已标记为失败，停止监控")
                 break
             
@@ -406,7 +469,12 @@ class PipelineTaskManager:
             # 超时处理
             logger.warning(f"[任务 {task_id}] Pipeline处理超时")
             self.task_manager.update_task_status(task_id, TaskStatus.TIMEOUT, "Pipeline处理超时")
+            self.cancel_task(task_id)
         
+        self._save_token_usage(task_id, saved_version)
+        usage = pop_task_usage(task_id)
+        if usage is not None:
+            logger.info(f"[任务 {task_id}] token用量: {usage.total.to_dict()}")
         logger.info(f"[任务 {task_id}] 监控结束")
     
     def _check_completion_in_database(self, task_id: str) -> bool:
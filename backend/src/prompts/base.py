@@ -21,6 +21,9 @@ class PromptsProtocol(Protocol):
 
     # Digest related prompts
     SINGLE_DIGEST_PROMPT: str
+    SINGLE_DIGEST_PREFIX_PROMPT: str
+    SINGLE_DIGEST_PAPER_PROMPT: str
+    SINGLE_DIGEST_PARTIAL_PROMPT: str
     DIGEST_BASE_PROMPT: str
     DIGEST_FREE_PROMPT: str
 
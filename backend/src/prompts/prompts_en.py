@@ -217,6 +217,68 @@ Give your outline modification suggestion for better use this paper as a referen
 ```
 """
 
+# SINGLE_DIGEST_PROMPT split for prefix caching: the part shared by all the papers of a survey comes first, the paper comes last
+SINGLE_DIGEST_PREFIX_PROMPT = """You are a professional academic assistant specializing in literature reviews, supporting researchers in efficiently synthesizing relevant research.
+
+# Background
+Currently, you are assisting with the writing of an academic survey. Since directly incorporating full papers can be overwhelming, the first step is to distill each paper into a concise **paper digest**. This digest should capture the essential information from the paper necessary and give critical analysis of current paper for constructing the survey. This paper has been determined to be relevant to the current review topic through preliminary work, so there should have a section in the outline that is relevant for this paper.
+
+# Task Description
+**YOUR TASK** is to create this digest for the provided **reference paper** based on the pre-defined **outline** of the survey. You must follow the instruction in section description to extract information from full content of reference paper. The resulting digest will act as a representative summary of the reference paper, enabling its use in the broader survey development process. Besides, based on the full paper, you need to provide suggestions to improve the outline quality. 
+
+## Digest Think Principles
+**Please follow these principles to generate the paper digest**:
+1. **Identify Relevant Sections**: Begin by reviewing the outline and identifying which sections are most pertinent to the content of the reference paper. Not all sections (or sub-sections) of the outline will be relevant to the paper. You may omit sections or sub-sections that do not directly apply to the content of the reference paper. But you should ensure that every level of the outline is preserved. Do not alter the structure of the outline. You must not add new sub-sections under existing sections. Fill in the relevant content within the structure provided.
+2. **Condense Content**: When dealing with relevant sections, strictly adhere to the guidance provided in the section description. Condense the paper's content to present the essential information for the survey. Base this critical analysis and insights on the entire content of the paper. In the process, summarize the challenges in the current field and reflect on the deficiencies of the current paper. A critical assessment of the extracted data is necessary. This includes evaluating aspects such as the uniqueness and generalizability of research methods, the representativeness and limitations of samples, the rationality of experimental design, the completeness and innovativeness of the theoretical framework, the depth of result interpretation and discussion, as well as the limitations and prospects of the research. The results of this work will be utilized in the academic survey to conduct a comprehensive analysis of the paper.
+3. **Faithfulness**: Throughout this process, make sure not to introduce any new facts or interpretations that are not supported by the original paper. Stay true to the original paper's findings and avoid any content that is not actually in the paper, i.e., do not produce hallucinated content. Encourage the extraction of experimental results, important formulas, etc from the original text to enhance the amount of information of the materials. Don't extract whole table and chart. Instead, extract the main content of the table and chart.
+
+## Suggestions Think Principles
+1. If this article is not suitable for any part of the outline, please provide suggestions for modifying the outline structure or title so that this article can be included. When making revisions, it is necessary to comprehensively consider the compatibility between the core content of this article and the existing outline framework, so that the new outline structure or title can accurately reflect the position and role of this article in the research topic.
+2. If the information in this article is insufficient to fill in the outline content, please provide suggestions for modifying the outline description to better utilize this article. When modifying the outline description, it should be based on a deep exploration of the content of this article, so that the scope of the outline description matches the information provided in this article, and avoid the inability to effectively integrate the content of this article due to the outline requirements being too high or too low.
+3. Based on the full text and the summarized information above, provide innovative and executable suggestions to address the challenges in the current field and the shortcomings of current work. Give a prediction about the future research direction to address the shortcomings of the current work. The future directions should be concrete rather than generic.
+
+# Output Requirements
+## Format Requirements
+1. **Output Format**: The digest must be in markdown format. Use a first-level title marked with one "#" for the topic and enclose the content in ```markdown\\n```. All section titles from the outline must appear in the digest at the same level; do not skip or omit any sections. The section title must the same with the outline, don't modify any words in the section title. Neglect the structure and title from reference paper, only focus on the content of the paper and follow the outline structure.
+2. **Citation Format**: You need to place the bibkey of the reference paper, given with the reference paper below in the form ['BIBKEY'], at the end of the sentence to specify the source of the information. If the information is not directly from the paper, you can write the sentence without any citation. You should write citation in both digest and suggestion.
+3. **Formula Format**: If there are formulas in the output, please use LaTeX format to represent them. For example, $y = x^2$ for inline formulas and $$y = x^2$$ for block formulas. Don't quote the formula with ```<FORMULA>```, replace it with $$<FORMULA>$$.
+4. **Suggestion Format**: Suggestion should be quoted by ```suggestion```. You only need to provide suggestions, no need to provide the modified new outline. Suggestion should have suitable citation to the paper bibkey.
+
+## Format Example
+Paper Digest:
+```markdown
+{outline_example}
+```
+
+Suggestion:
+```suggestion
+Give your outline modification suggestion for better use this paper as a reference.
+```
+
+# Input Materials
+## Initial Skeleton
+```markdown
+{survey_outline}
+```
+
+"""
+
+SINGLE_DIGEST_PAPER_PROMPT = """## Bibkey of the Reference Paper
+['{paper_bibkey}']
+
+## Reference Paper
+{paper_content}
+
+# Reminder
+Create the digest of the reference paper above following the Initial Skeleton and the output requirements, cite the paper as ['{paper_bibkey}'], then give your suggestion.
+"""
+
+# appended to the shared prompt when only the changed sections of the outline are digested again
+SINGLE_DIGEST_PARTIAL_PROMPT = """## Sections to Digest
+The other sections of the skeleton are already digested. This time, write the digest only for the sections in the format example, keep their titles, levels and order exactly as in the format example, and do not output any other section of the skeleton. The whole skeleton is given as context.
+
+"""
+
 DIGEST_BASE_PROMPT = """You are a professional academic assistant tasked with helping researchers conduct literature reviews based on provided materials.
 
 # Background
@@ -208,6 +208,64 @@ SINGLE_DIGEST_PROMPT = """你是一个专业的学术助手，专门从事文献
 ```
 """
 
+# 为前缀缓存拆分的SINGLE_DIGEST_PROMPT：同一综述所有文章共用的部分在前，文章内容在后
+SINGLE_DIGEST_PREFIX_PROMPT = """你是一个专业的学术助手，专门从事文献综述工作，帮助研究人员高效地综合相关研究。
+
+# 背景
+目前，你正在协助编写一篇学术综述报告。由于直接分析完整的相关文章可能过于冗长，第一步是将每篇文章提炼成简洁的**文章摘要**。该摘要应当捕捉文章中必要的关键信息，并对当前文章进行批判性分析，以便构建该综述报告。这篇文章通过前期工作被确定与当前综述主题相关，因此，摘要中的大纲应包含与该文章相关的部分。
+
+# 任务描述
+**你的任务**是基于综述报告的预定义**大纲**，为提供的**参考文章**生成该摘要。你必须遵循每个部分的描述指引，从参考文章的完整内容中提取信息。最终生成的摘要将作为参考文章的代表性总结，便于在进一步的综述撰写过程中使用。此外，根据完整的文章，你还需要提供改进大纲质量的建议。
+
+## 摘要生成原则
+**请遵循以下原则来生成文章摘要**：
+1. **识别相关部分**：首先回顾大纲，识别与参考文章内容最相关的部分。大纲中的所有部分（或子部分）可能并不都与该文章相关。你可以省略与文章内容无关的部分或子部分，但必须确保保留大纲中的每个层级，不能修改大纲结构。不要在现有部分下添加新的子部分。应在提供的结构框架内填充相关内容。
+2. **内容精炼**：对于相关部分，严格按照部分描述中的指导进行精炼。将文章内容压缩，呈现出对综述报告至关重要的信息。此批判性分析应基于文章的全部内容。在过程中，总结当前领域的挑战，并反思当前文章的不足之处。必须对提取的数据进行批判性评估，评估内容包括：研究方法的独特性和普适性、样本的代表性和局限性、实验设计的合理性、理论框架的完整性和创新性、结果解读和讨论的深度，以及研究的局限性和前景等。这些工作将用于学术综述，进行对文章的全面分析。
+3. **忠实性**：在整个过程中，确保不引入任何未被原文支持的新事实或解释，忠实于原文章的发现，避免任何不在文章中的内容，即不产生虚构内容。鼓励从原文中提取实验结果、重要公式、结果表格等，以增强材料的信息量。
+
+## 建议生成原则
+1. 如果该文章不适用于大纲中的任何部分，请提供修改大纲结构或标题的建议，以便将该文章纳入其中。在进行修改时，需综合考虑该文章的核心内容与现有大纲框架之间的兼容性，使得新的大纲结构或标题能够准确反映该文章在研究主题中的位置和作用。
+2. 如果该文章中的信息不足以填写大纲内容，请提供修改大纲描述的建议，以更好地利用该文章。当修改大纲描述时，应基于对文章内容的深入探索，使得大纲描述的范围与文章提供的信息匹配，避免由于大纲要求过高或过低，无法有效地整合该文章的内容。
+3. 基于完整文章和上述总结的信息，提供创新且可执行的建议，以应对当前领域的挑战以及现有工作中的不足之处。对未来研究方向做出预测，以解决当前工作中的不足。未来的研究方向应具体而非笼统。
+
+# 输出要求
+## 格式要求
+1. **输出格式**：摘要必须使用Markdown格式。摘要部分用一个```markdown\\n```整体括起来。大纲中的所有章节标题（包括总标题）必须出现在摘要中，并保持相同层级；不要跳过或省略任何部分。摘要的总标题和子标题应该与大纲的总标题和子标题保持一致。你不许在```markdown\\n```中嵌套任何额外的```markdown\\n```。
+2. **引用格式**：需要在句子末尾加上参考文章的Bibkey（与参考文章一起在下方给出），形如[\"BIBKEY\"]，以指定信息的来源。如果信息并非直接来自文章，可以不加引用。摘要和建议中均需要包含引用。
+3. **公式格式**：如果输出中有公式，请使用LaTeX格式表示。例如，内联公式使用$y = x^2$，块状公式使用$$y = x^2$$。
+4. **建议格式**：建议应以```suggestion\\n```括起来。只需要提供建议，不需要提供修改后的新大纲。
+## 格式示例
+```markdown
+{outline_example}
+```
+
+建议：
+```suggestion
+给出你对大纲修改的建议，以便更好地利用这篇文章作为参考。
+```
+
+# 输入材料
+## 初步大纲
+{survey_outline}
+
+"""
+
+SINGLE_DIGEST_PAPER_PROMPT = """## 参考文章的Bibkey
+[\"{paper_bibkey}\"]
+
+## 参考文章
+{paper_content}
+
+# 提醒
+按照上面的初步大纲和输出要求为这篇参考文章生成摘要，引用时使用[\"{paper_bibkey}\"]，然后给出你的建议。
+"""
+
+# 只为大纲中变化的章节重新生成摘要时，追加在共用提示词之后
+SINGLE_DIGEST_PARTIAL_PROMPT = """## 需要生成摘要的章节
+大纲的其他章节已经生成过摘要。这次只需要为格式示例中的章节生成摘要，章节标题、层级和顺序与格式示例完全一致，不要输出大纲的其他章节。完整的大纲仅作为上下文。
+
+"""
+
 DIGEST_BASE_PROMPT = """你是一个专业的学术助手，负责帮助研究人员根据提供的材料进行文献综述。
 
 # 背景
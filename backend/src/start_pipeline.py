@@ -3,11 +3,11 @@ import json
 import logging
 import gevent
 from args import parse_args
-import asyncio
 from datetime import datetime
 
-from async_d import Monitor, PipelineAnalyser
+from async_d import Monitor, PipelineAnalyser, Autoscaler
 from async_d import Pipeline
+from request import run_async
 from src.decode.decode_pipeline import DecodePipeline
 from src.encode.encode_pipeline import EncodePipeline
 from src.hidden.hidden_pipeline import HiddenPipeline
@@ -67,8 +67,11 @@ def start_pipeline(args):
     pipeline_analyser = PipelineAnalyser()
     pipeline_analyser.register(pipeline)
 
+    autoscaler = Autoscaler()
+    autoscaler.register(pipeline)
+
     monitor = Monitor(report_interval=60)
-    monitor.register(pipeline_analyser)
+    monitor.register(pipeline_analyser, autoscaler)
     monitor.start()
 
     pipeline.start()
@@ -99,7 +102,7 @@ def main():
         )
 
         crawler = AsyncCrawler(model="gemini-2.0-flash-thinking-exp-01-21", infer_type="OpenAI")
-        asyncio.run(
+        run_async(
             crawler.run(
                 topic=args.topic,
                 url_list=url_list,
@@ -90,6 +90,10 @@ class BaseTaskManager(ABC):
     def health_check(self) -> bool:
         """健康检查"""
         pass
+    
+    def update_token_usage(self, task_id: str, usage: Dict[str, Any]) -> bool:
+        """保存任务的token用量（总量、各阶段和各模型的用量及预算），见request/usage.py"""
+        return self.update_task_field(task_id, 'token_usage', usage)
 
 
 def with_app_context(func: Callable) -> Callable:
@@ -313,6 +317,8 @@ class PostgreSQLTaskManager(BaseTaskManager):
                 task.set_params(value)
             elif field == 'result_data':
                 task.set_result_data(value)
+            elif field == 'token_usage':
+                task.set_token_usage(value)
             elif hasattr(task, field):
                 setattr(task, field, value)
             else:
@@ -633,6 +639,8 @@ class RedisTaskManager(BaseTaskManager):
             # 解析JSON字段
             if 'params' in task_data:
                 task_data['params'] = json.loads(task_data['params'])
+            if 'token_usage' in task_data:
+                task_data['token_usage'] = json.loads(task_data['token_usage'])
             
             # 计算执行时间
             if 'start_time' in task_data and 'end_time' in task_data:
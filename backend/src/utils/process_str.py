@@ -2,6 +2,7 @@ import re
 import logging
 from difflib import SequenceMatcher
 from src.exceptions import MdNotFoundError, BibkeyNotFoundError
+from src.utils.tokenizer import count_tokens, truncate_tokens
 
 logger = logging.getLogger(__name__)
 
@@ -134,4 +135,66 @@ def proc_title_to_str(origin_title):
     title = re.sub(r'[^\w\s\_]', '', title)
     title = title.replace(" ", "_")
     title = re.sub(r'_{2,}', '_', title)
-    return title
\ No newline at end of file
+    return title
+
+
+def change_bibkeys_to_index(contents, bibkeys):
+    """Replaces the cited bibkeys in each content with their 1-based index in bibkeys.
+
+    Pure function of strings, so it can run in a worker process. Returns the
+    new contents and the citation count of each bibkey.
+    """
+    cite_reg = re.compile(r"\[([^\]]+)\]")
+    bibkey_index_dict = {bibkey: i + 1 for i, bibkey in enumerate(bibkeys)}
+    bibkey_count_dict = {bibkey: 0 for bibkey in bibkeys}
+
+    def replace_bibkey(match):
+        indices = set()
+        for bibkey in str2list(match.group(1)):
+            bibkey = bibkey.strip().replace("-", "_")
+            if bibkey in bibkey_index_dict:
+                bibkey_count_dict[bibkey] += 1
+                indices.add(bibkey_index_dict[bibkey])
+        if indices:
+            return f"[{','.join(str(index) for index in sorted(indices))}]"
+        else:
+            return ""
+
+    new_contents = []
+    for content in contents:
+        content = remove_illegal_bibkeys(content, legal_bibkeys=bibkeys)
+        new_contents.append(cite_reg.sub(replace_bibkey, content))
+    return new_contents, bibkey_count_dict
+
+
+def split_by_sections(content, max_tokens):
+    """Splits the markdown content into chunks of at most max_tokens tokens.
+
+    The chunks end on the section headings, a section longer than max_tokens
+    is split on its paragraphs and a paragraph longer than that is cut.
+    """
+    pieces = []  # (text, token count)
+    for section in re.split(r"\n(?=#{1,6}\s)", content):
+        section_tokens = count_tokens(section)
+        if section_tokens <= max_tokens:
+            pieces.append((section, section_tokens))
+            continue
+        for paragraph in re.split(r"\n\s*\n", section):
+            paragraph_tokens = count_tokens(paragraph)
+            while paragraph_tokens > max_tokens:
+                head = truncate_tokens(paragraph, max_tokens) or paragraph[:max_tokens]
+                pieces.append((head, count_tokens(head)))
+                paragraph = paragraph[len(head):]
+                paragraph_tokens = count_tokens(paragraph)
+            pieces.append((paragraph, paragraph_tokens))
+
+    chunks, chunk, chunk_tokens = [], [], 0
+    for piece, piece_tokens in pieces:
+        if chunk and chunk_tokens + piece_tokens > max_tokens:
+            chunks.append("\n".join(chunk))
+            chunk, chunk_tokens = [], 0
+        chunk.append(piece)
+        chunk_tokens += piece_tokens
+    if chunk:
+        chunks.append("\n".join(chunk))
+    return chunks
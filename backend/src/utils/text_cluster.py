@@ -0,0 +1,92 @@
+import re
+import math
+from collections import Counter
+
+import numpy as np
+
+_WORD_PATTERN = re.compile(r"[a-z][a-z0-9\-]+|[一-鿿]")
+
+
+def tokenize(text):
+    return _WORD_PATTERN.findall(text.lower())
+
+
+def tfidf_vectors(texts, max_features=4096, max_df=0.8):
+    """
+    The L2 normalized TF-IDF vectors (a dense (len(texts), features) array)
+    of the texts, with sublinear tf, over the max_features words in the most
+    texts, leaving out the words in fewer than 2 or more than max_df of them.
+    """
+    counts = [Counter(tokenize(text)) for text in texts]
+    doc_freq = Counter(word for count in counts for word in count)
+    max_doc_num = max(2, int(max_df * len(texts)))
+    vocabulary = [
+        word for word, freq in doc_freq.most_common() if 2 <= freq <= max_doc_num
+    ][:max_features]
+    word_index = {word: i for i, word in enumerate(vocabulary)}
+
+    vectors = np.zeros((len(texts), len(vocabulary)), dtype=np.float32)
+    for row, count in enumerate(counts):
+        for word, freq in count.items():
+            column = word_index.get(word)
+            if column is not None:
+                vectors[row, column] = 1 + math.log(freq)
+    idf = np.log((1 + len(texts)) / (1 + np.array([doc_freq[w] for w in vocabulary], dtype=np.float32))) + 1
+    vectors *= idf
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def balanced_kmeans(vectors, cluster_num, capacity, iterations=10, seed=0):
+    """
+    The cluster of each vector by spherical k-means, each cluster has at most
+    capacity vectors (cluster_num * capacity >= len(vectors)): the vectors
+    are assigned greedily from the most similar (vector, centroid) pair.
+    """
+    vector_num = len(vectors)
+    rng = np.random.default_rng(seed)
+    centroids = _init_centroids(vectors, cluster_num, rng)
+    labels = None
+    for _ in range(iterations):
+        new_labels = _assign(vectors @ centroids.T, capacity)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        for cluster in range(cluster_num):
+            members = vectors[labels == cluster]
+            if len(members):
+                centroid = members.sum(axis=0)
+                centroids[cluster] = centroid / max(np.linalg.norm(centroid), 1e-12)
+    return labels if labels is not None else np.zeros(vector_num, dtype=int)
+
+
+def _init_centroids(vectors, cluster_num, rng):
+    # k-means++，离已选中心越远（余弦相似度越低）的向量越可能被选为下一个中心
+    indices = [int(rng.integers(len(vectors)))]
+    max_similarity = vectors @ vectors[indices[0]]
+    for _ in range(1, cluster_num):
+        distances = np.clip(1 - max_similarity, 0, None)
+        distances[indices] = 0
+        if distances.sum() > 0:
+            index = int(rng.choice(len(vectors), p=distances / distances.sum()))
+        else:
+            index = int(rng.choice([i for i in range(len(vectors)) if i not in indices]))
+        indices.append(index)
+        max_similarity = np.maximum(max_similarity, vectors @ vectors[index])
+    return vectors[indices].copy()
+
+
+def _assign(similarities, capacity):
+    vector_num, cluster_num = similarities.shape
+    labels = np.full(vector_num, -1, dtype=int)
+    sizes = np.zeros(cluster_num, dtype=int)
+    assigned_num = 0
+    for flat_index in np.argsort(-similarities, axis=None, kind="stable"):
+        vector, cluster = divmod(int(flat_index), cluster_num)
+        if labels[vector] < 0 and sizes[cluster] < capacity:
+            labels[vector] = cluster
+            sizes[cluster] += 1
+            assigned_num += 1
+            if assigned_num == vector_num:
+                break
+    return labels
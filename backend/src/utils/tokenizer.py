@@ -0,0 +1,62 @@
+import os
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 英文单词按约6个字母一个token、数字按3位一个token、其他字符（中文、标点）各一个token估计
+_TOKEN_PATTERN = re.compile(r"[A-Za-z]+|\d{1,3}|\S")
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """
+    The tiktoken encoding (TOKENIZER_ENCODING, cl100k_base by default), None
+    if tiktoken is not installed or the encoding can not be loaded.
+    """
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding(os.environ.get("TOKENIZER_ENCODING", "cl100k_base"))
+        except Exception as e:
+            logger.info(f"tiktoken is not available, estimate the token count instead: {e}")
+    return _encoding
+
+
+def count_tokens(text):
+    """
+    The token count of the text, exact with tiktoken, estimated from the
+    words and characters otherwise.
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    count = 0
+    for piece in _TOKEN_PATTERN.findall(text):
+        if piece[0].isascii() and piece[0].isalpha():
+            count += (len(piece) + 5) // 6
+        else:
+            count += 1
+    return count
+
+
+def truncate_tokens(text, max_tokens):
+    """
+    The beginning of the text with at most max_tokens tokens.
+    """
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    token_count = count_tokens(text)
+    while token_count > max_tokens:
+        text = text[: int(len(text) * max_tokens / token_count * 0.95)]
+        token_count = count_tokens(text)
+    return text
@@ -0,0 +1,693 @@
+import unittest
+import os
+import sys
+import time
+import json
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gevent
+import gevent.event
+from async_d import (
+    Node,
+    Sequential,
+    FairQueue,
+    Autoscaler,
+    shared_deepcopy,
+    run_in_process,
+    Journal,
+    Pipeline,
+    PipelineAnalyser,
+    Tracer,
+    trace_span,
+    bind_trace,
+    cancel,
+    check_cancelled,
+)
+from async_d.analyser.histogram import LatencyHistogram
+from async_d.cancel import track_children
+from async_d.executor import get_process_executor
+from async_d.exceptions import NodeStop
+
+
+def build_node(func, name, **kwargs):
+    node = Node(func, **kwargs)
+    node.set_name(name)
+    return node
+
+
+class TestNodeEndSignal(unittest.TestCase):
+    """测试async_d的结束信号是否沿图传播"""
+
+    def setUp(self):
+        self.results = []
+
+    def _build_pipeline(self):
+        add_node = build_node(lambda x: x + 1, "add", worker_num=3)
+        double_node = build_node(lambda x: x * 2, "double", worker_num=2)
+        save_node = build_node(
+            self.results.append, "save", worker_num=2, no_output=True
+        )
+        return Sequential([add_node, double_node, save_node])
+
+    def test_group_end_after_drain(self):
+        """所有数据处理完成后，结束信号应立即到达整个group"""
+        pipeline = self._build_pipeline()
+        pipeline.start()
+        for i in range(10):
+            pipeline.put(i)
+
+        with gevent.Timeout(2):
+            pipeline.end()
+
+        self.assertEqual(sorted(self.results), [(i + 1) * 2 for i in range(10)])
+        self.assertTrue(pipeline.is_end)
+        self.assertFalse(pipeline.is_start)
+        for node in pipeline.all_nodes.values():
+            self.assertTrue(node.is_end)
+
+    def test_nested_group_end(self):
+        """嵌套的group同样应该立即结束"""
+        inner = self._build_pipeline()
+        outer = Sequential([build_node(lambda x: x, "head", worker_num=2), inner])
+        outer.start()
+        for i in range(5):
+            outer.put(i)
+
+        with gevent.Timeout(2):
+            outer.end()
+
+        self.assertEqual(len(self.results), 5)
+        self.assertTrue(inner.is_end)
+
+    def test_iterable_node_end(self):
+        """拆包节点收到结束标志时不应报错"""
+        unpack_node = build_node(
+            lambda x: x, "unpack", worker_num=2, is_data_iterable=True
+        )
+        save_node = build_node(self.results.append, "save", no_output=True)
+        pipeline = Sequential([unpack_node, save_node])
+        pipeline.start()
+        pipeline.put([1, 2, 3])
+
+        with gevent.Timeout(2):
+            pipeline.end()
+
+        self.assertEqual(sorted(self.results), [1, 2, 3])
+
+
+class TestNodeBatch(unittest.TestCase):
+    """测试Node的微批处理模式"""
+
+    def test_batch_size(self):
+        """一次调用最多处理batch_size条数据，结果逐条向下游输出"""
+        batches = []
+        results = []
+
+        def double_batch(batch):
+            batches.append(list(batch))
+            return [x * 2 for x in batch]
+
+        batch_node = build_node(
+            double_batch, "double_batch", queue_size=10, batch_size=4, batch_timeout=50
+        )
+        save_node = build_node(results.append, "save", no_output=True)
+        pipeline = Sequential([batch_node, save_node])
+        pipeline.start()
+        for i in range(10):
+            pipeline.put(i)
+
+        with gevent.Timeout(2):
+            pipeline.end()
+
+        self.assertEqual(sorted(results), [i * 2 for i in range(10)])
+        self.assertTrue(all(len(batch) <= 4 for batch in batches))
+        self.assertLess(len(batches), 10)
+
+    def test_batch_timeout(self):
+        """等待超过batch_timeout后不满batch_size也会处理"""
+        batches = []
+        batch_node = build_node(
+            batches.append, "save_batch", no_output=True, batch_size=8, batch_timeout=20
+        )
+        batch_node.start()
+        batch_node.put(1)
+        batch_node.put(2)
+        gevent.sleep(0.1)
+
+        self.assertEqual(batches, [[1, 2]])
+        batch_node.end()
+
+    def test_batch_skip_error(self):
+        """批中的异常数据直接跳过处理传给下游"""
+        batches = []
+        results = []
+        batch_node = build_node(
+            lambda batch: batches.append(batch) or batch,
+            "echo_batch",
+            queue_size=10,
+            batch_size=4,
+            batch_timeout=20,
+        )
+        save_node = build_node(
+            results.append, "save", no_output=True, skip_error=False
+        )
+        pipeline = Sequential([batch_node, save_node])
+        pipeline.start()
+        error = ValueError("upstream error")
+        for data in [1, error, 2]:
+            pipeline.put(data)
+
+        with gevent.Timeout(2):
+            pipeline.end()
+
+        self.assertEqual(batches, [[1, 2]])
+        self.assertIn(error, results)
+
+
+class SharedPayload:
+    def __init__(self):
+        self.papers = {"a": {"txt": "paper"}}
+        self.outline = ["section"]
+
+    def shared_objects(self):
+        return [self.papers, *self.papers.values()]
+
+
+class TestSharedCopy(unittest.TestCase):
+    """测试共享不可变部分的数据拷贝"""
+
+    def test_shared_deepcopy(self):
+        payload = SharedPayload()
+        copied = shared_deepcopy(payload)
+        self.assertIsNot(copied, payload)
+        self.assertIs(copied.papers, payload.papers)
+        self.assertIsNot(copied.outline, payload.outline)
+
+    def test_put_shared_data(self):
+        """最后一个下游拿到原始数据，其余下游拿到共享拷贝"""
+        received = {}
+        source = build_node(lambda x: x, "source", put_shared_data=True)
+        for name in ["left", "right"]:
+            sink = build_node(
+                lambda x, name=name: received.setdefault(name, x),
+                name,
+                no_output=True,
+            )
+            source.connect(sink)
+            sink.start()
+        source.start()
+        payload = SharedPayload()
+        source.put(payload)
+        gevent.sleep(0.05)
+
+        self.assertIsNot(received["left"], payload)
+        self.assertIs(received["left"].papers, payload.papers)
+        self.assertIs(received["right"], payload)
+
+
+class Job:
+    def __init__(self, task_id, cost=1, deadline=0):
+        self.task_id = task_id
+        self.cost = cost
+        self.deadline = deadline
+
+
+class TestFairQueue(unittest.TestCase):
+    """测试按任务公平调度的队列"""
+
+    def _drain(self, queue):
+        return [queue.get_nowait() for _ in range(queue.qsize())]
+
+    def test_flows_interleave(self):
+        """积压较多的任务不会饿死后到的小任务"""
+        queue = FairQueue()
+        for _ in range(5):
+            queue.put(Job("big"))
+        queue.put(Job("small"))
+        order = [job.task_id for job in self._drain(queue)]
+        self.assertLess(order.index("small"), 2)
+
+    def test_cost_and_weight(self):
+        """代价小的任务先服务，权重高的任务获得更多份额"""
+        queue = FairQueue(cost=lambda job: job.cost)
+        queue.put(Job("large", cost=300))
+        queue.put(Job("tiny", cost=10))
+        self.assertEqual(queue.get().task_id, "tiny")
+
+        queue = FairQueue(flow_weight=lambda key: 3 if key == "vip" else 1)
+        for _ in range(4):
+            queue.put(Job("normal"))
+            queue.put(Job("vip"))
+        order = [job.task_id for job in self._drain(queue)]
+        self.assertEqual(order[:4].count("vip"), 3)
+
+    def test_priority_and_stop(self):
+        """优先级（如截止时间）优先，结束标志最后输出"""
+        queue = FairQueue(priority=lambda job: job.deadline)
+        queue.put(NodeStop())
+        queue.put(Job("late", deadline=20))
+        queue.put(Job("early", deadline=10))
+        items = self._drain(queue)
+        self.assertEqual([job.task_id for job in items[:2]], ["early", "late"])
+        self.assertIsInstance(items[-1], NodeStop)
+
+    def test_node_scheduler(self):
+        results = []
+        node = build_node(
+            results.append,
+            "save",
+            no_output=True,
+            queue_size=10,
+            scheduler=FairQueue,
+        )
+        self.assertIsInstance(node.src_queue, FairQueue)
+        node.start()
+        node.put(Job("a"))
+        gevent.sleep(0.01)
+        self.assertEqual(len(results), 1)
+        node.end()
+
+
+class TestAutoscaler(unittest.TestCase):
+    """测试根据队列积压伸缩worker数量"""
+
+    def setUp(self):
+        self.release = gevent.event.Event()
+        self.results = []
+
+        def slow_save(data):
+            self.release.wait()
+            self.results.append(data)
+
+        self.node = build_node(
+            slow_save,
+            "slow_save",
+            no_output=True,
+            queue_size=20,
+            worker_num=2,
+            min_worker_num=1,
+            max_worker_num=8,
+        )
+        self.node.start()
+
+    def tearDown(self):
+        self.release.set()
+        with gevent.Timeout(2):
+            self.node.end()
+            self.node.wait_end()
+
+    def test_scale_up_and_down(self):
+        autoscaler = Autoscaler()
+        for i in range(10):
+            self.node.put(i)
+        gevent.sleep(0.01)
+        autoscaler.scale(self.node)
+        self.assertEqual(self.node.worker_num, 8)
+
+        self.release.set()
+        gevent.sleep(0.05)
+        self.assertEqual(len(self.results), 10)
+        for _ in range(5):
+            autoscaler.scale(self.node)
+            gevent.sleep(0.01)
+        self.assertEqual(self.node.worker_num, 1)
+        self.assertEqual(len([task for task in self.node.tasks if not task.dead]), 1)
+
+    def test_scale_bounds(self):
+        self.assertEqual(self.node.scale_workers(100), 8)
+        self.assertEqual(self.node.scale_workers(0), 1)
+
+
+def busy_square(x):
+    deadline = time.monotonic() + 0.05
+    while time.monotonic() < deadline:
+        pass
+    return x * x, os.getpid()
+
+
+class TestProcessExecutor(unittest.TestCase):
+    """测试CPU密集型函数在进程池中执行"""
+
+    def test_process_node(self):
+        results = []
+        square_node = build_node(busy_square, "square", worker_num=4, executor="process")
+        save_node = build_node(results.append, "save", no_output=True)
+        pipeline = Sequential([square_node, save_node])
+        pipeline.start()
+        for i in range(4):
+            pipeline.put(i)
+
+        with gevent.Timeout(10):
+            pipeline.end()
+
+        self.assertEqual(sorted(result[0] for result in results), [0, 1, 4, 9])
+        self.assertNotIn(os.getpid(), [result[1] for result in results])
+
+    def test_hub_not_blocked(self):
+        """进程池计算期间其他greenlet仍然可以运行"""
+        ticks = []
+
+        def tick():
+            while True:
+                ticks.append(1)
+                gevent.sleep(0.01)
+
+        ticker = gevent.spawn(tick)
+        self.assertEqual(run_in_process(busy_square, 3)[0], 9)
+        run_in_process(busy_square, 3)
+        ticker.kill()
+        self.assertGreater(len(ticks), 1)
+
+    def test_start_method(self):
+        """默认不fork，进程池从新的解释器启动"""
+        start_method = get_process_executor()._mp_context.get_start_method()
+        self.assertIn(start_method, ("forkserver", "spawn"))
+        self.assertEqual(run_in_process(busy_square, 4)[0], 16)
+
+
+class BranchPipeline(Pipeline):
+    """add的输出同时进入save和slow两个分支，slow处理完后也进入save"""
+
+    def _connect_nodes(self):
+        self.all_nodes["add"] >> self.all_nodes["save"]
+        self.all_nodes["add"] >> self.all_nodes["slow"] >> self.all_nodes["save"]
+
+
+class TestJournal(unittest.TestCase):
+    """测试节点数据的持久化与重启恢复"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "journal.db")
+        self.results = []
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _build_pipeline(self, journal, release):
+        def add(job):
+            return Job(job.task_id, cost=job.cost + 1)
+
+        def slow_double(job):
+            release.wait()
+            return Job(job.task_id, cost=job.cost * 2)
+
+        pipeline = Sequential(
+            [
+                build_node(add, "add"),
+                build_node(slow_double, "double"),
+                build_node(self.results.append, "save", no_output=True),
+            ]
+        )
+        journal.register(pipeline)
+        pipeline.start()
+        return pipeline
+
+    def _rows(self, journal):
+        return journal.conn.execute("SELECT key, node_id FROM branch_checkpoint").fetchall()
+
+    def test_resume(self):
+        """进程重启后数据从最后完成的节点之后继续处理"""
+        journal = Journal(self.path)
+        crashed = self._build_pipeline(journal, gevent.event.Event())
+        crashed.put(Job("a", cost=1))
+        gevent.sleep(0.05)
+        self.assertEqual(self._rows(journal), [("a", "0: add")])
+        for node in crashed.all_nodes.values():
+            gevent.killall(node.tasks)
+        journal.close()
+
+        release = gevent.event.Event()
+        release.set()
+        journal = Journal(self.path)
+        pipeline = self._build_pipeline(journal, release)
+        self.assertEqual(journal.resume(), ["a"])
+        gevent.sleep(0.05)
+
+        self.assertEqual([job.cost for job in self.results], [4])
+        self.assertEqual(self._rows(journal), [])
+        journal.close()
+
+    def _build_branch_pipeline(self, journal, release):
+        def add(job):
+            return Job(job.task_id, cost=job.cost + 1)
+
+        def slow(job):
+            release.wait()
+            return Job(job.task_id, cost=job.cost * 2)
+
+        pipeline = BranchPipeline(
+            [
+                build_node(add, "add"),
+                build_node(slow, "slow"),
+                build_node(self.results.append, "save", no_output=True),
+            ]
+        )
+        journal.register(pipeline)
+        pipeline.start()
+        return pipeline
+
+    def test_branch(self):
+        """一个分支结束时，仍在其他分支中的数据继续保留检查点"""
+        journal = Journal(self.path)
+        crashed = self._build_branch_pipeline(journal, gevent.event.Event())
+        crashed.put(Job("a", cost=1))
+        gevent.sleep(0.05)
+        self.assertEqual([job.cost for job in self.results], [2])
+        add_id = journal._node_id(crashed.all_nodes["add"])
+        self.assertEqual(self._rows(journal), [("a", add_id)])
+        for node in crashed.all_nodes.values():
+            gevent.killall(node.tasks)
+        journal.close()
+
+        release = gevent.event.Event()
+        release.set()
+        journal = Journal(self.path)
+        self._build_branch_pipeline(journal, release)
+        self.assertEqual(journal.resume(), ["a"])
+        gevent.sleep(0.05)
+        # 恢复时重复原来的分发，slow分支得以完成
+        self.assertIn(4, [job.cost for job in self.results])
+        self.assertEqual(self._rows(journal), [])
+        journal.close()
+
+    def test_without_key(self):
+        """数据拆成没有key的部分后，保留拆分前的检查点直到重新组装"""
+        release = gevent.event.Event()
+        parts = []
+
+        def split(job):
+            parts.append(job)
+            return ("part", job.task_id)
+
+        def assemble(part):
+            release.wait()
+            return parts.pop(0)
+
+        journal = Journal(self.path)
+        pipeline = Sequential(
+            [
+                build_node(lambda job: Job(job.task_id, cost=job.cost + 1), "add"),
+                build_node(split, "split"),
+                build_node(assemble, "assemble"),
+                build_node(self.results.append, "save", no_output=True),
+            ]
+        )
+        journal.register(pipeline)
+        pipeline.start()
+        pipeline.put(Job("a", cost=1))
+        gevent.sleep(0.05)
+        self.assertEqual(self._rows(journal), [("a", "0: add")])
+
+        release.set()
+        with gevent.Timeout(2):
+            pipeline.end()
+        self.assertEqual(len(self.results), 1)
+        self.assertEqual(self._rows(journal), [])
+        journal.close()
+
+    def test_filtered(self):
+        """过滤掉的旧版本数据在同一节点处理新版本后不再保留"""
+        journal = Journal(self.path)
+        pipeline = Sequential(
+            [
+                build_node(lambda job: Job(job.task_id, cost=job.cost + 1), "add"),
+                build_node(lambda job: job if job.cost > 2 else None, "filter", discard_none_output=True),
+                build_node(self.results.append, "save", no_output=True),
+            ]
+        )
+        journal.register(pipeline)
+        pipeline.start()
+        pipeline.put(Job("a", cost=1))
+        gevent.sleep(0.05)
+        self.assertEqual(self._rows(journal), [("a", "0: add")])
+        pipeline.put(Job("a", cost=2))
+        with gevent.Timeout(2):
+            pipeline.end()
+        self.assertEqual([job.cost for job in self.results], [3])
+        self.assertEqual(self._rows(journal), [])
+        journal.close()
+
+    def test_discard_finished(self):
+        release = gevent.event.Event()
+        release.set()
+        journal = Journal(self.path)
+        pipeline = self._build_pipeline(journal, release)
+        pipeline.put(Job("a", cost=1))
+        with gevent.Timeout(2):
+            pipeline.end()
+        self.assertEqual(self.results[0].cost, 4)
+        self.assertEqual(self._rows(journal), [])
+        journal.close()
+
+
+class TestPipelineAnalyser(unittest.TestCase):
+    """测试延迟直方图与排队等待指标"""
+
+    def test_histogram_percentile(self):
+        histogram = LatencyHistogram()
+        for ms in range(1, 1001):
+            histogram.record(ms / 1000)
+        self.assertAlmostEqual(histogram.percentile(50), 0.5, delta=0.01)
+        self.assertAlmostEqual(histogram.percentile(99), 0.99, delta=0.02)
+        self.assertEqual(histogram.percentile(100), 1.0)
+        self.assertIsNone(LatencyHistogram().percentile(50))
+
+    def test_node_metrics(self):
+        def slow_echo(x):
+            gevent.sleep(0.02)
+            return x
+
+        pipeline = Sequential(
+            [
+                build_node(slow_echo, "slow_echo", queue_size=10),
+                build_node(lambda x: None, "drop", no_output=True),
+            ]
+        )
+        analyser = PipelineAnalyser()
+        analyser.register(pipeline)
+        pipeline.start()
+        for i in range(3):
+            pipeline.put(i)
+        with gevent.Timeout(2):
+            pipeline.end()
+
+        metrics = {metric["name"]: metric for metric in analyser.get_metrics(pipeline)}
+        slow_metric = metrics["slow_echo"]
+        self.assertEqual(slow_metric["exec_count"], 3)
+        self.assertEqual(slow_metric["error_count"], 0)
+        self.assertGreaterEqual(slow_metric["exec_latency"]["p50"], 0.02)
+        # the third data waits for the first two in the single worker node
+        self.assertGreaterEqual(slow_metric["queue_wait"]["max"], 0.04)
+        self.assertIn("Queue Wait", analyser.report())
+        self.assertEqual(pipeline.all_nodes["slow_echo"].enqueue_time, {})
+
+    def test_no_analyser(self):
+        """没有注册分析器的节点不记录入队时间"""
+        node = build_node(lambda x: None, "drop", no_output=True)
+        node.start()
+        for i in range(3):
+            node.put(object())
+        with gevent.Timeout(2):
+            node.end()
+        self.assertIsNone(node.enqueue_time)
+        self.assertIsNone(node.pop_enqueue_time(1))
+
+
+class Section:
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+
+
+class TestTracer(unittest.TestCase):
+    """测试按数据传递的追踪上下文与瀑布图导出"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.tracer = Tracer()
+        self.tracer.output_dir = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_export_waterfall(self):
+        def request(i):
+            with trace_span("completion", model="mock"):
+                gevent.sleep(0.01)
+
+        def fan_out(section):
+            tasks = [gevent.spawn(bind_trace(request, "neuron"), i) for i in range(2)]
+            gevent.joinall(tasks)
+            return section
+
+        pipeline = Sequential(
+            [
+                build_node(fan_out, "fan_out"),
+                build_node(lambda x: x, "save", no_output=True),
+            ]
+        )
+        self.tracer.register(pipeline)
+        pipeline.start()
+        pipeline.put(Section("survey a"))
+        with gevent.Timeout(2):
+            pipeline.end()
+
+        with open(os.path.join(self.tmp_dir.name, "survey_a.json")) as f:
+            events = json.load(f)["traceEvents"]
+        names = [event["name"] for event in events]
+        self.assertEqual(names.count("fan_out"), 1)
+        self.assertEqual(names.count("neuron"), 2)
+        self.assertEqual(names.count("completion"), 2)
+        completion = next(event for event in events if event["name"] == "completion")
+        self.assertEqual(completion["args"]["parent"], "neuron")
+        self.assertEqual(completion["args"]["model"], "mock")
+
+    def test_untraced(self):
+        with trace_span("completion") as span:
+            self.assertIsNone(span)
+        func = lambda: 1
+        self.assertIs(bind_trace(func), func)
+
+
+class TestCancel(unittest.TestCase):
+    """测试按task_id取消在途数据"""
+
+    def test_cancel_running_and_queued(self):
+        started = []
+        results = []
+
+        def slow_request(job):
+            started.append(job.task_id)
+            children = [gevent.spawn(gevent.sleep, 10)]
+            track_children(children)
+            gevent.joinall(children)
+            check_cancelled()
+            return job
+
+        pipeline = Sequential(
+            [
+                build_node(slow_request, "slow_request", worker_num=1, queue_size=10),
+                build_node(results.append, "save", no_output=True),
+            ]
+        )
+        pipeline.start()
+        for task_id in ["cancel_a", "cancel_a", "cancel_b"]:
+            pipeline.put(Job(task_id))
+        gevent.sleep(0.01)
+        self.assertEqual(started, ["cancel_a"])
+
+        self.assertEqual(cancel("cancel_a"), 2)
+        gevent.sleep(0.01)
+        # the queued data of the cancelled task is dropped, the other task goes on
+        self.assertEqual(started, ["cancel_a", "cancel_b"])
+        cancel("cancel_b")
+        with gevent.Timeout(2):
+            pipeline.end()
+        self.assertEqual(results, [])
+        self.assertTrue(pipeline.all_nodes["slow_request"].is_end)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+import unittest
+import os
+import sys
+import pickle
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import async_d
+from src.data_structure import Digest
+from src.data_structure.survey import Survey
+from src.exceptions import StructureNotCorrespondingError
+
+
+OUTLINE = """```markdown
+# {title}
+## 1 Introduction
+Digest Construction:
+Collect the motivation.
+Digest Analysis:
+Summarize the motivation.
+## 2 Methods
+Digest Construction:
+Collect the methods.
+Digest Analysis:
+Compare the methods.
+### 2.1 Retrieval
+Digest Construction:
+Collect the retrievers.
+Digest Analysis:
+Compare the retrievers.
+```"""
+
+
+def build_survey(title="T", task_id=None, outline=OUTLINE):
+    papers = [
+        {"title": f"Paper {i}", "txt": f"content of paper {i}", "abstract": f"abstract {i}"}
+        for i in range(3)
+    ]
+    survey = Survey({"title": title, "papers": papers}, task_id=task_id)
+    survey.skeleton.parse_raw_skeleton(title, outline.format(title=title))
+    return survey
+
+
+def drain(content):
+    # 队列为空时迭代返回None，关闭后停止迭代
+    nodes = []
+    for node in content:
+        if node is None:
+            break
+        nodes.append(node)
+    return nodes
+
+
+class TestSurveyPickle(unittest.TestCase):
+    """测试生成正文后的综述仍可被journal序列化"""
+
+    def test_waiting_content(self):
+        survey = build_survey()
+        survey.init_content()
+        first = next(iter(survey.content))
+
+        restored = pickle.loads(pickle.dumps(survey))
+        waiting = [node.outline_node.title for node in drain(restored.content)]
+        self.assertEqual(sorted(waiting + [first.outline_node.title]), ["Introduction", "Retrieval"])
+        self.assertEqual(restored.content.root.son[0].father, restored.content.root)
+
+    def test_shutdown(self):
+        survey = build_survey()
+        survey.init_content()
+        survey.content.waiting_content.shutdown()
+
+        restored = pickle.loads(pickle.dumps(survey))
+        self.assertEqual(len(drain(restored.content)), 2)
+        # 取完后关闭的队列结束迭代，而不是返回None
+        self.assertEqual(list(restored.content), [])
+
+
+class TestTraceId(unittest.TestCase):
+    """测试同一主题的不同任务分别追踪"""
+
+    def test_task_id(self):
+        survey = build_survey(task_id="task-1")
+        survey.init_content()
+        self.assertEqual(survey.trace_id, "task-1")
+        self.assertNotEqual(build_survey(task_id="task-2").trace_id, survey.trace_id)
+        for section in survey.content.root.all_section:
+            self.assertEqual(section.trace_id, "task-1")
+
+    def test_title_fallback(self):
+        survey = build_survey(title="Topic")
+        survey.init_content()
+        self.assertEqual(survey.trace_id, "Topic")
+        self.assertEqual(survey.content.root.son[0].trace_id, "Topic")
+
+
+class TestMatchSections(unittest.TestCase):
+    """测试新旧大纲按标题、编号和描述对应未改动的章节"""
+
+    def test_unchanged(self):
+        old = build_survey().skeleton
+        new = build_survey().skeleton
+        positions = range(len(old.root.all_section))
+        self.assertEqual(new.match_sections(old), {i: i for i in positions})
+
+    def test_changed(self):
+        old = build_survey().skeleton
+        outline = OUTLINE.replace("Compare the methods.", "Contrast   the METHODS.").replace(
+            "Compare the retrievers.", "Rank the retrievers."
+        )
+        outline = outline.replace(
+            "## 1 Introduction", "## 1 Background\nDigest Construction:\nx\nDigest Analysis:\ny\n## 2 Introduction"
+        )
+        new = build_survey(outline=outline).skeleton
+        titles = [node.title for node in new.root.all_section]
+        self.assertEqual(titles, ["T", "Background", "Introduction", "Methods", "Retrieval"])
+        # 编号或描述改变的章节都不对应旧章节
+        self.assertEqual(new.match_sections(old), {0: 0})
+
+    def test_whitespace(self):
+        old = build_survey().skeleton
+        # 空白和大小写不算改动
+        new = build_survey(outline=OUTLINE.replace("Compare the methods.", "Compare  the Methods. ")).skeleton
+        self.assertEqual(new.match_sections(old), {i: i for i in range(4)})
+
+
+class TestParsePartialDigest(unittest.TestCase):
+    """测试只包含改动章节的digest按章节数和标题校验"""
+
+    def setUp(self):
+        self.outline = build_survey().skeleton
+        self.sections = self.outline.root.all_section[2:]  # Methods, Retrieval
+
+    def parse(self, raw_digest):
+        return Digest([{"title": "A", "bibkey": "a1", "txt": "x"}], "T").parse_partial_digest(
+            f"```markdown\n{raw_digest}\n```", self.sections
+        )
+
+    def test_parse(self):
+        digest = self.parse("# T\n## 2 Methods\nmethods [a1]\n### 2.1 Retrieval\n<EMPTY>")
+        self.assertEqual([node.title for node in digest.root.all_section], ["T", "Methods", "Retrieval"])
+        self.assertIn("a1", digest.root.all_section[1].description)
+        self.assertEqual(digest.root.all_section[2].description.strip(), "")
+
+    def test_section_number(self):
+        with self.assertRaises(StructureNotCorrespondingError):
+            self.parse("# T\n## 2 Methods\nmethods")
+
+    def test_section_title(self):
+        with self.assertRaises(StructureNotCorrespondingError):
+            self.parse("# T\n## 2 Methods\nmethods\n### 2.1 Ranking\nranking")
+
+
+if __name__ == "__main__":
+    unittest.main()
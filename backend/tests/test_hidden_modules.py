@@ -0,0 +1,193 @@
+import unittest
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gevent
+import async_d
+from src.data_structure import Digest
+from src.prompts import get_prompts
+from src.hidden.basic_modules.digest_module import SingleDigestNeuron
+from src.hidden.convolution_block.convergence import ConvergencePolicy
+from src.hidden.convolution_block.eval_cache import (
+    OutlineEvalCache,
+    canonicalize_outline,
+    get_eval_cache,
+    pop_eval_cache,
+)
+from request import usage as usage_module
+from test_data_structure import build_survey
+
+
+class ContextLengthError(Exception):
+    status_code = 400
+
+
+class ScriptedRequest:
+    """按顺序抛出预设异常、最后返回结果的请求池，记录每次收到的提示词"""
+
+    def __init__(self, errors, result):
+        self.errors = list(errors)
+        self.result = result
+        self.prompts = []
+
+    def completion(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.result
+
+
+class TestSingleDigestRetry(unittest.TestCase):
+    """测试单篇digest按错误类型重试：超出上下文长度才缩短论文"""
+
+    def setUp(self):
+        survey = build_survey()
+        self.outline = survey.skeleton
+        self.paper = {"title": "A", "bibkey": "a1", "txt": "word " * 400}
+        self.neuron = SingleDigestNeuron(
+            {"model": "mock", "infer_type": "mock", "prefix_cache": False}, get_prompts("en")
+        )
+        self.result = (
+            "```suggestion\nnone\n```\n"
+            f"```markdown\n{self.outline.all_skeleton(with_index=True)}\n```"
+        )
+
+    def run_neuron(self, errors):
+        self.neuron.request_pool = ScriptedRequest(errors, self.result)
+        digest = Digest([self.paper], "T")
+        paper_info = digest.paper_infos[0]
+        new_digest = self.neuron.forward(paper_info, self.outline, digest, Digest([], "T"))
+        return paper_info, new_digest
+
+    def test_context_length(self):
+        paper_info, new_digest = self.run_neuron(
+            [ContextLengthError("This model's maximum context length is 8192 tokens")]
+        )
+        self.assertIsNotNone(new_digest.root)
+        self.assertEqual(len(self.neuron.request_pool.prompts), 2)
+        self.assertLess(len(paper_info["content"]), len(paper_info["origin_content"]))
+
+    def test_format_error(self):
+        paper_info, new_digest = self.run_neuron([ValueError("bad format"), IndexError()])
+        self.assertIsNotNone(new_digest.root)
+        self.assertEqual(len(self.neuron.request_pool.prompts), 3)
+        self.assertEqual(paper_info["content"], paper_info["origin_content"])
+
+    def test_other_client_error(self):
+        with self.assertRaises(ContextLengthError):
+            self.run_neuron([ContextLengthError("invalid api key")])
+        self.assertEqual(len(self.neuron.request_pool.prompts), 1)
+
+
+class TestOutlineEvalCache(unittest.TestCase):
+    """测试大纲打分缓存的规范化键、并发合并、异常传递和相似复用"""
+
+    def setUp(self):
+        self.cache = OutlineEvalCache()
+        self.eval_count = 0
+
+    def evaluate(self, score=8, delay=0):
+        def evaluate():
+            self.eval_count += 1
+            gevent.sleep(delay)
+            return score, f"detail {score}"
+
+        return evaluate
+
+    def test_canonical_key(self):
+        outline = "# T\n## 1 Introduction\nDigest Construction: x"
+        fenced = "```markdown\n# T\n\n##  1   Introduction \nDigest Construction:  x\n```"
+        self.assertEqual(canonicalize_outline(outline), canonicalize_outline(fenced))
+        self.assertNotEqual(canonicalize_outline(outline), canonicalize_outline(outline + "\n## 2 Methods"))
+
+        self.assertEqual(self.cache.get_or_evaluate("m", outline, self.evaluate()), (8, "detail 8"))
+        self.assertEqual(self.cache.get_or_evaluate("m", fenced, self.evaluate(5)), (8, "detail 8"))
+        # 不同的打分方式不共用结果
+        self.assertEqual(self.cache.get_or_evaluate("other", outline, self.evaluate(5))[0], 5)
+        self.assertEqual(self.eval_count, 2)
+        self.assertEqual(self.cache.stats(), {"hit": 1, "similar_hit": 0, "eval": 2})
+
+    def test_join_pending(self):
+        tasks = [
+            gevent.spawn(self.cache.get_or_evaluate, "m", "# T\n## 1 A", self.evaluate(delay=0.02))
+            for _ in range(3)
+        ]
+        gevent.joinall(tasks)
+        self.assertEqual([task.value for task in tasks], [(8, "detail 8")] * 3)
+        self.assertEqual(self.eval_count, 1)
+        self.assertEqual(self.cache.stats()["hit"], 2)
+
+    def test_exception(self):
+        def fail():
+            gevent.sleep(0.02)
+            raise ValueError("bad score")
+
+        tasks = [gevent.spawn(self.cache.get_or_evaluate, "m", "# T", fail)]
+        tasks.append(gevent.spawn(self.cache.get_or_evaluate, "m", "# T", self.evaluate()))
+        gevent.joinall(tasks)
+        self.assertTrue(all(isinstance(task.exception, ValueError) for task in tasks))
+        # 失败的结果不缓存，之后重新打分
+        self.assertEqual(self.cache.get_or_evaluate("m", "# T", self.evaluate())[0], 8)
+        self.assertEqual(self.eval_count, 1)
+
+    def test_min_similarity(self):
+        lines = [f"## {i} Section {i}" for i in range(10)]
+        outline = "\n".join(["# T"] + lines)
+        similar = "\n".join(["# T"] + lines[:-1] + ["## 9 Other section"])
+        different = "\n".join(["# T"] + [f"## {i} Topic {i}" for i in range(10)])
+        self.cache.get_or_evaluate("m", outline, self.evaluate(8))
+
+        self.assertEqual(self.cache.get_or_evaluate("m", similar, self.evaluate(5), min_similarity=0.9)[0], 8)
+        self.assertEqual(self.cache.get_or_evaluate("m", different, self.evaluate(5), min_similarity=0.9)[0], 5)
+        self.assertEqual(self.cache.get_or_evaluate("m", similar, self.evaluate(6))[0], 6)
+        self.assertEqual(self.cache.stats(), {"hit": 0, "similar_hit": 1, "eval": 3})
+
+    def test_pop_eval_cache(self):
+        cache = get_eval_cache("eval-task")
+        self.assertIs(get_eval_cache("eval-task"), cache)
+        self.assertIs(pop_eval_cache("eval-task"), cache)
+        self.assertIsNone(pop_eval_cache("eval-task"))
+        self.assertIsNot(get_eval_cache("eval-task"), cache)
+        pop_eval_cache("eval-task")
+
+
+class TestConvergencePolicy(unittest.TestCase):
+    """测试卷积层和自我精炼的提前结束条件"""
+
+    def test_max_score(self):
+        policy = ConvergencePolicy(max_score=10, score_tolerance=0.5)
+        self.assertIsNone(policy.get_stop_reason(None, [9.0]))
+        self.assertIn("max score", policy.get_stop_reason(None, [9.0, 9.6]))
+
+    def test_patience(self):
+        policy = ConvergencePolicy(min_improvement=0.1, patience=2)
+        self.assertIsNone(policy.get_stop_reason(None, [7.0, 7.05]))
+        self.assertIsNone(policy.get_stop_reason(None, [7.0, 7.05, 7.2]))
+        self.assertIn("score improved", policy.get_stop_reason(None, [7.0, 7.2, 7.25, 7.28]))
+        # 最高分不再提高但平均分仍在提高时继续
+        self.assertIsNone(
+            policy.get_stop_reason(None, [7.0, 7.2, 7.25, 7.28], avg_scores=[5.0, 5.5, 6.0, 6.5])
+        )
+
+    def test_disabled(self):
+        policy = ConvergencePolicy.from_config(False, max_score=10)
+        self.assertIsNone(policy.get_stop_reason(None, [10, 10, 10]))
+        policy = ConvergencePolicy.from_config({"patience": 3}, max_score=10)
+        self.assertEqual((policy.patience, policy.min_improvement, policy.enabled), (3, 0.1, True))
+
+    def test_budget(self):
+        usage_module.set_task_budget("converge-task", max_tokens=10)
+        try:
+            policy = ConvergencePolicy.from_config(False)
+            self.assertIsNone(policy.get_stop_reason("converge-task", [1.0]))
+            with usage_module.usage_scope("converge-task", "SkeletonRefineModule"):
+                usage_module.record_usage("m", 20)
+            self.assertEqual(policy.get_stop_reason("converge-task", [1.0]), "token budget exceeded")
+        finally:
+            usage_module.pop_task_usage("converge-task")
+
+
+if __name__ == "__main__":
+    unittest.main()
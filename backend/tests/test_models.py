@@ -0,0 +1,83 @@
+import unittest
+import os
+import sys
+import tempfile
+import sqlite3
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from src.common_service.models import db, Task, upgrade_schema
+
+# 新增token_usage之前的tasks表
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY,
+    phone VARCHAR(20) NOT NULL UNIQUE,
+    created_at DATETIME,
+    updated_at DATETIME,
+    remaining_uses INTEGER
+);
+CREATE TABLE tasks (
+    id INTEGER PRIMARY KEY,
+    task_id VARCHAR(36) NOT NULL UNIQUE,
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    status VARCHAR(20) NOT NULL,
+    params TEXT,
+    created_at DATETIME,
+    updated_at DATETIME,
+    start_time DATETIME,
+    end_time DATETIME,
+    execution_seconds FLOAT,
+    error TEXT,
+    expire_at DATETIME NOT NULL,
+    result_data TEXT,
+    retry_count INTEGER,
+    max_retries INTEGER
+);
+INSERT INTO users (id, phone, remaining_uses) VALUES (1, 'test_user', 10);
+INSERT INTO tasks (task_id, user_id, status, params, expire_at, retry_count, max_retries)
+VALUES ('task-1', 1, 'completed', '{"topic": "T"}', '2030-01-01 00:00:00', 0, 3);
+"""
+
+
+class TestUpgradeSchema(unittest.TestCase):
+    """测试已有数据库升级后仍可读写新增的token_usage列"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmp_dir.name, "tasks.db")
+        with sqlite3.connect(path) as conn:
+            conn.executescript(BASELINE_SCHEMA)
+
+        self.app = Flask(__name__)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(self.app)
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def test_load_baseline_task(self):
+        with self.app.app_context():
+            # 与app.py启动时相同：create_all不修改已存在的表
+            db.create_all()
+            upgrade_schema()
+            upgrade_schema()
+
+            task = Task.query.filter_by(task_id='task-1').one()
+            data = task.to_dict()
+            self.assertEqual(data['params'], {"topic": "T"})
+            self.assertNotIn('token_usage', data)
+
+            task.set_token_usage({"total_tokens": 42})
+            db.session.commit()
+            db.session.expire_all()
+            task = Task.query.filter_by(task_id='task-1').one()
+            self.assertEqual(task.to_dict()['token_usage'], {"total_tokens": 42})
+
+
+if __name__ == "__main__":
+    unittest.main()
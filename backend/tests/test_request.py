@@ -0,0 +1,646 @@
+import unittest
+import os
+import sys
+import time
+import asyncio
+import tempfile
+from unittest import mock
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gevent
+import async_d
+from request.cache import CachePolicy, ResponseCache, make_cache_key
+from request.limiter import ModelLimiter, TokenBucket, get_limiter
+from request.stream import stop_after_md_block, stop_after_tags
+from request.hedge import HedgePolicy, get_hedge_stats
+from request.router import Backend, Router
+from request.batcher import MicroBatcher
+from request.mock import MockAPIError, MockRequest, MockUsage
+from request import usage as usage_module
+from async_d.cancel import track
+from request import RequestWrapper, run_async
+from request.openai import OpenAIRequest
+from request.local import LocalRequest
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_none
+
+
+class TestResponseCache(unittest.TestCase):
+    """测试LLM响应缓存的命中、过期、淘汰和持久化"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "cache.db")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_key(self):
+        messages = [{"role": "user", "content": "hello"}]
+        key = make_cache_key("m", messages, {"temperature": 0})
+        self.assertEqual(key, make_cache_key("m", list(messages), {"temperature": 0}))
+        self.assertNotEqual(key, make_cache_key("m2", messages, {"temperature": 0}))
+        self.assertNotEqual(key, make_cache_key("m", messages, {"temperature": 1}))
+
+    def test_hit_and_persist(self):
+        cache = ResponseCache(self.path)
+        self.assertIsNone(cache.get("a"))
+        cache.set("a", "m", "response a")
+        self.assertEqual(cache.get("a"), "response a")
+        self.assertEqual((cache.hit_count, cache.miss_count), (1, 1))
+        cache.close()
+
+        cache = ResponseCache(self.path)
+        self.assertEqual(cache.get("a"), "response a")
+        self.assertEqual(cache.total_size, len("response a"))
+        cache.close()
+
+    def test_ttl(self):
+        cache = ResponseCache(self.path, ttl=0.05)
+        cache.set("a", "m", "response a")
+        self.assertEqual(cache.get("a", ttl=0), "response a")
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.total_size, 0)
+        cache.close()
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(self.path, max_size=30)
+        for key in ["a", "b", "c"]:
+            cache.set(key, "m", key * 10)
+            time.sleep(0.01)
+        # a被访问后，最久未使用的是b
+        cache.get("a")
+        cache.set("d", "m", "d" * 10)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "a" * 10)
+        self.assertEqual(cache.get("d"), "d" * 10)
+        self.assertLessEqual(cache.total_size, 30)
+        cache.close()
+
+    def test_policy_validate(self):
+        def parse(result):
+            return int(result)
+
+        policy = CachePolicy(validate=parse)
+        self.assertTrue(policy.is_valid("42"))
+        self.assertFalse(policy.is_valid("not a number"))
+        self.assertTrue(CachePolicy().is_valid("anything"))
+
+
+class TestLimiter(unittest.TestCase):
+    """测试按模型的令牌桶限流和AIMD并发调整"""
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(60)
+        self.assertEqual(bucket.reserve(60), 0)
+        # 桶已空，再预留30个需要等30秒补充
+        self.assertAlmostEqual(bucket.reserve(30), 30, delta=0.1)
+        bucket.adjust(30)
+        self.assertAlmostEqual(bucket.reserve(0), 0, delta=0.1)
+
+    def test_concurrency(self):
+        limiter = ModelLimiter("m", max_concurrency=3)
+        max_in_flight = []
+
+        def request():
+            with limiter.acquire():
+                max_in_flight.append(limiter.in_flight)
+                gevent.sleep(0.05)
+
+        gevent.joinall([gevent.spawn(request) for _ in range(9)])
+        self.assertEqual(max(max_in_flight), 3)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_rate_limit(self):
+        limiter = ModelLimiter("m", max_concurrency=8)
+        limiter.on_rate_limit(retry_after=0.1)
+        # 短时间内的多次限流只减半一次
+        limiter.on_rate_limit(retry_after=0.1)
+        self.assertEqual(limiter.limit, 4)
+        self.assertFalse(limiter._try_acquire())
+
+        start_time = time.monotonic()
+        with limiter.acquire():
+            self.assertGreaterEqual(time.monotonic() - start_time, 0.05)
+        # 成功后加性增长
+        self.assertAlmostEqual(limiter.limit, 4.25)
+
+        with self.assertRaises(ValueError):
+            with limiter.acquire():
+                raise ValueError("failed")
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_async_acquire(self):
+        limiter = ModelLimiter("m", max_concurrency=2)
+        max_in_flight = []
+
+        async def request():
+            async with limiter.async_acquire() as usage:
+                max_in_flight.append(limiter.in_flight)
+                await asyncio.sleep(0.02)
+                usage["total_tokens"] = 10
+
+        async def main():
+            await asyncio.gather(*[request() for _ in range(6)])
+
+        asyncio.run(main())
+        self.assertEqual(max(max_in_flight), 2)
+        self.assertEqual(limiter.in_flight, 0)
+
+
+class RateLimitedRequest:
+    """前几次请求失败（默认429）的后端，用于测试限流器负责的重试"""
+
+    def __init__(self, model, fail_count):
+        self.model = model
+        self.fail_count = fail_count
+        self.status_code = 429
+        self.call_count = 0
+
+    @retry(wait=wait_none(), stop=stop_after_attempt(100), retry=retry_if_exception_type(MockAPIError))
+    def completion(self, messages, **kwargs):
+        self.call_count += 1
+        if self.call_count <= self.fail_count:
+            raise MockAPIError(self.status_code, "request failed", retry_after=0.01)
+        return "answer", 1
+
+
+class TestLimiterRetry(unittest.TestCase):
+    """测试重试在限流器之外进行、先到先得和配置过滤"""
+
+    def build_wrapper(self, model, fail_count):
+        wrapper = RequestWrapper(model=model, infer_type="local", port=0)
+        wrapper.limiter = ModelLimiter(model, rpm=600, max_concurrency=8, max_attempts=3)
+        wrapper.request_pool = RateLimitedRequest(model, fail_count)
+        return wrapper
+
+    def test_retry_reserves_again(self):
+        wrapper = self.build_wrapper("retry-m", fail_count=2)
+        self.assertEqual(wrapper.completion("hello"), "answer")
+        self.assertEqual(wrapper.request_pool.call_count, 3)
+        # 每次尝试都重新预留rpm并上报限流
+        self.assertAlmostEqual(wrapper.limiter.request_bucket.tokens, 597, delta=0.5)
+        self.assertEqual(wrapper.limiter.rate_limit_count, 2)
+        self.assertEqual(wrapper.limiter.in_flight, 0)
+
+    def test_max_attempts(self):
+        wrapper = self.build_wrapper("retry-max", fail_count=100)
+        with self.assertRaises(MockAPIError):
+            wrapper.completion("hello")
+        self.assertEqual(wrapper.request_pool.call_count, 3)
+        self.assertEqual(wrapper.limiter.in_flight, 0)
+
+    def test_client_error(self):
+        wrapper = self.build_wrapper("retry-client", fail_count=100)
+        wrapper.request_pool.status_code = 400
+        with self.assertRaises(MockAPIError):
+            wrapper.completion("hello")
+        self.assertEqual(wrapper.request_pool.call_count, 1)
+        self.assertEqual(wrapper.limiter.rate_limit_count, 0)
+
+    def test_fifo(self):
+        limiter = ModelLimiter("fifo", max_concurrency=1)
+        order = []
+
+        def request(i):
+            with limiter.acquire():
+                order.append(i)
+                gevent.sleep(0.01)
+
+        greenlets = []
+        for i in range(5):
+            greenlets.append(gevent.spawn(request, i))
+            gevent.sleep(0.001)
+        gevent.joinall(greenlets)
+        self.assertEqual(order, list(range(5)))
+        self.assertEqual((limiter.in_flight, len(limiter.waiters)), (0, 0))
+
+    def test_unknown_config_keys(self):
+        old_limits = os.environ.get("LLM_RATE_LIMITS")
+        os.environ["LLM_RATE_LIMITS"] = '{"config-m": {"rpm": 60, "burst": 3}}'
+        try:
+            limiter = get_limiter("config-m", max_concurrency=4)
+        finally:
+            if old_limits is None:
+                del os.environ["LLM_RATE_LIMITS"]
+            else:
+                os.environ["LLM_RATE_LIMITS"] = old_limits
+        self.assertEqual(limiter.max_concurrency, 4)
+        self.assertEqual(limiter.request_bucket.capacity, 60)
+
+
+class TestAsyncClients(unittest.TestCase):
+    """测试事件循环结束前关闭异步连接池"""
+
+    def test_run_async(self):
+        async def open_pools():
+            openai_client = OpenAIRequest("m", base_url="http://localhost:1", api_key="k").async_client
+            local_session = LocalRequest(url="http://localhost:1/infer").async_session
+            return openai_client, local_session
+
+        openai_client, local_session = run_async(open_pools())
+        self.assertTrue(openai_client.is_closed())
+        self.assertTrue(local_session.closed)
+        self.assertEqual(len(OpenAIRequest._async_clients), 0)
+        self.assertEqual(len(LocalRequest._async_sessions), 0)
+
+
+class TestStreamStop(unittest.TestCase):
+    """测试流式请求的停止条件在增量文本上的判断"""
+
+    def feed(self, predicate, text, chunk_size=3):
+        for end in range(chunk_size, len(text) + chunk_size, chunk_size):
+            if predicate(text[:end]):
+                return text[:end]
+        return None
+
+    def test_md_block(self):
+        text = "Rationale: ...\n```suggestion\nadd a section\n```\nTrailing thoughts " * 2
+        stopped = self.feed(stop_after_md_block("suggestion"), text)
+        self.assertIn("add a section\n```", stopped)
+        self.assertLess(len(stopped), text.index("Trailing") + 3)
+        self.assertIsNone(self.feed(stop_after_md_block("markdown"), text))
+
+    def test_tags(self):
+        text = "<CONTENT>body</CONTENT><TITLE>title</TITLE> more <CONTENT>x</CONTENT> tail"
+        stopped = self.feed(stop_after_tags("TITLE", "CONTENT"), text, chunk_size=1)
+        self.assertTrue(stopped.endswith("more <CONTENT>x</CONTENT>"))
+        stopped = self.feed(stop_after_tags("SCORE"), "score <SCORE>7.5</SCORE> rest", chunk_size=4)
+        self.assertIn("</SCORE>", stopped)
+
+
+class ScheduledRequest:
+    """按顺序返回预设延迟的请求后端，用于测试对冲"""
+
+    def __init__(self, delays):
+        self.delays = list(delays)
+        self.call_count = 0
+
+    def completion(self, messages, **kwargs):
+        delay = self.delays[min(self.call_count, len(self.delays) - 1)]
+        self.call_count += 1
+        gevent.sleep(delay)
+        return f"answer after {delay}", 1
+
+
+class TestHedge(unittest.TestCase):
+    """测试超过滚动延迟分位数后的对冲请求"""
+
+    def build_wrapper(self, model, delays):
+        wrapper = RequestWrapper(model=model, infer_type="local", port=0)
+        wrapper.request_pool = ScheduledRequest(delays)
+        stats = get_hedge_stats(model)
+        for _ in range(20):
+            stats.record(0.05)
+        return wrapper, stats
+
+    def test_hedge_wins(self):
+        wrapper, stats = self.build_wrapper("hedge-win", [1.0, 0.01])
+        policy = HedgePolicy(percentile=95, budget=1, min_delay=0.05)
+        start_time = time.monotonic()
+        with usage_module.usage_scope("hedge-task", "DigestModule"):
+            result = wrapper.completion("hello", hedge=policy)
+        self.assertEqual(result, "answer after 0.01")
+        self.assertLess(time.monotonic() - start_time, 0.5)
+        self.assertEqual((stats.hedge_count, stats.hedge_win_count), (1, 1))
+        # 被取消的原请求释放了限流器
+        gevent.sleep(0)
+        self.assertEqual(wrapper.limiter.in_flight, 0)
+        # 被取消的原请求的用量和耗时同样计入
+        usage = usage_module.pop_task_usage("hedge-task").to_dict()
+        self.assertEqual(usage["calls"], 2)
+        self.assertGreater(usage["stages"]["DigestModule"]["prompt_tokens"], 0)
+        self.assertEqual(len(stats.latencies), 22)
+        self.assertGreaterEqual(max(list(stats.latencies)[-2:]), 0.05)
+
+    def test_budget(self):
+        wrapper, stats = self.build_wrapper("hedge-budget", [0.2])
+        policy = HedgePolicy(percentile=95, budget=0.1, min_delay=0.05)
+        results = [wrapper.completion("hello", hedge=policy) for _ in range(3)]
+        self.assertEqual(results, ["answer after 0.2"] * 3)
+        self.assertEqual(stats.hedge_count, 0)
+        self.assertEqual(wrapper.request_pool.call_count, 3)
+
+
+class FlakyRequest:
+    """延迟固定、可设置为总是失败的请求后端，用于测试路由"""
+
+    def __init__(self, name, delay, fail=False):
+        self.name = name
+        self.delay = delay
+        self.fail = fail
+        self.call_count = 0
+
+    def completion(self, messages, **kwargs):
+        self.call_count += 1
+        gevent.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError(f"{self.name} is down")
+        return self.name, 1
+
+
+class TestRouter(unittest.TestCase):
+    """测试多后端路由的负载分配、故障转移和摘除"""
+
+    def test_prefer_fast_backend(self):
+        fast, slow = FlakyRequest("fast", 0.001), FlakyRequest("slow", 0.02)
+        router = Router("m", [Backend("fast", fast), Backend("slow", slow)])
+        gevent.joinall([gevent.spawn(router.completion, []) for _ in range(5)])
+        for _ in range(40):
+            router.completion([])
+        self.assertGreater(fast.call_count, slow.call_count * 3)
+
+    def test_failover_and_ejection(self):
+        down, up = FlakyRequest("down", 0, fail=True), FlakyRequest("up", 0)
+        router = Router("m", [Backend("down", down), Backend("up", up)])
+        results = [router.completion([]) for _ in range(20)]
+        self.assertEqual(results, [("up", 1)] * 20)
+        # 出错后代价升高，之后很少再收到请求
+        self.assertLessEqual(down.call_count, 3)
+        self.assertEqual([b.in_flight for b in router.backends], [0, 0])
+
+    def test_ejection(self):
+        backend = Backend("b", FlakyRequest("b", 0))
+        for _ in range(3):
+            self.assertTrue(backend.is_available(time.monotonic()))
+            backend.on_failure(ConnectionError("down"))
+        self.assertFalse(backend.is_available(time.monotonic()))
+        self.assertFalse(backend.is_available(time.monotonic() + 9))
+        self.assertTrue(backend.is_available(time.monotonic() + 11))
+
+        class RateLimitError(Exception):
+            status_code = 429
+
+        backend = Backend("b", FlakyRequest("b", 0))
+        backend.on_failure(RateLimitError("quota exceeded"))
+        self.assertFalse(backend.is_available(time.monotonic()))
+
+    def test_client_error(self):
+        class BadRequestError(Exception):
+            status_code = 400
+
+        class BadRequest(FlakyRequest):
+            def completion(self, messages, **kwargs):
+                self.call_count += 1
+                raise BadRequestError("context too long")
+
+        requests = [BadRequest("a", 0), BadRequest("b", 0)]
+        router = Router("m", [Backend(r.name, r) for r in requests])
+        for _ in range(5):
+            with self.assertRaises(BadRequestError):
+                router.completion([])
+        # 请求本身的错误既不重试，也不计入后端的健康状况
+        self.assertEqual(sum(r.call_count for r in requests), 5)
+        for backend in router.backends:
+            self.assertEqual((backend.in_flight, backend.consecutive_failures), (0, 0))
+            self.assertTrue(backend.is_available(time.monotonic()))
+
+
+class RecordingRequest:
+    """记录收到的消息和参数的请求后端，用于测试前缀缓存提示"""
+
+    def __init__(self, name="recording", supports_prompt_cache_key=False):
+        self.name = name
+        self.supports_prompt_cache_key = supports_prompt_cache_key
+        self.calls = []
+
+    def completion(self, messages, **kwargs):
+        self.calls.append((messages, kwargs))
+        return self.name, 1
+
+
+class TestPrefixCache(unittest.TestCase):
+    """测试共用提示词前缀的拼接、缓存提示和路由亲和"""
+
+    def test_prefix_first(self):
+        wrapper = RequestWrapper(model="prefix-m", infer_type="local", port=0)
+        wrapper.request_pool = RecordingRequest()
+        wrapper.completion("paper a", prefix="shared outline\n")
+        wrapper.completion([{"role": "user", "content": "paper b"}], prefix="shared outline\n")
+        contents = [messages[0]["content"] for messages, _ in wrapper.request_pool.calls]
+        self.assertEqual(contents, ["shared outline\npaper a", "shared outline\npaper b"])
+        # 后端不支持时不传缓存提示
+        self.assertEqual([kwargs for _, kwargs in wrapper.request_pool.calls], [{}, {}])
+
+    def test_prompt_cache_key(self):
+        wrapper = RequestWrapper(model="prefix-m", infer_type="local", port=0)
+        wrapper.request_pool = RecordingRequest(supports_prompt_cache_key=True)
+        wrapper.completion("paper a", prefix="outline 1")
+        wrapper.completion("paper b", prefix="outline 1")
+        wrapper.completion("paper c", prefix="outline 2")
+        wrapper.completion("no prefix")
+        keys = [kwargs.get("prompt_cache_key") for _, kwargs in wrapper.request_pool.calls]
+        self.assertEqual(keys[0], keys[1])
+        self.assertNotEqual(keys[0], keys[2])
+        self.assertIsNone(keys[3])
+
+    def test_router_affinity(self):
+        requests = [RecordingRequest(f"b{i}", supports_prompt_cache_key=(i == 0)) for i in range(4)]
+        router = Router("m", [Backend(r.name, r) for r in requests])
+        chosen = {router.completion([], prompt_cache_key="prefix")[0] for _ in range(20)}
+        self.assertEqual(len(chosen), 1)
+        # 只有支持的后端收到缓存提示
+        for request in requests:
+            for _, kwargs in request.calls:
+                self.assertEqual("prompt_cache_key" in kwargs, request.supports_prompt_cache_key)
+
+
+class TestMicroBatcher(unittest.TestCase):
+    """测试并发请求合并为批量请求并按顺序分发结果"""
+
+    def setUp(self):
+        self.batches = []
+
+    def send(self, instances, params):
+        self.batches.append((list(instances), params))
+        gevent.sleep(0.01)
+        if params.get("fail"):
+            raise ConnectionError("server down")
+        return [f"answer {instance}" for instance in instances]
+
+    def test_coalesce(self):
+        batcher = MicroBatcher(self.send, max_batch_size=4, max_wait=0.05)
+        greenlets = [gevent.spawn(batcher.submit, i, {}) for i in range(10)]
+        gevent.joinall(greenlets)
+        self.assertEqual([g.value for g in greenlets], [f"answer {i}" for i in range(10)])
+        self.assertEqual([len(instances) for instances, _ in self.batches], [4, 4, 2])
+
+    def test_params_and_wait(self):
+        batcher = MicroBatcher(self.send, max_batch_size=16, max_wait=0.02)
+        start_time = time.monotonic()
+        greenlets = [
+            gevent.spawn(batcher.submit, i, {"temperature": i % 2}) for i in range(6)
+        ]
+        gevent.joinall(greenlets)
+        self.assertLess(time.monotonic() - start_time, 0.5)
+        # 参数不同的请求不能合并
+        self.assertEqual(
+            sorted((params["temperature"], instances) for instances, params in self.batches),
+            [(0, [0, 2, 4]), (1, [1, 3, 5])],
+        )
+
+    def test_failure(self):
+        batcher = MicroBatcher(self.send, max_batch_size=16, max_wait=0.01)
+        greenlets = [gevent.spawn(batcher.submit, i, {"fail": True}) for i in range(3)]
+        gevent.joinall(greenlets)
+        self.assertTrue(all(isinstance(g.exception, ConnectionError) for g in greenlets))
+
+    def test_cancelled_caller(self):
+        batcher = MicroBatcher(self.send, max_batch_size=2, max_wait=1)
+        first = gevent.spawn(batcher.submit, "a", {})
+        gevent.sleep(0)
+        second = gevent.spawn(batcher.submit, "b", {})
+        gevent.sleep(0.001)
+        # 批次已发出后取消一个调用方，另一个仍能拿到结果
+        first.kill()
+        self.assertEqual(second.get(timeout=1), "answer b")
+
+    def test_local_default(self):
+        # 默认不合并，需要显式打开
+        with mock.patch.dict(os.environ):
+            os.environ.pop("LOCAL_MAX_BATCH_SIZE", None)
+            self.assertIsNone(LocalRequest(url="http://localhost:1/batch-off").batcher)
+            os.environ["LOCAL_MAX_BATCH_SIZE"] = "4"
+            self.assertEqual(LocalRequest(url="http://localhost:1/batch-on").batcher.max_batch_size, 4)
+
+
+class TestMockRequest(unittest.TestCase):
+    """测试离线模拟后端按提示词类型生成可解析的输出"""
+
+    def setUp(self):
+        from src.prompts import get_prompts
+
+        self.prompts = get_prompts("en")
+        self.profile = {"ttft_mean": 0, "tokens_per_second": 0, "seed": 1}
+
+    def ask(self, request, prompt):
+        return request.completion([{"role": "user", "content": prompt}])
+
+    def test_prompt_families(self):
+        request = MockRequest(profile=self.profile)
+        outline = "# T\n## 1 Intro\nDigest Construction: \nx\nDigest Analysis: \ny"
+        name, fields = request.matcher.match(
+            self.prompts.OUTLINE_ENTROPY_PROMPT.format(title="T", outline=outline)
+        )
+        self.assertEqual(name, "OUTLINE_ENTROPY_PROMPT")
+        self.assertEqual(fields["title"], "T")
+        answer, token_usage = self.ask(
+            request, self.prompts.OUTLINE_ENTROPY_PROMPT.format(title="T", outline=outline)
+        )
+        self.assertRegex(answer, r"<SCORE>\s*\d+(\.\d+)?\s*</SCORE>")
+        self.assertGreater(token_usage.prompt_tokens, 0)
+        self.assertGreater(token_usage.completion_tokens, 0)
+
+    def test_outline_and_digest_parse(self):
+        from src.data_structure.skeleton import Skeleton
+        from src.data_structure.digest import Digest
+
+        request = MockRequest(profile=self.profile)
+        raw_outline, _ = self.ask(
+            request,
+            self.prompts.INIT_OUTLINE_PROMPT.format(
+                title="T", abstracts="Bibkey: 'a1':\nAbstract:\nfoo"
+            ),
+        )
+        outline = Skeleton(["a1"]).parse_raw_skeleton("T", raw_outline)
+        self.assertGreater(len(outline.root.all_section), 1)
+
+        prompt = self.prompts.SINGLE_DIGEST_PREFIX_PROMPT.format(
+            survey_outline=outline.all_skeleton(construction=True, with_index=True),
+            outline_example=outline.all_skeleton(with_digest_placeholder=True, with_index=True),
+        ) + self.prompts.SINGLE_DIGEST_PAPER_PROMPT.format(paper_bibkey="a1", paper_content="cc")
+        raw_digest, _ = self.ask(request, prompt)
+        digest = Digest([{"txt": "cc", "bibkey": "a1", "title": "A"}], "T")
+        digest.parse_suggestion(raw_digest, "a1")
+        digest.parse_raw_digest(raw_digest, outline)
+        self.assertEqual(len(digest.root.all_section), len(outline.root.all_section))
+
+    def test_errors_retried(self):
+        request = MockRequest(profile=dict(self.profile, error_rate=0.3, rate_limit_rate=0.2))
+        completion = MockRequest.completion.retry_with(wait=wait_none())
+        for _ in range(10):
+            answer, _ = completion(request, [{"role": "user", "content": "hello"}])
+            self.assertTrue(answer)
+        # 部分请求失败后重试
+        self.assertGreater(request.request_count, 10)
+        with self.assertRaises(MockAPIError):
+            MockRequest(profile=dict(self.profile, error_rate=1))._generate([])
+
+    def test_stream(self):
+        request = MockRequest(profile=self.profile)
+        messages = [{"role": "user", "content": "hello"}]
+        chunks = list(request.stream_completion(messages))
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(usage is None for _, usage in chunks[:-1]))
+        self.assertIsNotNone(chunks[-1][1])
+        answer, _ = MockRequest(profile=self.profile).completion(messages)
+        self.assertEqual("".join(chunk for chunk, _ in chunks), answer)
+
+
+class TestUsage(unittest.TestCase):
+    """测试按任务和阶段累计token用量及预算"""
+
+    def setUp(self):
+        self.wrapper = RequestWrapper(model="usage-m", infer_type="local", port=0)
+        self.wrapper.request_pool = self
+
+    def completion(self, messages, **kwargs):
+        return "answer", MockUsage(100, 20)
+
+    def run_in(self, task_id, stage, count=1):
+        def work():
+            for _ in range(count):
+                self.wrapper.completion("hello")
+
+        greenlet = gevent.spawn(work)
+        track(greenlet, task_id, stage)
+        greenlet.join()
+
+    def test_task_and_stage(self):
+        self.run_in("usage-task", "DigestModule", 2)
+        self.run_in("usage-task", "SkeletonRefineModule")
+        with usage_module.usage_scope("usage-task", "TopicSearch"):
+            self.wrapper.completion("hello")
+        usage = usage_module.pop_task_usage("usage-task").to_dict()
+        self.assertEqual(usage["calls"], 4)
+        self.assertEqual(usage["total_tokens"], 480)
+        self.assertEqual(usage["stages"]["DigestModule"]["prompt_tokens"], 200)
+        self.assertEqual(set(usage["stages"]), {"DigestModule", "SkeletonRefineModule", "TopicSearch"})
+        self.assertEqual(usage["models"]["usage-m"]["completion_tokens"], 80)
+        # 不属于任务的请求只计入总量
+        total_calls = usage_module.get_total_usage().calls
+        self.wrapper.completion("hello")
+        self.assertEqual(usage_module.get_total_usage().calls, total_calls + 1)
+
+    def test_budget(self):
+        usage_module.set_task_budget("budget-task", max_tokens=300)
+        self.run_in("budget-task", "SkeletonRefineModule", 2)
+        self.assertFalse(usage_module.is_over_budget("budget-task"))
+        self.run_in("budget-task", "SkeletonRefineModule")
+        self.assertTrue(usage_module.is_over_budget("budget-task"))
+        self.assertFalse(usage_module.is_over_budget("other-task"))
+        usage_module.pop_task_usage("budget-task")
+
+    def test_total_only_usage(self):
+        # 只有总量的用量（Google、提前停止的流）按估算的提示词长度拆分
+        messages = [{"role": "user", "content": "a" * 400}]
+        self.assertEqual(usage_module.split_tokens(150, messages), (104, 46))
+        self.assertEqual(usage_module.split_tokens(None, messages), (0, 0))
+
+    def test_bounded(self):
+        old_max = usage_module.MAX_TASK_NUM
+        usage_module.MAX_TASK_NUM = 3
+        try:
+            for i in range(5):
+                self.run_in(f"bounded-{i}", "DigestModule")
+            self.assertIsNone(usage_module.get_task_usage("bounded-0"))
+            self.assertIsNotNone(usage_module.get_task_usage("bounded-4"))
+        finally:
+            usage_module.MAX_TASK_NUM = old_max
+            for i in range(5):
+                usage_module.pop_task_usage(f"bounded-{i}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import unittest
+import os
+import re
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from src.hidden.basic_modules.group_module import GroupModule
+from src.utils.process_str import split_by_sections
+from src.utils.text_cluster import balanced_kmeans, tfidf_vectors
+from src.utils.tokenizer import count_tokens
+
+TOPICS = [
+    "retrieval augmented generation dense retriever passage index",
+    "protein folding structure prediction amino acid residue",
+    "reinforcement learning policy gradient reward agent",
+]
+
+
+def strip_whitespace(text):
+    return re.sub(r"\s+", "", text)
+
+
+class TestSplitBySections(unittest.TestCase):
+    """测试按章节切分长论文：每块不超过max_tokens，且不丢失内容"""
+
+    def setUp(self):
+        self.sections = [
+            f"## {i} Section {i}\n" + "\n\n".join(
+                " ".join(f"word{i}x{j}x{k}" for k in range(20)) for j in range(3)
+            )
+            for i in range(4)
+        ]
+        self.content = "# Paper\n" + "\n".join(self.sections)
+
+    def check(self, chunks, max_tokens):
+        for chunk in chunks:
+            self.assertLessEqual(count_tokens(chunk), max_tokens)
+        self.assertEqual(strip_whitespace("".join(chunks)), strip_whitespace(self.content))
+
+    def test_short(self):
+        self.assertEqual(split_by_sections(self.content, 100000), [self.content])
+
+    def test_headings(self):
+        max_tokens = count_tokens(self.sections[0]) + 5
+        chunks = split_by_sections(self.content, max_tokens)
+        self.check(chunks, max_tokens)
+        self.assertGreater(len(chunks), 1)
+        # 每个章节都能放进一块时，只在标题处切分
+        for chunk in chunks[1:]:
+            self.assertTrue(chunk.startswith("## "))
+
+    def test_long_section(self):
+        max_tokens = count_tokens(self.sections[0]) // 2
+        chunks = split_by_sections(self.content, max_tokens)
+        self.check(chunks, max_tokens)
+        self.assertGreater(len(chunks), len(self.sections))
+
+    def test_long_paragraph(self):
+        self.content = "# Paper\n" + " ".join(f"token{i}" for i in range(500))
+        chunks = split_by_sections(self.content, 50)
+        self.check(chunks, 50)
+        self.assertGreaterEqual(len(chunks), count_tokens(self.content) // 50)
+
+
+class TestTextCluster(unittest.TestCase):
+    """测试按TF-IDF相似度分组论文：组大小不超过digest_batch，同主题的论文分在一组"""
+
+    def setUp(self):
+        self.module = GroupModule(
+            {"neuron": {"model": "mock", "infer_type": "mock"}}, "similarity", digest_batch=4
+        )
+
+    def build_papers(self, per_topic=4):
+        return [
+            {"title": f"{topic.split()[0]} paper {i}", "abstract": topic, "txt": f"{topic} {i}", "topic": t}
+            for i in range(per_topic)
+            for t, topic in enumerate(TOPICS)
+        ]
+
+    def test_tfidf_vectors(self):
+        vectors = tfidf_vectors(TOPICS * 2)
+        self.assertEqual(vectors.shape[0], 6)
+        np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1, rtol=1e-5)
+        self.assertAlmostEqual(float(vectors[0] @ vectors[3]), 1, places=5)
+        self.assertAlmostEqual(float(vectors[0] @ vectors[1]), 0, places=5)
+
+    def test_capacity(self):
+        vectors = tfidf_vectors([f"{TOPICS[0]} {i}" for i in range(10)] + [TOPICS[1]] * 2)
+        labels = balanced_kmeans(vectors, 4, 3)
+        self.assertEqual(len(labels), 12)
+        self.assertLessEqual(max(np.bincount(labels)), 3)
+
+    def test_same_topic(self):
+        papers = self.build_papers()
+        groups = list(self.module._similarity_group_papers(papers, 4))
+        self.assertEqual(sorted(len(group) for group in groups), [4, 4, 4])
+        for group in groups:
+            self.assertEqual(len({paper["topic"] for paper in group}), 1)
+
+    def test_empty_vocabulary(self):
+        # 没有任何词出现在两篇以上的论文中，所有论文仍然分到组里
+        papers = [{"title": f"t{i}", "abstract": "", "txt": f"unique{i}"} for i in range(10)]
+        groups = list(self.module._similarity_group_papers(papers, 4))
+        titles = [paper["title"] for group in groups for paper in group]
+        self.assertEqual(sorted(titles), sorted(paper["title"] for paper in papers))
+        self.assertTrue(all(len(group) <= 4 for group in groups))
+
+    def test_missing_text(self):
+        papers = self.build_papers()
+        papers[0]["txt"] = None
+        papers[1]["abstract"] = None
+        del papers[2]["txt"]
+        groups = list(self.module._similarity_group_papers(papers, 4))
+        self.assertEqual(sum(len(group) for group in groups), len(papers))
+        self.assertTrue(all(len(group) <= 4 for group in groups))
+
+
+if __name__ == "__main__":
+    unittest.main()